@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Almacén de Facturas PDF
+Organiza facturas_pdf/ en directorios diarios (AAAA/MM/DD) y empaqueta los días
+antiguos en un archivo DD.pack con índice de desplazamientos (DD.idx), de modo
+que cada PDF se puede leer con un seek sin desempaquetar
+
+Los pendientes generados antes de migrar siguen apuntando a la ruta plana
+(facturas_pdf/factura_X.pdf); esas rutas se buscan por nombre en los días
+
+Uso: python3 almacen_facturas.py [--empaquetar] [--contar] [--migrar]
+"""
+
+import csv
+import datetime
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config_paths import PDF_STORAGE_CONFIG, get_path
+from retencion import ArtifactManifest
+
+
+class InvoiceStore:
+    """Almacén de PDFs particionado por fecha con paquetes diarios"""
+
+    def __init__(self, root: Optional[str] = None, config: Dict = PDF_STORAGE_CONFIG):
+        self.root = Path(root) if root else get_path('pdf')
+        self.config = config
+        # índice -> ((st_mtime_ns, st_size), entradas): otro proceso puede reescribirlo
+        self._indexes: Dict[Path, Tuple[Tuple[int, int], Dict[str, Tuple[int, int]]]] = {}
+        self._migrated: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    # --- Ubicación -------------------------------------------------------
+
+    def shard_dir(self, day: datetime.date) -> Path:
+        """Directorio diario de un día (facturas_pdf/AAAA/MM/DD)"""
+        return self.root / f"{day:%Y}" / f"{day:%m}" / f"{day:%d}"
+
+    def path_for(self, invoice_id: str, day: Optional[datetime.date] = None) -> Path:
+        """Ruta de una factura dentro del directorio diario"""
+        return self.shard_dir(day or datetime.date.today()) / f"factura_{invoice_id}.pdf"
+
+    def _bundle_files(self, day_dir: Path) -> Tuple[Path, Path]:
+        """Paquete e índice que sustituyen a un directorio diario"""
+        return (day_dir.with_name(day_dir.name + self.config['pack_extension']),
+                day_dir.with_name(day_dir.name + self.config['index_extension']))
+
+    def _day_dirs(self) -> List[Path]:
+        """Directorios diarios existentes (sin recorrer su contenido)"""
+        return sorted(p for p in self.root.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]') if p.is_dir())
+
+    @staticmethod
+    def _day_of(day_dir: Path) -> Optional[datetime.date]:
+        try:
+            return datetime.date(int(day_dir.parent.parent.name), int(day_dir.parent.name), int(day_dir.name))
+        except ValueError:
+            return None
+
+    # --- Lectura ---------------------------------------------------------
+
+    def _load_index(self, index_file: Path) -> Dict[str, Tuple[int, int]]:
+        """Carga el índice nombre -> (offset, longitud) de un paquete
+
+        Se cachea mientras el archivo no cambie (mtime y tamaño); un día aún sin
+        paquete no se cachea, porque el cron puede empaquetarlo en otro proceso.
+        """
+        try:
+            st = index_file.stat()
+        except FileNotFoundError:
+            return {}
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._indexes.get(index_file)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            index: Dict[str, Tuple[int, int]] = {}
+            with open(index_file, 'r', encoding='utf-8', newline='') as f:
+                for name, offset, length in csv.reader(f):
+                    index[name] = (int(offset), int(length))
+            self._indexes[index_file] = (version, index)
+            return index
+
+    def _locate(self, pdf_path: str) -> Optional[Tuple[Path, int, int]]:
+        """Busca un PDF empaquetado a partir de su ruta original"""
+        path = Path(pdf_path)
+        bundle, index_file = self._bundle_files(path.parent)
+        entry = self._load_index(index_file).get(path.name)
+        if entry is None:
+            return None
+        return bundle, entry[0], entry[1]
+
+    def _find_migrated(self, name: str) -> Optional[str]:
+        """Ruta diaria de un PDF migrado del formato plano (el día más antiguo que lo tenga)"""
+        days = {day_dir: day_dir / name for day_dir in self._day_dirs()}
+        for index_file in self.root.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/*' + self.config['index_extension']):
+            day_dir = index_file.with_name(index_file.name[:-len(self.config['index_extension'])])
+            if name in self._load_index(index_file):
+                days.setdefault(day_dir, day_dir / name)
+        for day_dir in sorted(days):
+            candidate = days[day_dir]
+            if candidate.exists() or self._locate(str(candidate)) is not None:
+                return str(candidate)
+        return None
+
+    def _resolve(self, pdf_path: str) -> str:
+        """Traduce una ruta plana ya migrada a su ruta diaria; las demás no cambian"""
+        if os.path.exists(pdf_path) or os.path.abspath(os.path.dirname(pdf_path)) != os.path.abspath(self.root):
+            return pdf_path
+        name = os.path.basename(pdf_path)
+        with self._lock:
+            migrated = self._migrated.get(name)
+        # La ruta recordada deja de valer si el día se empaquetó o se eliminó
+        if migrated is not None and (os.path.exists(migrated) or self._locate(migrated) is not None):
+            return migrated
+        migrated = self._find_migrated(name)
+        if migrated is None:
+            return pdf_path
+        with self._lock:
+            self._migrated[name] = migrated
+        return migrated
+
+    def exists(self, pdf_path: str) -> bool:
+        """Indica si el PDF existe suelto o dentro de un paquete diario"""
+        pdf_path = self._resolve(pdf_path)
+        return os.path.exists(pdf_path) or self._locate(pdf_path) is not None
+
+    def size(self, pdf_path: str) -> int:
+        """Tamaño en bytes del PDF"""
+        pdf_path = self._resolve(pdf_path)
+        if os.path.exists(pdf_path):
+            return os.path.getsize(pdf_path)
+        located = self._locate(pdf_path)
+        if located is None:
+            raise FileNotFoundError(pdf_path)
+        return located[2]
+
+    def mtime(self, pdf_path: str) -> float:
+        """Última modificación del PDF suelto o, si ya se empaquetó, del paquete"""
+        pdf_path = self._resolve(pdf_path)
+        if os.path.exists(pdf_path):
+            return os.path.getmtime(pdf_path)
+        located = self._locate(pdf_path)
+        if located is None:
+            raise FileNotFoundError(pdf_path)
+        return os.path.getmtime(located[0])
+
+    def read_bytes(self, pdf_path: str) -> bytes:
+        """Lee un PDF suelto o, si ya se empaquetó, mediante seek en el paquete"""
+        pdf_path = self._resolve(pdf_path)
+        if os.path.exists(pdf_path):
+            with open(pdf_path, 'rb') as f:
+                return f.read()
+        located = self._locate(pdf_path)
+        if located is None:
+            raise FileNotFoundError(pdf_path)
+        bundle, offset, length = located
+        with open(bundle, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    # --- Mantenimiento ---------------------------------------------------
+
+    def pack_day(self, day_dir: Path) -> int:
+        """Empaqueta los PDFs de un directorio diario y elimina los sueltos"""
+        bundle, index_file = self._bundle_files(day_dir)
+        pdfs = sorted(day_dir.glob('factura_*.pdf'))
+
+        index = dict(self._load_index(index_file))
+        packed = []
+        with open(bundle, 'ab') as out:
+            offset = out.tell()
+            for pdf in pdfs:
+                data = pdf.read_bytes()
+                out.write(data)
+                index[pdf.name] = (offset, len(data))
+                offset += len(data)
+                packed.append(pdf)
+            out.flush()
+            os.fsync(out.fileno())
+
+        tmp_index = index_file.with_name(index_file.name + '.tmp')
+        with open(tmp_index, 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerows((name, off, length) for name, (off, length) in index.items())
+        os.replace(tmp_index, index_file)
+        shutil.rmtree(day_dir)
+        return len(packed)
+
+    def pack_expired(self, today: Optional[datetime.date] = None) -> Dict[str, int]:
+        """Empaqueta los directorios diarios con más de 'pack_after_days' días"""
+        today = today or datetime.date.today()
+        cutoff = today - datetime.timedelta(days=self.config['pack_after_days'])
+        stats = {'dias': 0, 'facturas': 0}
+        manifest = ArtifactManifest()
+
+        for day_dir in self._day_dirs():
+            day = self._day_of(day_dir)
+            if day is None or day >= cutoff:
+                continue
+            stats['facturas'] += self.pack_day(day_dir)
+            stats['dias'] += 1
+
+            # Los paquetes heredan la fecha del día para que la retención los trate igual
+            created = datetime.datetime.combine(day, datetime.time()).timestamp()
+            manifest.register_many((str(path), 'pdf', created) for path in self._bundle_files(day_dir))
+
+        return stats
+
+    def count(self) -> int:
+        """Cuenta las facturas sueltas y empaquetadas sin listar todo el árbol"""
+        total = 0
+        for day_dir in self._day_dirs():
+            total += sum(1 for _ in day_dir.glob('factura_*.pdf'))
+        for index_file in self.root.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/*' + self.config['index_extension']):
+            total += len(self._load_index(index_file))
+        # PDFs del formato plano anterior aún no migrados
+        total += sum(1 for _ in self.root.glob('factura_*.pdf'))
+        return total
+
+    def migrate_flat(self) -> int:
+        """Mueve los PDFs del directorio plano a su directorio diario (por mtime)
+
+        Las rutas nuevas se registran en el manifiesto con la fecha original para
+        que la retención las encuentre; las entradas planas caducan solas.
+        """
+        moved = []
+        for pdf in self.root.glob('factura_*.pdf'):
+            mtime = pdf.stat().st_mtime
+            target = self.shard_dir(datetime.date.fromtimestamp(mtime))
+            target.mkdir(parents=True, exist_ok=True)
+            os.replace(pdf, target / pdf.name)
+            moved.append((str(target / pdf.name), 'pdf', mtime))
+        for stray in self.root.glob('factura_*.out'):
+            stray.unlink()
+        ArtifactManifest().register_many(moved)
+        with self._lock:
+            self._migrated = {}
+        return len(moved)
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    store = InvoiceStore()
+
+    if '--migrar' in args:
+        print(f"PDFs migrados al formato por fecha: {store.migrate_flat()}")
+
+    if '--empaquetar' in args:
+        stats = store.pack_expired()
+        print(f"Días empaquetados: {stats['dias']} ({stats['facturas']} facturas)")
+
+    if '--contar' in args:
+        print(store.count())
+
+
+if __name__ == "__main__":
+    main()
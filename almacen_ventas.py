@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Almacén Columnar de Ventas
+Cada lote de compras (datos/compras_lote_*.csv) se guarda en datos/ventas/ como
+columnas tipadas (array): monto en enteros de 64 bits y fecha, ciudad, tipo y
+estado de pago como códigos sobre un diccionario por lote. Junto a las
+columnas se guardan los agregados del lote por (día, ciudad, pago, estado), de
+modo que los totales de meses de lotes salen de sumar esos agregados sin
+releer ningún CSV
+
+Un lote se convierte una sola vez (o de nuevo si el CSV cambió) y su columna
+se conserva aunque la retención borre el CSV original
+
+Uso: python3 almacen_ventas.py [--dia AAAA-MM-DD] [--por ciudad,pago,estado,dia]
+"""
+
+import csv
+import datetime
+import glob
+import json
+import os
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config_paths import get_path
+
+# Dimensiones por las que se agrega, en el orden de la clave de los agregados
+DIMENSIONS = ('dia', 'ciudad', 'pago', 'estado')
+# Columna del CSV de compras de cada dimensión
+SOURCE_COLUMNS = {'dia': 'fecha_emision', 'ciudad': 'ciudad', 'pago': 'pago', 'estado': 'estado_pago'}
+# Tipo de array de cada columna guardada
+COLUMN_TYPES = {'monto': 'q', 'dia': 'H', 'ciudad': 'H', 'pago': 'H', 'estado': 'H'}
+EXTENSION = '.col'
+
+
+class SalesBatch:
+    """Un lote convertido: metadatos, diccionarios y agregados; columnas bajo demanda"""
+
+    def __init__(self, path: Path, meta: Dict, data_offset: int):
+        self.path = path
+        self.meta = meta
+        self.data_offset = data_offset
+
+    @property
+    def rows(self) -> int:
+        return self.meta['filas']
+
+    def aggregates(self) -> Iterable[Tuple[Tuple[str, ...], int, int]]:
+        """(valores de DIMENSIONS, cantidad de compras, monto) por grupo"""
+        dictionaries = [self.meta['diccionarios'][name] for name in DIMENSIONS]
+        for *codes, count, amount in self.meta['agregados']:
+            yield tuple(values[code] for values, code in zip(dictionaries, codes)), count, amount
+
+    def columns(self) -> Dict[str, array]:
+        """Lee todas las columnas del lote"""
+        result = {}
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_offset)
+            for name, (typecode, size) in self.meta['columnas'].items():
+                column = array(typecode)
+                column.frombytes(f.read(size))
+                result[name] = column
+        return result
+
+
+class SalesStore:
+    """Lotes de compras en formato columnar con agregados por lote"""
+
+    def __init__(self, root: Optional[str] = None, sources_dir: Optional[str] = None):
+        self.root = Path(root) if root else get_path('sales_store')
+        self.sources_dir = Path(sources_dir) if sources_dir else get_path('data')
+        self._loaded: Dict[Path, Tuple[float, SalesBatch]] = {}
+
+    def _batch_path(self, source: str) -> Path:
+        return self.root / (Path(source).stem + EXTENSION)
+
+    @staticmethod
+    def _read_meta(path: Path) -> Optional[SalesBatch]:
+        try:
+            with open(path, 'rb') as f:
+                first = f.readline()
+                return SalesBatch(path, json.loads(first.decode('utf-8')), len(first))
+        except (OSError, ValueError):
+            return None
+
+    # --- Conversión ------------------------------------------------------
+
+    def refresh(self) -> int:
+        """Convierte los lotes nuevos o modificados; devuelve cuántos se convirtieron"""
+        converted = 0
+        for source in sorted(glob.glob(str(self.sources_dir / 'compras_lote_*.csv'))):
+            st = os.stat(source)
+            batch = self._read_meta(self._batch_path(source))
+            if batch is not None and batch.meta['mtime'] == st.st_mtime and batch.meta['tamano'] == st.st_size:
+                continue
+            self.ingest(source)
+            converted += 1
+        return converted
+
+    def ingest(self, source: str) -> SalesBatch:
+        """Convierte un CSV de compras a columnas y agregados"""
+        st = os.stat(source)
+        dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in DIMENSIONS}
+        columns = {name: array(typecode) for name, typecode in COLUMN_TYPES.items()}
+        invalid = 0
+
+        with open(source, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                amount = (row.get('monto') or '').strip()
+                if not amount.isdigit():
+                    invalid += 1
+                    continue
+                columns['monto'].append(int(amount))
+                for name in DIMENSIONS:
+                    value = (row.get(SOURCE_COLUMNS[name]) or '').strip()
+                    codes = dictionaries[name]
+                    columns[name].append(codes.setdefault(value, len(codes)))
+
+        # Agregados del lote: una pasada sobre las columnas de códigos
+        counts: Counter = Counter()
+        amounts: Counter = Counter()
+        keys = list(zip(*(columns[name] for name in DIMENSIONS)))
+        counts.update(keys)
+        for key, amount in zip(keys, columns['monto']):
+            amounts[key] += amount
+
+        meta = {
+            'fuente': os.path.basename(source),
+            'mtime': st.st_mtime,
+            'tamano': st.st_size,
+            'filas': len(columns['monto']),
+            'invalidas': invalid,
+            'diccionarios': {name: list(dictionaries[name]) for name in DIMENSIONS},
+            'columnas': {name: [column.typecode, len(column) * column.itemsize] for name, column in columns.items()},
+            'agregados': [[*key, counts[key], amounts[key]] for key in counts],
+        }
+
+        path = self._batch_path(source)
+        self.root.mkdir(parents=True, exist_ok=True)
+        header = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        tmp_path = path.with_suffix(EXTENSION + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for column in columns.values():
+                column.tofile(f)
+        os.replace(tmp_path, path)
+        return SalesBatch(path, meta, len(header))
+
+    # --- Consultas -------------------------------------------------------
+
+    def batches(self) -> List[SalesBatch]:
+        """Lotes convertidos; los metadatos ya leídos se reutilizan si el archivo no cambió"""
+        result = []
+        for path in sorted(self.root.glob('*' + EXTENSION)):
+            mtime = path.stat().st_mtime
+            cached = self._loaded.get(path)
+            if cached is None or cached[0] != mtime:
+                batch = self._read_meta(path)
+                if batch is None:
+                    continue
+                cached = self._loaded[path] = (mtime, batch)
+            result.append(cached[1])
+        return result
+
+    def totals(self, by: Tuple[str, ...] = (), day: Optional[str] = None,
+               since: Optional[str] = None) -> Dict[Tuple[str, ...], Tuple[int, int]]:
+        """Compras y monto agrupados por las dimensiones 'by'
+
+        'day' limita a un día (AAAA-MM-DD) y 'since' a ese día y posteriores.
+        Se suman los agregados de cada lote, sin leer las columnas.
+        """
+        positions = [DIMENSIONS.index(name) for name in by]
+        result: Dict[Tuple[str, ...], List[int]] = {}
+        for batch in self.batches():
+            days = batch.meta['diccionarios']['dia']
+            if day is not None and day not in days:
+                continue
+            if since is not None and max(days, default='') < since:
+                continue
+            for values, count, amount in batch.aggregates():
+                if day is not None and values[0] != day:
+                    continue
+                if since is not None and values[0] < since:
+                    continue
+                group = result.setdefault(tuple(values[p] for p in positions), [0, 0])
+                group[0] += count
+                group[1] += amount
+        return {key: (count, amount) for key, (count, amount) in result.items()}
+
+    def daily_summary(self, day: Optional[str] = None) -> Dict:
+        """Totales de un día para el reporte diario"""
+        day = day or datetime.date.today().isoformat()
+        self.refresh()
+        overall = self.totals(day=day).get((), (0, 0))
+        by_payment = self.totals(('pago',), day=day)
+        return {
+            'compras': overall[0],
+            'monto': overall[1],
+            'pagos_completos': by_payment.get(('Pago completo',), (0, 0))[0],
+            'por_ciudad': self.totals(('ciudad',), day=day),
+            'por_pago': by_payment,
+            'por_estado': self.totals(('estado',), day=day),
+        }
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    store = SalesStore()
+    converted = store.refresh()
+    if converted:
+        print(f"Lotes convertidos: {converted}")
+
+    day = args[args.index('--dia') + 1] if '--dia' in args else None
+    by = tuple(args[args.index('--por') + 1].split(',')) if '--por' in args else ()
+    unknown = [name for name in by if name not in DIMENSIONS]
+    if unknown:
+        print(f"Error: dimensiones desconocidas: {', '.join(unknown)} (use {', '.join(DIMENSIONS)})")
+        sys.exit(1)
+
+    for key, (count, amount) in sorted(store.totals(by, day=day).items()):
+        label = ' / '.join(key) or 'Total'
+        print(f"{label}: {count} compras, L{amount:,}")
+
+
+if __name__ == "__main__":
+    main()
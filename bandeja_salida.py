@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bandeja de Salida de Mensajes
+Separa la construcción de los correos de su entrega: un grupo de procesos arma
+cada mensaje completo (RFC 5322, con el PDF en base64 y fines de línea CRLF)
+y lo deja en temp/bandeja_salida/ con el formato de un Maildir:
+
+  tmp/   mensajes en escritura
+  new/   <id_factura>.eml listos para enviar (varias facturas: id1+id2.eml)
+
+Los hilos de entrega del enviador solo leen esos bytes y los pasan al
+servidor, así que construcción y envío escalan por separado. Un mensaje que
+falla queda en new/ y el siguiente intento lo reutiliza sin reconstruirlo
+si va al mismo destinatario y es posterior a todos sus PDFs (una factura
+regenerada se vuelve a adjuntar); uno enviado se elimina
+
+Lo usa enviador.py con SPOOL_CONFIG['enabled'] o --bandeja
+Uso: python3 bandeja_salida.py [--estado] [--purgar]
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from email.parser import BytesHeaderParser
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from almacen_facturas import InvoiceStore
+from config_paths import CLEANUP_CONFIG, SPOOL_CONFIG, get_path
+
+EXTENSION = '.eml'
+
+# Constructor de mensajes de cada proceso de la bandeja (ver _init_builder)
+_builder = None
+
+
+def _init_builder(smtp_config):
+    """Inicializa el constructor de mensajes en un proceso de la bandeja"""
+    global _builder
+    # Importación diferida: enviador importa este módulo
+    from enviador import EmailMessageBuilder
+    _builder = EmailMessageBuilder(smtp_config)
+
+
+def _build_message(root: str, name: str, recipient: str, invoices: List[Tuple[str, str]]) -> Optional[str]:
+    """Construye y deja en new/ un mensaje; devuelve un error o None"""
+    if len(invoices) == 1:
+        pdf_path, invoice_id = invoices[0]
+        message = _builder.create_invoice_message(recipient, pdf_path, invoice_id)
+    else:
+        message = _builder.create_multi_invoice_message(recipient, invoices)
+    if message is None:
+        return "Error creando mensaje"
+
+    # Listo para el servidor: fines de línea CRLF como en la conversación SMTP
+    data = message.as_bytes(policy=message.policy.clone(linesep='\r\n'))
+    tmp_path = os.path.join(root, 'tmp', f"{name}.{os.getpid()}{EXTENSION}")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, os.path.join(root, 'new', name + EXTENSION))
+    return None
+
+
+class MessageSpool:
+    """Mensajes construidos en procesos aparte y entregados desde archivos"""
+
+    def __init__(self, root: Optional[str] = None, config: Dict = SPOOL_CONFIG,
+                 invoice_store: Optional[InvoiceStore] = None):
+        self.root = Path(root) if root else get_path('spool')
+        self.invoice_store = invoice_store or InvoiceStore()
+        self.workers = max(1, int(config.get('build_workers', 0)) or os.cpu_count() or 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._builds: Dict[str, Future] = {}
+        self.reused = 0
+
+    @staticmethod
+    def name_for(invoice_ids: List[str]) -> str:
+        return '+'.join(invoice_ids)
+
+    def path_for(self, name: str) -> Path:
+        return self.root / 'new' / (name + EXTENSION)
+
+    def start(self, smtp_config):
+        """Abre el grupo de procesos si no está abierto (spawn: el enviador ya tiene hilos en marcha)"""
+        if self._pool is not None:
+            return
+        (self.root / 'tmp').mkdir(parents=True, exist_ok=True)
+        (self.root / 'new').mkdir(parents=True, exist_ok=True)
+        self.purge()
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_builder, initargs=(smtp_config,))
+
+    def close(self):
+        """Cierra el grupo; los mensajes aún no construidos se cancelan"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._builds = {}
+
+    def _spooled_for(self, name: str, recipient: str, invoices: List[Tuple[str, str]]) -> bool:
+        """Indica si ya hay un mensaje construido para ese destinatario con los PDFs actuales"""
+        path = self.path_for(name)
+        try:
+            with open(path, 'rb') as f:
+                built = os.fstat(f.fileno()).st_mtime
+                headers = BytesHeaderParser().parsebytes(f.read(4096).split(b'\r\n\r\n', 1)[0])
+        except FileNotFoundError:
+            return False
+        if headers.get('To') != recipient:
+            return False
+        try:
+            return all(self.invoice_store.mtime(pdf_path) < built for pdf_path, _ in invoices)
+        except FileNotFoundError:
+            return False
+
+    def submit(self, name: str, recipient: str, invoices: List[Tuple[str, str]]):
+        """Encarga la construcción de un mensaje (o reutiliza el que quedó de un intento anterior)"""
+        if self._spooled_for(name, recipient, invoices):
+            future: Future = Future()
+            future.set_result(None)
+            self.reused += 1
+        else:
+            future = self._pool.submit(_build_message, str(self.root), name, recipient, invoices)
+        self._builds[name] = future
+
+    def get(self, name: str) -> Tuple[Optional[bytes], str]:
+        """Bytes del mensaje, esperando su construcción; (None, error) si falló"""
+        try:
+            error = self._builds.pop(name).result()
+        except Exception as e:
+            error = f"Error creando mensaje: {str(e)}"
+        if error:
+            return None, error
+        return self.path_for(name).read_bytes(), ''
+
+    def remove(self, name: str):
+        """Elimina un mensaje ya entregado"""
+        try:
+            os.remove(self.path_for(name))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, max_age_days: Optional[float] = None) -> int:
+        """Elimina mensajes viejos (se reconstruirán si aún están pendientes) y restos de tmp/"""
+        max_age_days = CLEANUP_CONFIG.get('temp_days', 1) if max_age_days is None else max_age_days
+        now = time.time()
+        removed = 0
+        for directory, max_age in (('new', max_age_days * 86400), ('tmp', 3600)):
+            for path in (self.root / directory).glob('*' + EXTENSION):
+                try:
+                    if now - path.stat().st_mtime > max_age:
+                        path.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {directory: len(list((self.root / directory).glob('*' + EXTENSION)))
+                for directory in ('new', 'tmp') if (self.root / directory).exists()}
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    spool = MessageSpool()
+    if '--purgar' in args:
+        print(f"Mensajes eliminados: {spool.purge()}")
+    if '--estado' in args or not args:
+        for directory, count in spool.stats().items():
+            print(f"{directory}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cola de Envíos con Arrendamientos
+Cola SQLite compartida de la que varios procesos enviadores (en uno o varios
+equipos) toman lotes de facturas con un arrendamiento que vence. Mientras
+envía, el proceso renueva sus arrendamientos; si muere, vencen y otro proceso
+retoma las facturas. Un lote arrendado solo lo envía su dueño. Los lotes se
+toman por prioridad efectiva (prioridad más envejecimiento, PRIORITY_CONFIG)
+
+En modo WAL todos los procesos deben estar en el mismo equipo; para varios
+equipos sobre almacenamiento compartido use journal_mode 'DELETE'
+
+Uso: python3 cola_envios.py [--importar] [--estado] [--purgar]
+"""
+
+import csv
+import os
+import re
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config_paths import LIMITS, PRIORITY_CONFIG, QUEUE_CONFIG, get_path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pendientes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pdf_path TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    prioridad INTEGER NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    dueno TEXT,
+    vence REAL,
+    disponible REAL NOT NULL DEFAULT 0,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pendientes_estado ON pendientes (estado, disponible, id);
+CREATE INDEX IF NOT EXISTS idx_pendientes_dueno ON pendientes (dueno);
+"""
+
+# Estados de una factura en la cola
+PENDING = 'pendiente'
+SENT = 'enviado'
+INVALID = 'invalido'
+
+
+@dataclass
+class QueueItem:
+    """Factura arrendada por un proceso"""
+    id: int
+    pdf_path: str
+    email: str
+    attempts: int
+    priority: int = 0
+    queued_at: float = 0.0
+
+
+def worker_id() -> str:
+    """Identificador del proceso: equipo y PID"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """Cola de facturas por enviar con arrendamientos renovables"""
+
+    def __init__(self, db_file: Optional[str] = None, config: Dict = QUEUE_CONFIG):
+        self.db_file = str(db_file or get_path('queue_db'))
+        self.config = config
+        self.lease_seconds = float(config.get('lease_seconds', 120))
+        self.aging_rate = float(PRIORITY_CONFIG.get('aging_per_minute', 0)) / 60
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+
+        db = self._connect()
+        try:
+            db.execute(f"PRAGMA journal_mode={config.get('journal_mode', 'WAL')}")
+            db.executescript(SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(pendientes)")}
+            if 'prioridad' not in columns:
+                # Bases creadas antes de la prioridad de envío
+                db.execute("ALTER TABLE pendientes ADD COLUMN prioridad INTEGER NOT NULL DEFAULT 0")
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Una conexión por operación: los hilos de entrega no comparten conexiones"""
+        db = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Transacción que toma el bloqueo de escritura desde el inicio"""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    # --- Altas -----------------------------------------------------------
+
+    def add_many(self, rows: Iterable[Tuple[str, str, int]]) -> int:
+        """Encola (pdf, correo, prioridad); un PDF ya encolado no se duplica"""
+        now = time.time()
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO pendientes (pdf_path, email, prioridad, creado, actualizado, disponible) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                ((pdf, email, priority, now, now) for pdf, email, priority in rows)
+            )
+            return db.total_changes - before
+
+    # --- Arrendamientos --------------------------------------------------
+
+    def claim(self, owner: str, limit: int) -> List[QueueItem]:
+        """Arrienda hasta 'limit' facturas libres o con arrendamiento vencido
+
+        Primero las de mayor prioridad efectiva: prioridad - ritmo * llegada es
+        equivalente a prioridad + ritmo * espera (ver enviador.PriorityScheduler).
+        """
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT id, pdf_path, email, intentos, prioridad, creado FROM pendientes "
+                "WHERE estado = ? AND disponible <= ? AND (vence IS NULL OR vence < ?) "
+                "ORDER BY prioridad - ? * creado DESC, id LIMIT ?",
+                (PENDING, now, now, self.aging_rate, limit)
+            ).fetchall()
+            db.executemany(
+                "UPDATE pendientes SET dueno = ?, vence = ?, intentos = intentos + 1, actualizado = ? "
+                "WHERE id = ?",
+                ((owner, now + self.lease_seconds, now, row[0]) for row in rows)
+            )
+        return [QueueItem(row[0], row[1], row[2], row[3] + 1, row[4], row[5]) for row in rows]
+
+    def heartbeat(self, owner: str) -> int:
+        """Renueva todos los arrendamientos vigentes del proceso"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE pendientes SET vence = ? WHERE dueno = ? AND estado = ? AND vence >= ?",
+                (now + self.lease_seconds, owner, PENDING, now)
+            )
+            return cursor.rowcount
+
+    def _finish(self, owner: str, ids: Iterable[int], state: str, available: float = 0) -> int:
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.executemany(
+                "UPDATE pendientes SET estado = ?, dueno = NULL, vence = NULL, disponible = ?, "
+                "actualizado = ? WHERE id = ? AND dueno = ?",
+                ((state, available, now, item_id, owner) for item_id in ids)
+            )
+            return cursor.rowcount
+
+    def complete(self, owner: str, ids: Iterable[int]) -> int:
+        """Marca como enviadas las facturas arrendadas por el proceso"""
+        return self._finish(owner, ids, SENT)
+
+    def reject(self, owner: str, ids: Iterable[int]) -> int:
+        """Aparta facturas que no se pueden enviar (correo inválido, PDF inexistente)"""
+        return self._finish(owner, ids, INVALID)
+
+    def release(self, owner: str, ids: Iterable[int], delay: float = 0) -> int:
+        """Devuelve facturas a la cola, disponibles de nuevo tras 'delay' segundos"""
+        return self._finish(owner, ids, PENDING, time.time() + delay)
+
+    def release_all(self, owner: str) -> int:
+        """Devuelve todo lo que el proceso tenga arrendado (detención ordenada)"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE pendientes SET dueno = NULL, vence = NULL, actualizado = ? "
+                "WHERE dueno = ? AND estado = ?",
+                (now, owner, PENDING)
+            )
+            return cursor.rowcount
+
+    @contextmanager
+    def lease_keeper(self, owner: str) -> Iterator[None]:
+        """Renueva los arrendamientos en segundo plano mientras dura el bloque"""
+        interval = float(self.config.get('heartbeat_seconds', self.lease_seconds / 3))
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.heartbeat(owner)
+                except sqlite3.Error:
+                    # Un fallo puntual se recupera en el siguiente latido
+                    pass
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    # --- Consultas y mantenimiento --------------------------------------
+
+    def stats(self) -> Dict:
+        """Profundidad de la cola, facturas listas, arrendadas y antigüedad máxima"""
+        now = time.time()
+        db = self._connect()
+        try:
+            depth, oldest = db.execute(
+                "SELECT COUNT(*), MIN(creado) FROM pendientes WHERE estado = ?", (PENDING,)
+            ).fetchone()
+            ready = db.execute(
+                "SELECT COUNT(*) FROM pendientes WHERE estado = ? AND disponible <= ? "
+                "AND (vence IS NULL OR vence < ?)", (PENDING, now, now)
+            ).fetchone()[0]
+            leased = db.execute(
+                "SELECT COUNT(*) FROM pendientes WHERE estado = ? AND vence >= ?", (PENDING, now)
+            ).fetchone()[0]
+        finally:
+            db.close()
+        return {
+            'profundidad': depth,
+            'listos': ready,
+            'arrendados': leased,
+            'antiguedad_max_segundos': round(now - oldest, 1) if oldest else 0,
+        }
+
+    def purge(self, days: Optional[float] = None) -> int:
+        """Elimina las facturas enviadas o inválidas con más de 'days' días"""
+        days = self.config.get('keep_days', 7) if days is None else days
+        with self._transaction() as db:
+            cursor = db.execute(
+                "DELETE FROM pendientes WHERE estado != ? AND actualizado < ?",
+                (PENDING, time.time() - days * 86400)
+            )
+            return cursor.rowcount
+
+
+def import_pending_file(queue: WorkQueue, pending_manager) -> int:
+    """Mueve las filas del archivo de pendientes a la cola
+
+    El archivo queda como buzón de entrada del generador: las filas importadas
+    se eliminan y las anexadas durante la importación se conservan. Las filas
+    se leen del índice de pendientes por tramos de 'pending_chunk_rows'.
+    """
+    if not os.path.exists(pending_manager.pending_file):
+        return 0
+    index = pending_manager.open_index()
+    if not len(index):
+        index.close()
+        return 0
+    chunk_rows = max(1, int(LIMITS.get('pending_chunk_rows', 50000)))
+    added = 0
+    for start in range(0, len(index), chunk_rows):
+        rows = [
+            (row[0].strip(), row[1].strip(),
+             int(row[2]) if len(row) > 2 and re.fullmatch(r'-?\d+', row[2].strip()) else 0)
+            for row in csv.reader(index.lines(start, start + chunk_rows)) if len(row) >= 2 and row[0].strip()
+        ]
+        added += queue.add_many(rows) if rows else 0
+    pending_manager.update_pending_file(range(len(index)))
+    return added
+
+
+def main():
+    """Función principal"""
+    # Importación diferida: enviador importa este módulo
+    from enviador import PendingFileManager
+
+    args = sys.argv[1:]
+    queue = WorkQueue()
+
+    if '--importar' in args:
+        added = import_pending_file(queue, PendingFileManager(str(get_path('pending'))))
+        print(f"Facturas encoladas: {added}")
+
+    if '--purgar' in args:
+        print(f"Registros purgados: {queue.purge()}")
+
+    if '--estado' in args or not args:
+        for key, value in queue.stats().items():
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,11 +10,15 @@ BASE_DIR = Path(__file__).parent.absolute()
 # Configuración de directorios
 DIRECTORIES = {
     'data': BASE_DIR / 'datos',
+    'sales_store': BASE_DIR / 'datos' / 'ventas',
     'logs': BASE_DIR / 'logs',
     'logs_envios': BASE_DIR / 'logs' / 'envios',
+    'log_segments': BASE_DIR / 'logs' / 'segmentos',
     'reports': BASE_DIR / 'logs' / 'reportes',
+    'profiles': BASE_DIR / 'logs' / 'perfiles',
     'pdf': BASE_DIR / 'facturas_pdf',
     'temp': BASE_DIR / 'temp',
+    'spool': BASE_DIR / 'temp' / 'bandeja_salida',
     'backup': BASE_DIR / 'backup'
 }
 
@@ -25,7 +29,17 @@ FILES = {
     'daily_log': BASE_DIR / 'logs' / 'log_diario.log',
     'shipment_log': BASE_DIR / 'logs' / 'envios' / 'log_envios.csv',
     'enviador_log': BASE_DIR / 'logs' / 'envios' / 'enviador.log',
-    'cron_log': BASE_DIR / 'cron_execution.log'
+    'enviador_json_log': BASE_DIR / 'logs' / 'envios' / 'enviador.jsonl',   # LOGGING_CONFIG['enviador_mode'] 'cola'
+    'cron_log': BASE_DIR / 'cron_execution.log',
+    'log_segment_index': BASE_DIR / 'logs' / 'segmentos' / 'indice.csv',
+    'artifact_manifest': BASE_DIR / 'temp' / 'manifest_artefactos.csv',
+    'stamp_base': BASE_DIR / 'temp' / 'estampado' / 'base_factura.pdf',
+    'sender_pid': BASE_DIR / 'temp' / 'enviador_demonio.pid',
+    'sender_status': BASE_DIR / 'temp' / 'enviador_estado.json',
+    'queue_db': BASE_DIR / 'temp' / 'cola_envios.db',
+    'ingest_watermarks': BASE_DIR / 'temp' / 'marcas_compras.json',
+    'suppression_db': BASE_DIR / 'datos' / 'supresion.db',
+    'suppression_bloom': BASE_DIR / 'datos' / 'supresion.bloom'
 }
 
 # Configuración de email del administrador
@@ -36,7 +50,64 @@ CLEANUP_CONFIG = {
     'logs_days': 7,           # Días para mantener logs
     'pdf_days': 30,           # Días para mantener PDFs
     'temp_users_days': 30,    # Días para mantener usuarios temporales
-    'backup_days': 90         # Días para mantener backups
+    'backup_days': 90,        # Días para mantener backups
+    'temp_days': 1,           # Días para mantener auxiliares de LaTeX y temporales
+    'archive_expired': False, # Empaquetar en backup/ los archivos vencidos antes de borrarlos
+    'batch_size': 500,        # Archivos borrados por lote
+    'workers': 4              # Hilos de borrado en paralelo
+}
+
+# Configuración del aprovisionamiento de usuarios en Linux (usuarios_temporales.py)
+USER_PROVISION_CONFIG = {
+    'enabled': False,                               # Paso 4 de cron_job.sh: crea y bloquea cuentas del equipo
+    'root': '/',                                    # Raíz de etc/passwd, etc/shadow y etc/group
+    'backend': 'comandos',                          # 'comandos' (newusers/chpasswd/gpasswd) o 'archivos'
+    'group': 'empleados',                           # Grupo principal de las cuentas creadas
+    'admin_group': 'sudo',                          # Grupo de los departamentos administrativos
+    'admin_departments': ['TI', 'Administración'],
+    'shell': '/bin/bash',
+    'home': '/home',
+    'uid_min': 1000,                                # Primer UID libre en el modo 'archivos'
+    'hash_workers': 0,                              # Procesos para los hashes en modo 'archivos' (0 = CPUs)
+    'username_max_length': 20,
+    'password_length': 12
+}
+
+# Configuración del almacenamiento de PDFs (facturas_pdf/AAAA/MM/DD/factura_<id>.pdf)
+PDF_STORAGE_CONFIG = {
+    'pack_after_days': 7,     # Días tras los que un directorio diario se empaqueta en DD.pack
+    'pack_extension': '.pack',
+    'index_extension': '.idx'
+}
+
+# Configuración de la optimización de PDFs tras compilar (optimizador_pdf.py)
+PDF_OPTIMIZE_CONFIG = {
+    'enabled': True,                            # Optimizar las facturas compiladas con LaTeX
+    'tools': ['ghostscript', 'qpdf', 'pypdf'],  # Herramientas a usar si están instaladas
+    'workers': 4                                # PDFs optimizados en paralelo
+}
+
+# Configuración del servidor de compilación LaTeX (generador_facturas.py --servidor)
+LATEX_SERVER_CONFIG = {
+    'workers': 2,           # Procesos pdflatex con el preámbulo precargado
+    'recycle_after': 50,    # Trabajos por proceso antes de cerrar su PDF y reiniciarlo
+    'job_timeout': 60       # Segundos máximos por factura
+}
+
+# Configuración del estampado sobre PDF base (generador_facturas.py --estampar)
+STAMP_CONFIG = {
+    # Espacio reservado en el PDF base para campos en líneas centradas o alineadas
+    # a la derecha; el resto usa el ancho de su celda o párrafo
+    'reserved_widths': {'id_transaccion': '3cm', 'fecha_emision': '3cm'}
+}
+
+# Categorías del manifiesto de artefactos y su clave de retención en CLEANUP_CONFIG
+RETENTION_CATEGORIES = {
+    'pdf': 'pdf_days',
+    'log': 'logs_days',
+    'report': 'logs_days',
+    'backup': 'backup_days',
+    'temp': 'temp_days'
 }
 
 # Configuración de límites del sistema
@@ -44,7 +115,118 @@ LIMITS = {
     'max_emails_per_batch': 100,    # Máximo correos por lote
     'max_retries': 3,               # Máximo reintentos de envío
     'timeout_seconds': 30,          # Timeout para conexiones SMTP
-    'max_file_size_mb': 10          # Tamaño máximo de archivos adjuntos
+    'max_file_size_mb': 10,         # Tamaño máximo de archivos adjuntos
+    'pending_chunk_rows': 50000     # Filas de pendientes leídas y enviadas por tramo
+}
+
+# Configuración de entrega agrupada por dominio del destinatario
+DELIVERY_CONFIG = {
+    'group_by_domain': True,          # Agrupar pendientes por dominio antes de enviar
+    'max_workers': 4,                 # Conexiones SMTP simultáneas en total
+    'per_domain_concurrency': 2,      # Conexiones simultáneas por dominio (por defecto)
+    'domain_concurrency': {},         # Límites específicos, ej. {'gmail.com': 1}
+    'domain_relays': {},              # Servidor por dominio, ej. {'example.net': ('mx.example.net', 25)}
+    'defer_after_temp_failures': 3,   # Errores 4xx seguidos antes de diferir el resto del dominio
+    'coalesce_by_recipient': False    # Un solo mensaje con todas las facturas de un destinatario
+}
+
+# Bandeja de salida: procesos que construyen los mensajes en temp/bandeja_salida/
+# mientras los hilos de entrega solo los envían (bandeja_salida.py, enviador.py --bandeja)
+SPOOL_CONFIG = {
+    'enabled': False,
+    'build_workers': 2       # Procesos que construyen mensajes (0 = CPUs)
+}
+
+# Circuito ante fallas sistémicas del servidor SMTP (sin conexión, autenticación, 4xx)
+CIRCUIT_BREAKER_CONFIG = {
+    'enabled': True,
+    'failure_threshold': 5,     # Fallas sistémicas seguidas que abren el circuito
+    'open_seconds': 30,         # Espera antes de probar un envío (semiabierto)
+    'max_open_seconds': 300     # Pausa máxima por ejecución; luego el resto queda como no intentado
+}
+
+# Lista de supresión de destinatarios con rebote permanente (lista_supresion.py)
+SUPPRESSION_CONFIG = {
+    'enabled': True,
+    'codes': [550, 551, 553],          # Rechazos del destinatario que lo suprimen
+    'expire_days': 180,                # Días hasta volver a intentar (0 = nunca vence)
+    'expected_entries': 1000000,       # Tamaño del filtro de Bloom (crece si se supera)
+    'false_positive_rate': 0.001       # Fracción de consultas que llegan a la base sin estar suprimidas
+}
+
+# Ajuste automático de los envíos simultáneos (AIMD por latencia SMTP y tasa de 4xx)
+# El límite parte de DELIVERY_CONFIG['max_workers'] y se mueve entre los extremos
+AUTOTUNE_CONFIG = {
+    'enabled': True,
+    'min_concurrency': 1,
+    'max_concurrency': 8,
+    'window': 20,                   # Envíos por ajuste
+    'latency_tolerance': 2.0,       # Latencia media sobre la base que se considera saturación
+    'max_temp_failure_rate': 0.05,  # Fracción de errores temporales o sistémicos tolerada
+    'decrease_factor': 0.5,         # Reducción multiplicativa del límite
+    'baseline_drift': 0.05          # Cuánto puede subir la latencia base por ventana
+}
+
+# Configuración del enviador en modo demonio (enviador.py --demonio)
+DAEMON_CONFIG = {
+    'poll_interval': 1.0,        # Segundos entre revisiones del archivo de pendientes
+    'retry_interval': 300,       # Segundos antes de reintentar un envío fallido o diferido
+    'idle_close_seconds': 240,   # Cierre de conexiones SMTP sin uso
+    'status_interval': 30        # Segundos entre actualizaciones del archivo de estado
+}
+
+# Configuración de la cola compartida de envíos (cola_envios.py, enviador.py --cola)
+QUEUE_CONFIG = {
+    'enabled': False,          # Usar la cola SQLite en lugar del archivo de pendientes
+    'journal_mode': 'WAL',     # 'DELETE' si varios equipos comparten la base por red
+    'batch_size': 50,          # Facturas arrendadas por lote
+    'lease_seconds': 120,      # Vigencia de un arrendamiento sin renovar
+    'heartbeat_seconds': 30,   # Intervalo de renovación mientras se envía
+    'retry_seconds': 300,      # Espera antes de reintentar una factura fallida
+    'keep_days': 7             # Días que se conservan las enviadas e inválidas
+}
+
+# Ingesta incremental de compras (ingesta_compras.py, generador_facturas.py --incremental)
+INGEST_CONFIG = {
+    'max_retries': 3,        # Ejecuciones en que se intenta una compra que no compila
+    'invoiced_keep': 10000   # Transacciones facturadas que se recuerdan por lote (0 = todas)
+}
+
+# Redirección de prueba: una muestra determinista de destinatarios recibe sus
+# facturas en los correos de prueba (enviador.py --redirigir-prueba FRACCION)
+TEST_REDIRECT_CONFIG = {
+    'enabled': False,
+    'fraction': 0.3,           # Fracción de destinatarios redirigidos (0.0 - 1.0)
+    'salt': 'canario',         # Cambiarla elige otra muestra; la misma repite la anterior
+    'recipients': [
+        'riveramax380@gmail.com',
+        'jeffreynuyens@ufm.edu',
+        'robertobetancourth69@gmail.com'
+    ]
+}
+
+# Prioridad de envío: generador_facturas.py la calcula y la escribe como tercera
+# columna de pendientes; enviador.py y cola_envios.py envían primero las mayores
+PRIORITY_CONFIG = {
+    'vip_markers': ['VIP'],    # Texto en observaciones que identifica a un cliente VIP
+    'vip': 100,                # Puntos por cliente VIP
+    'full_payment': 20,        # Puntos por 'Pago completo'
+    'failed_payment': -20,     # Puntos por estado_pago 'Fallido'
+    'aging_per_minute': 1.0    # Puntos que gana una factura por minuto de espera
+}
+
+# Presupuesto de tiempo de las etapas Python (presupuesto_ejecucion.py)
+# cron_job.sh lo fija con PRESUPUESTO_SEGUNDOS según el timeout de cada paso
+RUN_BUDGET_CONFIG = {
+    'generador_seconds': 600,   # Límite de generador_facturas.py (None = sin límite)
+    'enviador_seconds': 1800,   # Límite de enviador.py en una ejecución única
+    'margin_seconds': 30        # Reserva para terminar el trabajo en curso y cerrar
+}
+
+# Configuración de validación previa de correos
+VALIDATION_CONFIG = {
+    'check_domain': True,   # Validar longitud y etiquetas del dominio
+    'idna': True            # Codificar dominios internacionales con IDNA
 }
 
 # Configuración de formato de fechas
@@ -58,7 +240,30 @@ DATE_FORMATS = {
 LOGGING_CONFIG = {
     'level': 'INFO',
     'format': '%(asctime)s [%(levelname)s] %(message)s',
-    'date_format': '%Y-%m-%d %H:%M:%S'
+    'date_format': '%Y-%m-%d %H:%M:%S',
+    # 'directo': el hilo que registra escribe el log; 'cola': los registros pasan
+    # por una cola a un hilo que los escribe como JSON lines (registro_estructurado.py)
+    'enviador_mode': 'directo',
+    # Fracción de los mensajes por fila que se registran en modo 'cola'
+    # (las advertencias y errores se registran siempre)
+    'sampling': {
+        'fila': 0.1,        # "Procesando N: ..."
+        'envio': 1.0,       # "Enviado exitosamente: ..."
+    },
+}
+
+# Rotación de logs en segmentos comprimidos por día y tamaño (rotacion_logs.py)
+LOG_ROTATION_CONFIG = {
+    'logs': ['daily_log', 'enviador_log', 'enviador_json_log', 'cron_log'],   # Claves de FILES que se rotan
+    'max_bytes': 20 * 1024 * 1024,    # Tamaño que cierra un segmento aunque no cambie el día
+    'compression': 'gzip',            # 'gzip' o 'zstd' (requiere el módulo zstandard)
+    'level': 6                        # Nivel de compresión
+}
+
+# Configuración del perfilado por etapas (perfilado.py, --perfilar cpu,memoria o PERFILAR)
+PROFILE_CONFIG = {
+    'top_n': 25,              # Líneas por memoria asignada en cada reporte de memoria
+    'traceback_frames': 1     # Marcos guardados por asignación (más = más detalle y costo)
 }
 
 def ensure_directories():
@@ -7,34 +7,47 @@
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 LOG_FILE="$SCRIPT_DIR/cron_execution.log"
 LOCK_FILE="/tmp/mercado_irsi_cron.lock"
+STEP_GRACE_SECONDS=60  # Margen sobre el timeout de cada paso antes de terminarlo
 
 # Función de logging con timestamp
 log_message() {
     echo "$(date '+%Y-%m-%d %H:%M:%S') [CRON] $1" | tee -a "$LOG_FILE"
 }
 
-# Función para cleanup en caso de error
+# Función para cleanup en caso de error (solo borra el lock propio)
 cleanup() {
-    if [[ -f "$LOCK_FILE" ]]; then
+    if [[ -f "$LOCK_FILE" ]] && [[ "$(cat "$LOCK_FILE" 2>/dev/null)" == "$$" ]]; then
         rm -f "$LOCK_FILE"
     fi
 }
 
-# Trap para cleanup
-trap cleanup EXIT
-
-# Verificar si ya se está ejecutando otra instancia
+# Verificar si ya se está ejecutando otra instancia; un lock de un proceso muerto se retoma
 if [[ -f "$LOCK_FILE" ]]; then
+    lock_pid=$(cat "$LOCK_FILE" 2>/dev/null)
+    if [[ -n "$lock_pid" ]] && kill -0 "$lock_pid" 2>/dev/null; then
+        log_message "ERROR: Otra instancia del proceso ya está ejecutándose (PID $lock_pid)"
+        exit 1
+    fi
+    log_message "AVISO: Lock huérfano de PID ${lock_pid:-desconocido}, se retoma"
+    rm -f "$LOCK_FILE"
+fi
+
+# Crear lock file (noclobber: si otra instancia lo creó en el intertanto, se sale)
+if ! (set -o noclobber; echo $$ > "$LOCK_FILE") 2>/dev/null; then
     log_message "ERROR: Otra instancia del proceso ya está ejecutándose"
     exit 1
 fi
 
-# Crear lock file
-echo $$ > "$LOCK_FILE"
+# Trap para cleanup (después de tomar el lock, para no borrar el de otra instancia)
+trap cleanup EXIT
 
 # Cambiar al directorio del script
 cd "$SCRIPT_DIR"
 
+# Cerrar en segmentos comprimidos los logs de días anteriores o demasiado grandes
+# (rotacion_logs.py; los escritores abiertos siguen escribiendo sin reabrirlos)
+python3 rotacion_logs.py >> "$LOG_FILE" 2>&1 || echo "$(date '+%Y-%m-%d %H:%M:%S') [CRON] AVISO: Falló la rotación de logs" >> "$LOG_FILE"
+
 log_message "=== INICIO DE EJECUCIÓN AUTOMATIZADA ==="
 
 # Función para ejecutar paso con manejo de errores
@@ -45,15 +58,26 @@ execute_step() {
     
     log_message "Iniciando: $step_name"
     
-    # Ejecutar comando (sin timeout en macOS por defecto)
-    if bash -c "$command"; then
+    # Las etapas Python dejan de tomar trabajo antes del límite (PRESUPUESTO_SEGUNDOS);
+    # timeout/gtimeout solo corta, con margen, lo que no respete el presupuesto
+    local timeout_cmd=""
+    if command -v timeout >/dev/null 2>&1; then
+        timeout_cmd="timeout -k 30 $((timeout_seconds + STEP_GRACE_SECONDS))"
+    elif command -v gtimeout >/dev/null 2>&1; then
+        timeout_cmd="gtimeout -k 30 $((timeout_seconds + STEP_GRACE_SECONDS))"
+    fi
+    
+    PRESUPUESTO_SEGUNDOS="$timeout_seconds" $timeout_cmd bash -c "$command"
+    local exit_code=$?
+    if [[ $exit_code -eq 0 ]]; then
         log_message "$step_name completado exitosamente"
         return 0
+    elif [[ $exit_code -eq 124 || $exit_code -eq 137 ]] && [[ -n "$timeout_cmd" ]]; then
+        log_message "ERROR: $step_name - Tiempo límite de ${timeout_seconds}s excedido, proceso terminado"
     else
-        local exit_code=$?
         log_message "ERROR: $step_name - Error con codigo: $exit_code"
-        return $exit_code
     fi
+    return $exit_code
 }
 
 # PASO 1: Generar datos de compras (opcional, solo si no hay archivos recientes)
@@ -68,8 +92,8 @@ else
     log_message "INFO: Usando archivo CSV existente: $newest_csv"
 fi
 
-# PASO 2: Generar facturas
-execute_step "Generación de Facturas" "./generador_facturas.sh" 600
+# PASO 2: Generar facturas (solo compras nuevas; lo no enviado sigue en pendientes)
+execute_step "Generación de Facturas" "./generador_facturas.sh --incremental" 600
 if [[ $? -ne 0 ]]; then
     log_message "ERROR: Fallo en generación de facturas, abortando"
     exit 1
@@ -79,19 +103,26 @@ fi
 log_message "INFO: Envío inmediato de correos..."
 
 # PASO 3: Enviar correos
+# Con la cola compartida (QUEUE_CONFIG) el lock solo protege a este equipo:
+# otros equipos o procesos "python3 enviador.py --cola" vacían la misma cola
 execute_step "Envío de Correos" "python3 enviador.py" 1800
 envio_exit_code=$?
 
-# PASO 4: Procesar empleados temporales (si hay archivo)
-# TEMPORALMENTE DESHABILITADO - PowerShell no disponible en macOS
-# if [[ -f "datos/empleados.csv" ]]; then
-#     execute_step "Gestión de Usuarios" "powershell -File usuarios.ps1" 300
-# fi
+# PASO 4: Procesar empleados temporales (si hay archivo y USER_PROVISION_CONFIG['enabled'])
+# En Linux con privilegios se usa la versión Python (newusers/chpasswd en lote);
+# usuarios.ps1 sigue siendo la opción para Windows
+provision_enabled=$(python3 -c "from config_paths import USER_PROVISION_CONFIG as u; print(bool(u.get('enabled')))" 2>/dev/null)
+if [[ "$provision_enabled" == "True" && -f "datos/empleados.csv" && "$(uname -s)" == "Linux" && $EUID -eq 0 ]]; then
+    execute_step "Gestión de Usuarios" "python3 usuarios_temporales.py" 300
+fi
 
 # Resumen final
 log_message "=== RESUMEN DE EJECUCIÓN ==="
-log_message "Facturas generadas: $(ls facturas_pdf/*.pdf 2>/dev/null | wc -l)"
+log_message "Facturas generadas: $(python3 almacen_facturas.py --contar 2>/dev/null || echo 0)"
 log_message "Pendientes de envío: $(wc -l < temp/pendientes_envio.csv 2>/dev/null || echo 0)"
+if [[ -f "temp/cola_envios.db" ]]; then
+    log_message "Cola compartida: $(python3 cola_envios.py --estado 2>/dev/null | tr '\n' ' ')"
+fi
 
 if [[ -f "logs/envios/log_envios.csv" ]]; then
     exitosos=$(awk -F',' '$3=="exitoso" {count++} END {print count+0}' logs/envios/log_envios.csv)
@@ -102,10 +133,31 @@ fi
 
 log_message "=== FIN DE EJECUCIÓN AUTOMATIZADA ==="
 
-# Limpiar archivos temporales antiguos (más de 7 días)
-find . -name "*.aux" -o -name "*.log" -o -name "factura_*.tex" | xargs rm -f 2>/dev/null
-find logs/ -name "*.log" -mtime +7 -delete 2>/dev/null
-find facturas_pdf/ -name "*.pdf" -mtime +30 -delete 2>/dev/null
+# Empaquetar directorios diarios antiguos de facturas_pdf/
+execute_step "Empaquetado de Facturas" "python3 almacen_facturas.py --migrar --empaquetar" 300
+
+# Purgar de la cola compartida las facturas enviadas hace más de QUEUE_CONFIG['keep_days']
+if [[ -f "temp/cola_envios.db" ]]; then
+    execute_step "Purga de Cola de Envíos" "python3 cola_envios.py --purgar" 300
+fi
+
+# Quitar de la lista de supresión los rebotes vencidos (SUPPRESSION_CONFIG['expire_days'])
+if [[ -f "datos/supresion.db" ]]; then
+    execute_step "Purga de Lista de Supresión" "python3 lista_supresion.py --purgar" 300
+fi
+
+# Limpiar artefactos vencidos según CLEANUP_CONFIG (manifiesto, sin recorrer directorios)
+if [[ ! -f "temp/manifest_artefactos.csv" ]]; then
+    execute_step "Retención de Artefactos" "python3 retencion.py --inicializar" 300
+else
+    execute_step "Retención de Artefactos" "python3 retencion.py" 300
+fi
+
+# Auxiliares de LaTeX que no llegaron al manifiesto (compilaciones interrumpidas),
+# con más de CLEANUP_CONFIG['temp_days']
+temp_minutes=$(python3 -c "from config_paths import CLEANUP_CONFIG as c; print(int(c['temp_days'] * 1440))" 2>/dev/null || echo 1440)
+find . -maxdepth 1 \( -name "*.aux" -o -name "factura_*.tex" \) -mmin +"$temp_minutes" -delete 2>/dev/null
+find facturas_pdf temp/latex -maxdepth 4 \( -name "*.aux" -o -name "factura_*.tex" \) -mmin +"$temp_minutes" -delete 2>/dev/null
 
 # Código de salida basado en el resultado del envío
 exit $envio_exit_code
\ No newline at end of file
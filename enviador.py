@@ -4,27 +4,70 @@
 Sistema de Envío Automatizado de Facturas por Correo
 Procesa archivo pendientes_envio.csv y envía facturas por correo electrónico
 
+Uso: python3 enviador.py [--demonio] [--cola] [--presupuesto SEGUNDOS] [--redirigir-prueba FRACCION] [--registro-json]
+                           [--perfilar cpu,memoria] [--bandeja]
+  --demonio  Queda en ejecución y envía las facturas nuevas en cuanto llegan
+             a pendientes (detener con SIGTERM)
+  --cola     Importa pendientes a la cola compartida (cola_envios.py) y envía
+             lotes arrendados; varios enviadores pueden vaciarla a la vez
+  --presupuesto  Deja de enviar cuando lo restante no alcanzaría a terminar en
+             SEGUNDOS (por defecto PRESUPUESTO_SEGUNDOS o RUN_BUDGET_CONFIG)
+  --redirigir-prueba  Envía a los correos de prueba las facturas de esa fracción
+             de destinatarios, elegida por hash (TEST_REDIRECT_CONFIG)
+  --registro-json  Registra en segundo plano, como JSON lines y con muestreo de
+             los mensajes por fila (LOGGING_CONFIG['enviador_mode'] = 'cola')
+  --perfilar  Perfila las etapas de envío y reporte (cpu y/o memoria) en
+             logs/perfiles/ (también con la variable PERFILAR, perfilado.py)
+  --bandeja  Construye los mensajes en procesos aparte y los entrega desde
+             temp/bandeja_salida/ (SPOOL_CONFIG, bandeja_salida.py)
+
 Autor: Sistema de Facturación Mercado IRSI
 Versión: 2.0
 Fecha: 2024
 """
 
 import csv
+import fcntl
 import smtplib
 import os
 import re
+import signal
 import sys
+import time
 import datetime
+import hashlib
+import heapq
+import itertools
 import json
+import mmap
+import shutil
+from array import array
 from pathlib import Path
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
+import atexit
+import contextlib
 import logging
-from typing import Dict, List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Optional, Union
 from dataclasses import dataclass
 
+from config_paths import (AUTOTUNE_CONFIG, CIRCUIT_BREAKER_CONFIG, DAEMON_CONFIG, DELIVERY_CONFIG, LIMITS, LOGGING_CONFIG, PRIORITY_CONFIG,
+                          QUEUE_CONFIG, SPOOL_CONFIG, SUPPRESSION_CONFIG, TEST_REDIRECT_CONFIG, VALIDATION_CONFIG, get_path)
+from retencion import ArtifactManifest
+from almacen_facturas import InvoiceStore
+from almacen_ventas import SalesStore
+from bandeja_salida import MessageSpool
+from lista_supresion import SuppressionList
+from rotacion_logs import SegmentedFileHandler, SegmentedLog
+from cola_envios import WorkQueue, import_pending_file, worker_id
+from presupuesto_ejecucion import RunBudget
+from perfilado import StageProfiler
+from registro_estructurado import start_queue_logging
+
 
 @dataclass
 class EmailConfig:
@@ -46,6 +89,54 @@ class PathConfig:
     reports_dir: str
 
 
+class PendingRow:
+    """Fila del archivo de pendientes
+    
+    Se crea solo al procesar su tramo del índice (PendingIndex); con __slots__
+    cada fila ocupa lo justo para sus cinco campos.
+    """
+    __slots__ = ('row_num', 'pdf_path', 'email', 'priority', 'queued_at')
+    
+    def __init__(self, row_num: int, pdf_path: str, email: str, priority: int = 0, queued_at: float = 0.0):
+        self.row_num = row_num
+        self.pdf_path = pdf_path
+        self.email = email
+        self.priority = priority
+        self.queued_at = queued_at      # Momento de llegada a pendientes (para el envejecimiento)
+    
+    def __repr__(self) -> str:
+        return f"PendingRow({self.row_num}, {self.pdf_path!r}, {self.email!r}, {self.priority})"
+    
+    @property
+    def domain(self) -> str:
+        """Dominio del destinatario en minúsculas"""
+        return self.email.rsplit('@', 1)[-1].lower() if '@' in self.email else ''
+
+
+@dataclass
+class DeliveryResult:
+    """Resultado detallado de un envío SMTP"""
+    success: bool
+    detail: str
+    smtp_code: Optional[int] = None
+    connection_ok: bool = True
+    
+    @property
+    def is_temporary(self) -> bool:
+        """Indica si el servidor respondió con un error temporal (4xx)"""
+        return self.smtp_code is not None and 400 <= self.smtp_code < 500
+    
+    @property
+    def is_systemic(self) -> bool:
+        """Falla del servidor o de la conexión (sin conexión, autenticación, 4xx),
+        no del mensaje ni del destinatario"""
+        if self.success:
+            return False
+        if self.smtp_code is None:
+            return not self.connection_ok
+        return self.is_temporary or self.smtp_code in (530, 534, 535)
+
+
 class ConfigManager:
     """Gestor de configuración del sistema"""
     
@@ -128,18 +219,98 @@ class ConfigManager:
 class EmailValidator:
     """Validador de correos electrónicos"""
     
+    # TLD alfabético o en punycode (xn--...), que es como queda un TLD internacional tras IDNA
+    EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.(?:[a-zA-Z]{2,}|xn--[a-zA-Z0-9-]+)$')
+    LABEL_PATTERN = re.compile(r'^(?!-)[a-z0-9-]{1,63}(?<!-)$')
+    
+    def __init__(self, check_domain: bool = False, use_idna: bool = False):
+        self.check_domain = check_domain
+        self.use_idna = use_idna
+        self._cache: Dict[str, Optional[str]] = {}
+    
     @staticmethod
     def validate_email(email: str) -> bool:
         """Valida formato de correo electrónico usando regex"""
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        return EmailValidator.EMAIL_PATTERN.match(email) is not None
+    
+    def normalize(self, email: str) -> Optional[str]:
+        """Normaliza un correo (espacios, dominio en minúsculas e IDNA)
+        
+        Devuelve None si el dominio no puede codificarse.
+        """
+        email = email.strip()
+        if '@' not in email:
+            return email
+        local, domain = email.rsplit('@', 1)
+        domain = domain.strip().rstrip('.').lower()
+        if self.use_idna and not domain.isascii():
+            try:
+                domain = domain.encode('idna').decode('ascii')
+            except UnicodeError:
+                return None
+        return f"{local}@{domain}"
+    
+    def _valid_domain(self, domain: str) -> bool:
+        """Comprueba longitud y sintaxis de cada etiqueta del dominio"""
+        if len(domain) > 253:
+            return False
+        return all(self.LABEL_PATTERN.match(label) for label in domain.split('.'))
+    
+    def check(self, email: str) -> Optional[str]:
+        """Normaliza y valida un correo, cacheando el resultado por dirección
+        
+        Devuelve la dirección normalizada o None si no es entregable.
+        """
+        if email in self._cache:
+            return self._cache[email]
+        
+        normalized = self.normalize(email)
+        if normalized is not None and not self.validate_email(normalized):
+            normalized = None
+        if normalized is not None and self.check_domain:
+            local, domain = normalized.rsplit('@', 1)
+            if len(local) > 64 or not self._valid_domain(domain):
+                normalized = None
+        
+        self._cache[email] = normalized
+        return normalized
+    
+    @property
+    def distinct_checked(self) -> int:
+        """Número de direcciones distintas validadas"""
+        return len(self._cache)
+
+
+class TestRedirector:
+    """Redirige una muestra determinista de destinatarios a los correos de prueba
+    
+    La muestra se decide con un hash del destinatario y la sal: la misma
+    configuración elige siempre los mismos destinatarios, sin copiar ni
+    reescribir el archivo de pendientes.
+    """
+    
+    def __init__(self, fraction: float, recipients: List[str], salt: str = ''):
+        self.fraction = min(max(fraction, 0.0), 1.0)
+        self.recipients = recipients
+        self.salt = salt
+    
+    def _hash(self, purpose: str, email: str) -> int:
+        digest = hashlib.sha256(f"{self.salt}:{purpose}:{email.strip().lower()}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+    
+    def target(self, email: str) -> Optional[str]:
+        """Correo de prueba que recibe los envíos de 'email', o None si no se redirige"""
+        if not self.recipients or self._hash('muestra', email) >= self.fraction * 2 ** 64:
+            return None
+        return self.recipients[self._hash('destino', email) % len(self.recipients)]
 
 
 class EmailMessageBuilder:
     """Constructor de mensajes de correo"""
     
-    def __init__(self, smtp_config: EmailConfig):
+    def __init__(self, smtp_config: EmailConfig, invoice_store: Optional[InvoiceStore] = None):
         self.smtp_config = smtp_config
+        self.invoice_store = invoice_store or InvoiceStore()
     
     def create_invoice_message(self, recipient: str, pdf_path: str, invoice_id: str) -> Optional[MIMEMultipart]:
         """Crea mensaje de correo con factura adjunta"""
@@ -158,6 +329,27 @@ class EmailMessageBuilder:
         
         return msg
     
+    def create_multi_invoice_message(self, recipient: str,
+                                     invoices: List[Tuple[str, str]]) -> Optional[MIMEMultipart]:
+        """Crea un único mensaje con varias facturas adjuntas (pdf_path, invoice_id)"""
+        
+        invoice_ids = [invoice_id for _, invoice_id in invoices]
+        
+        msg = MIMEMultipart()
+        msg['From'] = self.smtp_config.user
+        msg['To'] = recipient
+        msg['Subject'] = f'Facturas Electrónicas ({len(invoice_ids)}) - Mercado IRSI'
+        
+        body = self._create_multi_invoice_body(invoice_ids)
+        msg.attach(MIMEText(body, 'plain', 'utf-8'))
+        
+        # Adjuntar PDFs
+        for pdf_path, _ in invoices:
+            if not self._attach_pdf(msg, pdf_path):
+                return None
+        
+        return msg
+    
     def create_admin_report_message(self, admin_email: str, report_file: str) -> Optional[MIMEMultipart]:
         """Crea mensaje de reporte para administrador"""
         
@@ -192,6 +384,31 @@ Atentamente,
 Mercado IRSI
 Sistema Automatizado de Facturación
 
+---
+Este es un correo automático, por favor no responda.
+Para consultas: soporte@mercadoirsi.com
+Web: www.mercadoirsi.com
+"""
+    
+    def _create_multi_invoice_body(self, invoice_ids: List[str]) -> str:
+        """Crea el cuerpo del mensaje para varias facturas"""
+        detalle = "\n".join(f"- Factura #{invoice_id}" for invoice_id in invoice_ids)
+        return f"""
+Estimado/a Cliente,
+
+Adjunto encontrará sus {len(invoice_ids)} facturas electrónicas correspondientes a sus compras en Mercado IRSI.
+
+Facturas incluidas:
+{detalle}
+
+Fecha de emisión: {datetime.datetime.now().strftime('%Y-%m-%d')}
+
+Gracias por su preferencia.
+
+Atentamente,
+Mercado IRSI
+Sistema Automatizado de Facturación
+
 ---
 Este es un correo automático, por favor no responda.
 Para consultas: soporte@mercadoirsi.com
@@ -213,15 +430,14 @@ Mercado IRSI
     def _attach_pdf(self, msg: MIMEMultipart, file_path: str) -> bool:
         """Adjunta archivo PDF al mensaje"""
         try:
-            with open(file_path, 'rb') as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {os.path.basename(file_path)}'
-                )
-                msg.attach(part)
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(self.invoice_store.read_bytes(file_path))
+            encoders.encode_base64(part)
+            part.add_header(
+                'Content-Disposition',
+                f'attachment; filename= {os.path.basename(file_path)}'
+            )
+            msg.attach(part)
             return True
         except FileNotFoundError:
             logging.error(f"Archivo no encontrado: {file_path}")
@@ -237,30 +453,446 @@ class EmailSender:
     def __init__(self, smtp_config: EmailConfig):
         self.smtp_config = smtp_config
     
+    def open_connection(self, host: Optional[str] = None, port: Optional[int] = None) -> smtplib.SMTP:
+        """Abre una conexión SMTP lista para enviar
+        
+        Sin host se usa el relay configurado (con TLS y autenticación). Un host
+        distinto corresponde a entrega directa y solo se autentica si es el relay.
+        """
+        host = host or self.smtp_config.server
+        port = port or self.smtp_config.port
+        server = smtplib.SMTP(host, port, timeout=LIMITS['timeout_seconds'])
+        
+        if self.smtp_config.use_tls:
+            if host == self.smtp_config.server:
+                server.starttls()
+            else:
+                server.ehlo()
+                if server.has_extn('starttls'):
+                    server.starttls()
+        
+        if host == self.smtp_config.server:
+            server.login(self.smtp_config.user, self.smtp_config.password)
+        
+        return server
+    
     def send_email(self, message: MIMEMultipart, recipient: str) -> Tuple[bool, str]:
         """Envía correo electrónico usando SMTP"""
+        result = self.deliver(message, recipient)
+        return result.success, result.detail
+    
+    def deliver(self, message: Union[MIMEMultipart, bytes], recipient: str,
+                server: Optional[smtplib.SMTP] = None) -> DeliveryResult:
+        """Envía un mensaje, reutilizando la conexión indicada si existe
+        
+        'message' puede ser el mensaje ya serializado con CRLF (bandeja_salida.py).
+        """
+        own_connection = server is None
         try:
-            server = smtplib.SMTP(self.smtp_config.server, self.smtp_config.port)
-            
-            if self.smtp_config.use_tls:
-                server.starttls()
+            if own_connection:
+                server = self.open_connection()
             
-            server.login(self.smtp_config.user, self.smtp_config.password)
-            
-            text = message.as_string()
+            text = message if isinstance(message, bytes) else message.as_string()
             server.sendmail(self.smtp_config.user, recipient, text)
-            server.quit()
             
-            return True, "Enviado exitosamente"
+            if own_connection:
+                server.quit()
+            
+            return DeliveryResult(True, "Enviado exitosamente")
         
-        except smtplib.SMTPAuthenticationError:
-            return False, "Error de autenticación SMTP"
-        except smtplib.SMTPRecipientsRefused:
-            return False, "Destinatario rechazado"
+        except smtplib.SMTPAuthenticationError as e:
+            return DeliveryResult(False, "Error de autenticación SMTP", e.smtp_code, False)
+        except smtplib.SMTPRecipientsRefused as e:
+            codes = [code for code, _ in e.recipients.values()]
+            return DeliveryResult(False, "Destinatario rechazado", codes[0] if codes else None)
         except smtplib.SMTPServerDisconnected:
-            return False, "Servidor SMTP desconectado"
+            return DeliveryResult(False, "Servidor SMTP desconectado", connection_ok=False)
+        except smtplib.SMTPResponseException as e:
+            return DeliveryResult(False, f"Error SMTP: {e.smtp_code} {e.smtp_error!r}", e.smtp_code, False)
         except Exception as e:
-            return False, f"Error SMTP: {str(e)}"
+            return DeliveryResult(False, f"Error SMTP: {str(e)}", connection_ok=False)
+
+
+class SMTPConnection:
+    """Conexión SMTP perezosa y reutilizable para un grupo de envíos"""
+    
+    def __init__(self, sender: EmailSender, host: Optional[str] = None, port: Optional[int] = None):
+        self.sender = sender
+        self.host = host
+        self.port = port
+        self.last_used = time.monotonic()
+        self._server: Optional[smtplib.SMTP] = None
+    
+    def check_alive(self) -> bool:
+        """Comprueba con NOOP que una conexión reutilizada siga abierta"""
+        if self._server is None:
+            return False
+        try:
+            alive = self._server.noop()[0] == 250
+        except Exception:
+            alive = False
+        if not alive:
+            self.close()
+        return alive
+    
+    def send(self, message: Union[MIMEMultipart, bytes], recipient: str) -> DeliveryResult:
+        """Envía por la conexión abierta, abriéndola o reabriéndola si hace falta"""
+        self.last_used = time.monotonic()
+        if self._server is None:
+            try:
+                self._server = self.sender.open_connection(self.host, self.port)
+            except smtplib.SMTPAuthenticationError as e:
+                return DeliveryResult(False, "Error de autenticación SMTP", e.smtp_code, False)
+            except smtplib.SMTPResponseException as e:
+                return DeliveryResult(False, f"Error SMTP: {e.smtp_code} {e.smtp_error!r}", e.smtp_code, False)
+            except Exception as e:
+                return DeliveryResult(False, f"Error SMTP: {str(e)}", connection_ok=False)
+        
+        result = self.sender.deliver(message, recipient, self._server)
+        if not result.connection_ok:
+            self.close()
+        return result
+    
+    def close(self):
+        """Cierra la conexión ignorando errores del servidor"""
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+
+class SMTPConnectionPool:
+    """Conexiones SMTP que se mantienen abiertas entre ciclos del modo demonio"""
+    
+    def __init__(self, sender: EmailSender, idle_seconds: float):
+        self.sender = sender
+        self.idle_seconds = idle_seconds
+        self._idle: Dict[Tuple[Optional[str], Optional[int]], List[SMTPConnection]] = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, host: Optional[str] = None, port: Optional[int] = None) -> SMTPConnection:
+        """Entrega una conexión libre hacia host:port (verificada con NOOP) o una nueva"""
+        with self._lock:
+            idle = self._idle.get((host, port))
+            connection = idle.pop() if idle else None
+        if connection is None:
+            return SMTPConnection(self.sender, host, port)
+        # Si el servidor la cerró, send() la reabrirá
+        connection.check_alive()
+        return connection
+    
+    def release(self, connection: SMTPConnection):
+        """Devuelve una conexión al pool para el siguiente ciclo"""
+        with self._lock:
+            self._idle.setdefault((connection.host, connection.port), []).append(connection)
+    
+    def close_idle(self):
+        """Cierra las conexiones sin uso durante más de idle_seconds"""
+        limit = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for key, connections in self._idle.items():
+                expired = [c for c in connections if c.last_used < limit]
+                self._idle[key] = [c for c in connections if c.last_used >= limit]
+                for connection in expired:
+                    connection.close()
+    
+    def close_all(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+
+class PriorityScheduler:
+    """Montículo de envíos por prioridad con envejecimiento
+    
+    La prioridad efectiva de un envío es su prioridad más 'aging_per_minute'
+    puntos por minuto de espera. Como todos envejecen al mismo ritmo, el orden
+    solo depende de prioridad - ritmo * llegada, que sirve de clave fija en el
+    montículo: una factura poco prioritaria termina adelantando a las
+    importantes que llegan después y nunca queda relegada indefinidamente.
+    """
+    
+    def __init__(self, config: Dict = PRIORITY_CONFIG):
+        self.rate = float(config.get('aging_per_minute', 0)) / 60
+        self._heap: List[Tuple[float, int, List[PendingRow]]] = []
+        self._counter = itertools.count()
+    
+    def key(self, delivery: List[PendingRow]) -> float:
+        """Clave del envío: la de su factura más urgente"""
+        return max(row.priority - self.rate * row.queued_at for row in delivery)
+    
+    def push(self, delivery: List[PendingRow]):
+        # El contador desempata en orden de llegada al montículo
+        heapq.heappush(self._heap, (-self.key(delivery), next(self._counter), delivery))
+    
+    def pop(self) -> List[PendingRow]:
+        return heapq.heappop(self._heap)[2]
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def order(self, deliveries: List[List[PendingRow]]) -> List[List[PendingRow]]:
+        """Envíos de mayor a menor prioridad efectiva"""
+        for delivery in deliveries:
+            self.push(delivery)
+        return [self.pop() for _ in range(len(self._heap))]
+
+
+class CircuitBreaker:
+    """Corta los envíos cuando las fallas son del servidor SMTP y no de cada factura
+    
+    Tras 'failure_threshold' fallas sistémicas seguidas (sin conexión,
+    autenticación, 4xx) el circuito se abre y los hilos de envío esperan. Cada
+    'open_seconds' un solo envío pasa como sonda (semiabierto): si el servidor
+    responde se cierra y todos siguen; si vuelve a fallar se abre de nuevo. Si
+    el tiempo abierto acumulado en la ejecución (todas sus aperturas) superaría
+    'max_open_seconds' se abandona y lo que falta queda en pendientes como no
+    intentado.
+    """
+    
+    CLOSED, OPEN, HALF_OPEN = 'cerrado', 'abierto', 'semiabierto'
+    
+    def __init__(self, config: Dict = CIRCUIT_BREAKER_CONFIG):
+        self.threshold = max(1, int(config.get('failure_threshold', 5)))
+        self.open_seconds = float(config.get('open_seconds', 30))
+        self.max_open_seconds = float(config.get('max_open_seconds', 0))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.probes = 0
+        self.last_error = ''
+        self.abandoned = False
+        self._opened_at = 0.0
+        self._open_since = 0.0
+        self._paused = 0.0
+        self._prober: Optional[int] = None
+        self._condition = threading.Condition()
+    
+    def start_run(self):
+        """Nueva ejecución (o ciclo del demonio): la pausa acumulada vuelve a cero"""
+        with self._condition:
+            self.abandoned = False
+            self._paused = 0.0
+            self._open_since = time.monotonic()
+    
+    def wait_turn(self, should_stop: Callable[[], bool] = lambda: False) -> bool:
+        """Espera hasta poder enviar; False si se abandonó la ejecución o 'should_stop' lo pide"""
+        with self._condition:
+            while True:
+                if self.abandoned or should_stop():
+                    return False
+                if self.state == self.CLOSED:
+                    return True
+                if self.state == self.HALF_OPEN and self._prober == threading.get_ident():
+                    # La sonda no llegó al servidor (p. ej. error armando el mensaje): sigue con otro envío
+                    return True
+                now = time.monotonic()
+                probe_at = self._opened_at + self.open_seconds
+                if self._paused + (probe_at - self._open_since) > self.max_open_seconds:
+                    self.abandoned = True
+                    self._condition.notify_all()
+                    return False
+                if self.state == self.OPEN and now >= probe_at:
+                    # Este hilo hace la sonda; los demás esperan su resultado
+                    self.state = self.HALF_OPEN
+                    self._prober = threading.get_ident()
+                    self.probes += 1
+                    logging.info("Circuito SMTP semiabierto: se prueba un envío")
+                    return True
+                timeout = probe_at - now if self.state == self.OPEN else self.open_seconds
+                self._condition.wait(max(0.01, min(timeout, 1.0)))
+    
+    def record(self, result: DeliveryResult):
+        """Registra el resultado de un envío que llegó al servidor (o lo intentó)"""
+        with self._condition:
+            if not result.is_systemic:
+                if self.state != self.CLOSED:
+                    logging.info("Circuito SMTP cerrado: el servidor volvió a responder")
+                    self._paused += time.monotonic() - self._open_since
+                    self._condition.notify_all()
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            
+            self.failures += 1
+            self.last_error = result.detail
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                if self.state == self.CLOSED:
+                    self.trips += 1
+                    self._open_since = time.monotonic()
+                    logging.warning(f"Circuito SMTP abierto tras {self.failures} fallas seguidas: {result.detail}")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._condition.notify_all()
+    
+    def release_probe(self):
+        """El hilo de la sonda terminó su lote sin enviarla: otro hilo puede probar"""
+        with self._condition:
+            if self.state == self.HALF_OPEN and self._prober == threading.get_ident():
+                self.state = self.OPEN
+                self._prober = None
+                self._condition.notify_all()
+    
+    def summary(self) -> str:
+        text = (f"Circuito SMTP: abierto {self.trips} veces, {self.probes} sondas, "
+                f"último error: {self.last_error}")
+        return text + (" (ejecución abandonada)" if self.abandoned else "")
+
+
+class ConcurrencyTuner:
+    """Límite AIMD de envíos simultáneos según la latencia SMTP y la tasa de 4xx
+    
+    Cada envío ocupa un cupo mientras habla con el servidor. Cada 'window'
+    envíos se compara la latencia media con la mínima observada (la latencia
+    sin carga) y se cuenta la fracción de errores temporales o sistémicos: si
+    la latencia supera 'latency_tolerance' veces esa base o los errores
+    superan 'max_temp_failure_rate', el límite se multiplica por
+    'decrease_factor'; si no, y el límite estaba en uso, crece en uno. El
+    límite queda entre 'min_concurrency' y 'max_concurrency'.
+    """
+    
+    def __init__(self, config: Dict = AUTOTUNE_CONFIG, initial: Optional[int] = None):
+        self.minimum = max(1, int(config.get('min_concurrency', 1)))
+        self.maximum = max(self.minimum, int(config.get('max_concurrency', self.minimum)))
+        self.window = max(1, int(config.get('window', 20)))
+        self.tolerance = float(config.get('latency_tolerance', 2.0))
+        self.max_failure_rate = float(config.get('max_temp_failure_rate', 0.05))
+        self.decrease_factor = float(config.get('decrease_factor', 0.5))
+        self.baseline_drift = float(config.get('baseline_drift', 0.05))
+        start = initial if initial is not None else int(config.get('initial', self.minimum))
+        self.limit = float(min(self.maximum, max(self.minimum, start)))
+        self.baseline: Optional[float] = None
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        self._latencies: List[float] = []
+        self._failures = 0
+        self._samples = 0
+        self._window_peak = 0
+        self.start_run()
+    
+    @property
+    def level(self) -> int:
+        return int(self.limit)
+    
+    def start_run(self):
+        """Reinicia las estadísticas de la ejecución (el límite aprendido se conserva)"""
+        with self._condition:
+            self.increases = 0
+            self.decreases = 0
+            self.sends = 0
+            self._level_total = 0
+    
+    @contextlib.contextmanager
+    def slot(self):
+        """Cupo para un envío; espera mientras el límite está ocupado"""
+        with self._condition:
+            while self.in_flight >= self.level:
+                self._condition.wait()
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+            self.sends += 1
+            self._level_total += self.level
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+    
+    def record(self, result: DeliveryResult, seconds: float):
+        """Registra un envío y, al completar la ventana, ajusta el límite"""
+        with self._condition:
+            self._samples += 1
+            if result.is_temporary or result.is_systemic:
+                self._failures += 1
+            else:
+                self._latencies.append(seconds)
+            if self._samples < self.window:
+                return
+            
+            failure_rate = self._failures / self._samples
+            latency = sum(self._latencies) / len(self._latencies) if self._latencies else None
+            if latency is not None:
+                # La base sigue a la mínima, pero sube despacio si el servidor se vuelve más lento
+                self.baseline = latency if self.baseline is None else min(
+                    latency, self.baseline * (1 + self.baseline_drift))
+            
+            previous = self.level
+            if failure_rate > self.max_failure_rate or (
+                    latency is not None and latency > self.baseline * self.tolerance):
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                self.decreases += 1
+            elif self._window_peak >= previous:
+                self.limit = min(float(self.maximum), self.limit + 1)
+                self.increases += 1
+            if self.level != previous:
+                logging.info("Concurrencia de envío: %d -> %d (latencia %s, errores temporales %.0f%%)",
+                             previous, self.level,
+                             f"{latency * 1000:.0f} ms" if latency is not None else "-", failure_rate * 100)
+                self._condition.notify_all()
+            
+            self._latencies = []
+            self._failures = self._samples = 0
+            self._window_peak = self.in_flight
+    
+    def summary(self) -> str:
+        average = self._level_total / self.sends if self.sends else self.limit
+        baseline = f"{self.baseline * 1000:.0f} ms" if self.baseline is not None else "-"
+        return (f"Concurrencia de envío: final {self.level} (límites {self.minimum}-{self.maximum}, "
+                f"promedio {average:.1f}, {self.increases} aumentos, {self.decreases} reducciones, "
+                f"latencia base {baseline})")
+
+
+class DomainBatcher:
+    """Agrupa pendientes por dominio y los reparte en lotes con conexión propia"""
+    
+    def __init__(self, delivery_config: Dict):
+        self.config = delivery_config
+    
+    def group_by_domain(self, deliveries: List[List[PendingRow]]) -> Dict[str, List[List[PendingRow]]]:
+        """Agrupa envíos por dominio conservando el orden recibido (el de prioridad)"""
+        groups: Dict[str, List[List[PendingRow]]] = {}
+        for delivery in deliveries:
+            groups.setdefault(delivery[0].domain, []).append(delivery)
+        return groups
+    
+    def concurrency_for(self, domain: str) -> int:
+        """Número máximo de conexiones simultáneas hacia un dominio"""
+        limit = self.config.get('domain_concurrency', {}).get(
+            domain, self.config.get('per_domain_concurrency', 1)
+        )
+        return max(1, int(limit))
+    
+    def relay_for(self, domain: str) -> Tuple[Optional[str], Optional[int]]:
+        """Servidor de entrega para un dominio (None usa el relay configurado)"""
+        relay = self.config.get('domain_relays', {}).get(domain)
+        if relay:
+            return relay[0], relay[1]
+        return None, None
+    
+    def split(self, deliveries: List[List[PendingRow]]) -> List[Tuple[str, List[List[PendingRow]]]]:
+        """Divide los envíos en lotes (dominio, envíos)
+        
+        Primero los dominios con facturas de mayor prioridad y, a igual
+        prioridad, los más grandes.
+        """
+        batches = []
+        groups = self.group_by_domain(deliveries)
+        top_priority = {
+            domain: max(row.priority for delivery in group for row in delivery)
+            for domain, group in groups.items()
+        }
+        for domain in sorted(groups, key=lambda d: (top_priority[d], len(groups[d])), reverse=True):
+            domain_deliveries = groups[domain]
+            slots = min(self.concurrency_for(domain), len(domain_deliveries))
+            for slot in range(slots):
+                batches.append((domain, domain_deliveries[slot::slots]))
+        return batches
 
 
 class LogManager:
@@ -268,6 +900,11 @@ class LogManager:
     
     def __init__(self, path_config: PathConfig):
         self.path_config = path_config
+        self._lock = threading.Lock()
+        self._listener = None
+        # El log diario se rota la primera vez que se escribe cada día (rotacion_logs.py)
+        self._daily_log = SegmentedLog(self.path_config.log_diario)
+        self._daily_day: Optional[datetime.date] = None
         self._setup_logging()
     
     def _setup_logging(self):
@@ -276,24 +913,46 @@ class LogManager:
         log_dir = Path(self.path_config.log_enviador).parent
         log_dir.mkdir(parents=True, exist_ok=True)
         
+        if LOGGING_CONFIG.get('enviador_mode') == 'cola':
+            self.use_queue_logging()
+            return
+        
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s [%(levelname)s] %(message)s',
             handlers=[
-                logging.FileHandler(self.path_config.log_enviador, encoding='utf-8'),
+                SegmentedFileHandler(self.path_config.log_enviador),
                 logging.StreamHandler()
             ]
         )
     
-    def log_shipment(self, pdf_file: str, email: str, status: str):
-        """Registra resultado de envío en log CSV"""
+    def use_queue_logging(self):
+        """Pasa al registro en segundo plano: JSON lines en enviador.jsonl (rotado)
+        
+        Los hilos de envío solo encolan; el formato y la escritura ocurren en el
+        hilo del listener, que vacía la cola al terminar el proceso.
+        """
+        if self._listener is not None:
+            return
+        json_file = Path(self.path_config.log_enviador).with_suffix('.jsonl')
+        self._listener = start_queue_logging(str(json_file), LOGGING_CONFIG.get('sampling', {}),
+                                             getattr(logging, LOGGING_CONFIG.get('level', 'INFO')),
+                                             LOGGING_CONFIG.get('format'))
+        atexit.register(self._listener.stop)
+    
+    def log_shipment(self, pdf_file: str, email: str, status: str, original: str = ''):
+        """Registra resultado de envío en log CSV
+        
+        'original' es el destinatario real cuando el envío se redirigió a prueba.
+        """
         # Crear directorio si no existe
         log_dir = Path(self.path_config.log_envios).parent
         log_dir.mkdir(parents=True, exist_ok=True)
         
-        with open(self.path_config.log_envios, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow([pdf_file, email, status])
+        with self._lock:
+            with open(self.path_config.log_envios, 'a', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow([pdf_file, email, status, original] if original else [pdf_file, email, status])
     
     def log_daily(self, message: str):
         """Registra mensaje en log diario"""
@@ -301,9 +960,98 @@ class LogManager:
         log_dir = Path(self.path_config.log_diario).parent
         log_dir.mkdir(parents=True, exist_ok=True)
         
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(self.path_config.log_diario, 'a', encoding='utf-8') as f:
-            f.write(f"{timestamp} [ENVIADOR] {message}\n")
+        now = datetime.datetime.now()
+        timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            if self._daily_day != now.date():
+                self._daily_day = now.date()
+                try:
+                    self._daily_log.rotate()
+                except OSError as e:
+                    logging.warning(f"No se pudo rotar el log diario: {str(e)}")
+            with open(self.path_config.log_diario, 'a', encoding='utf-8') as f:
+                f.write(f"{timestamp} [ENVIADOR] {message}\n")
+
+
+class PendingIndex:
+    """Índice de desplazamientos de las líneas del archivo de pendientes
+    
+    El archivo se recorre con mmap y solo se guarda el byte inicial de cada
+    línea en un array de enteros de 8 bytes: la memoria no depende del largo de
+    rutas y correos. Las líneas se copian del mapa solo al pedirlas, por
+    tramos, y el resumen (blake2b) del contenido indexado permite comprobar al
+    reescribir que nadie lo reemplazó.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = array('Q')
+        self.size = 0
+        self.digest = b''
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+    
+    @staticmethod
+    def content_digest(data) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+    
+    def open(self) -> 'PendingIndex':
+        self._file = open(self.path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size == 0:
+            self.digest = self.content_digest(b'')
+            return self
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Una última línea sin fin de línea aún se está escribiendo: queda para el próximo ciclo
+        self.size = self._map.rfind(b'\n') + 1
+        # Inicio de cada línea = suma de los largos anteriores (cada línea leída se descarta al sumarla)
+        self.offsets = array('Q', itertools.accumulate(map(len, iter(self._map.readline, b'')), initial=0))
+        self.offsets.pop()
+        while self.offsets and self.offsets[-1] >= self.size:
+            self.offsets.pop()
+        self._map.seek(0)
+        with memoryview(self._map) as view:
+            self.digest = self.content_digest(view[:self.size])
+        return self
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def __len__(self) -> int:
+        return len(self.offsets)
+    
+    def span(self, start: int, stop: int) -> Tuple[int, int]:
+        """Bytes [inicio, fin) de las líneas start..stop-1"""
+        stop = min(stop, len(self.offsets))
+        if start >= stop:
+            return 0, 0
+        end = self.offsets[stop] if stop < len(self.offsets) else self.size
+        return self.offsets[start], end
+    
+    def lines(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """Líneas start..stop-1 decodificadas (con su fin de línea)"""
+        stop = len(self.offsets) if stop is None else stop
+        begin, end = self.span(start, stop)
+        if begin == end:
+            return []
+        return self._map[begin:end].decode('utf-8').splitlines(keepends=True)
+    
+    def copy_lines(self, output, skip: Set[int]):
+        """Escribe en 'output' las líneas indexadas salvo las de 'skip', por tramos contiguos"""
+        run_start = None
+        for line_num in range(len(self.offsets) + 1):
+            keep = line_num < len(self.offsets) and line_num not in skip
+            if keep and run_start is None:
+                run_start = line_num
+            elif not keep and run_start is not None:
+                begin, end = self.span(run_start, line_num)
+                output.write(self._map[begin:end])
+                run_start = None
 
 
 class PendingFileManager:
@@ -311,19 +1059,65 @@ class PendingFileManager:
     
     def __init__(self, pending_file: str):
         self.pending_file = pending_file
+        self.lock_file = pending_file + '.lock'
+        self._index: Optional[PendingIndex] = None
+    
+    def _lock(self):
+        """Bloqueo exclusivo entre procesos que reescriben el archivo"""
+        handle = open(self.lock_file, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
     
-    def update_pending_file(self, successful_rows: List[int]):
-        """Actualiza archivo de pendientes eliminando líneas exitosas"""
+    def open_index(self) -> PendingIndex:
+        """Indexa el archivo y lo recuerda para la actualización posterior"""
+        if self._index is not None:
+            self._index.close()
+        self._index = PendingIndex(self.pending_file).open()
+        return self._index
+    
+    def read_lines(self) -> List[str]:
+        """Lee todas las líneas del archivo (indexándolo para la actualización posterior)"""
+        return self.open_index().lines()
+    
+    def update_pending_file(self, successful_rows: Iterable[int]):
+        """Actualiza archivo de pendientes eliminando líneas exitosas
+        
+        Las líneas anexadas mientras se enviaba (p. ej. por el generador con el
+        enviador en modo demonio) se conservan. Si el archivo fue reemplazado,
+        los números de fila ya no corresponden y no se elimina nada. Las líneas
+        se copian en bytes desde el mapa del índice, sin cargarlas como texto.
+        """
+        index, self._index = self._index, None
         if not os.path.exists(self.pending_file):
+            if index is not None:
+                index.close()
             return
         
-        with open(self.pending_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        remaining_lines = [line for i, line in enumerate(lines) if i not in successful_rows]
-        
-        with open(self.pending_file, 'w', encoding='utf-8') as f:
-            f.writelines(remaining_lines)
+        handle = self._lock()
+        try:
+            if index is None:
+                index = PendingIndex(self.pending_file).open()
+            with open(self.pending_file, 'rb') as f:
+                current_size = os.fstat(f.fileno()).st_size
+                unchanged = current_size >= index.size
+                if unchanged and index.size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as current:
+                        with memoryview(current) as view:
+                            unchanged = PendingIndex.content_digest(view[:index.size]) == index.digest
+                if not unchanged:
+                    logging.warning("El archivo de pendientes fue reemplazado durante el envío; no se actualiza")
+                    return
+                
+                tmp_file = self.pending_file + '.tmp'
+                with open(tmp_file, 'wb') as output:
+                    index.copy_lines(output, set(successful_rows))
+                    # Lo anexado después de indexar
+                    f.seek(index.size)
+                    shutil.copyfileobj(f, output)
+            os.replace(tmp_file, self.pending_file)
+        finally:
+            index.close()
+            handle.close()
 
 
 class ReportGenerator:
@@ -362,8 +1156,14 @@ class ReportGenerator:
             'total_emails': 0,
             'successful_emails': 0,
             'failed_emails': 0,
+            'deferred_emails': 0,
+            'suppressed_emails': 0,
+            'concurrency': '',
             'total_vendido': 0,
-            'pagos_completos': 0
+            'pagos_completos': 0,
+            'pdf_bytes_before': 0,
+            'pdf_bytes_after': 0,
+            'ventas': {}
         }
         
         # Estadísticas de envíos
@@ -374,27 +1174,37 @@ class ReportGenerator:
                     stats['total_emails'] += 1
                     if row['status'] == 'exitoso':
                         stats['successful_emails'] += 1
+                    elif row['status'] == 'diferido':
+                        stats['deferred_emails'] += 1
+                    elif row['status'] == 'suprimido':
+                        stats['suppressed_emails'] += 1
                     else:
                         stats['failed_emails'] += 1
         
-        # Estadísticas de ventas desde log diario
-        if os.path.exists(self.path_config.log_diario):
-            with open(self.path_config.log_diario, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if 'Monto total procesado' in line:
-                        match = re.search(r'L(\d+)', line)
-                        if match:
-                            stats['total_vendido'] = int(match.group(1))
-                    elif 'Pagos completos' in line:
-                        match = re.search(r'Pagos completos: (\d+)', line)
-                        if match:
-                            stats['pagos_completos'] = int(match.group(1))
+        # Estadísticas de ventas del día desde el almacén columnar de compras
+        sales = SalesStore().daily_summary()
+        stats['total_vendido'] = sales['monto']
+        stats['pagos_completos'] = sales['pagos_completos']
+        stats['ventas'] = sales
+        
+        # Optimización de PDFs del día desde el log diario (solo los segmentos de hoy)
+        today = datetime.date.today().isoformat()
+        for line in SegmentedLog(self.path_config.log_diario).lines(since=today):
+            if 'Concurrencia de envío: final' in line:
+                # La última ejecución del día
+                stats['concurrency'] = line.split('Concurrencia de envío: final', 1)[1].strip()
+            if 'Optimización de PDFs' in line:
+                match = re.search(r'(\d+) bytes -> (\d+) bytes', line)
+                if match:
+                    stats['pdf_bytes_before'] += int(match.group(1))
+                    stats['pdf_bytes_after'] += int(match.group(2))
         
         return stats
     
     def _create_report_content(self, stats: Dict) -> str:
         """Crea contenido del reporte"""
         success_rate = (stats['successful_emails']/stats['total_emails']*100) if stats['total_emails'] > 0 else 0
+        saved_rate = (100 - stats['pdf_bytes_after']/stats['pdf_bytes_before']*100) if stats['pdf_bytes_before'] > 0 else 0
         
         return f"""
 === REPORTE DIARIO DE FACTURACIÓN ===
@@ -404,11 +1214,19 @@ ENVÍO DE CORREOS:
 - Total de correos procesados: {stats['total_emails']}
 - Envíos exitosos: {stats['successful_emails']}
 - Envíos fallidos: {stats['failed_emails']}
+- Envíos diferidos: {stats['deferred_emails']}
+- Envíos suprimidos (rebote permanente): {stats['suppressed_emails']}
+- Concurrencia de envío: {stats['concurrency'] or 'sin ajuste automático'}
 - Tasa de éxito: {success_rate:.1f}%
 
 VENTAS:
 - Total vendido: L{stats['total_vendido']:,}
 - Pagos completos: {stats['pagos_completos']}
+{self._format_sales_breakdown(stats['ventas'])}
+
+PDFS ADJUNTOS:
+- Tamaño antes de optimizar: {stats['pdf_bytes_before'] / 1024:,.0f} KB
+- Tamaño optimizado: {stats['pdf_bytes_after'] / 1024:,.0f} KB (-{saved_rate:.1f}%)
 
 ARCHIVOS GENERADOS:
 - Log de envíos: {self.path_config.log_envios}
@@ -417,6 +1235,22 @@ ARCHIVOS GENERADOS:
 === FIN DEL REPORTE ===
 """
     
+    @staticmethod
+    def _format_sales_breakdown(sales: Dict, top_cities: int = 5) -> str:
+        """Líneas de ventas del día por tipo de pago, estado y ciudad"""
+        lines = []
+        for title, key in (('Por tipo de pago', 'por_pago'), ('Por estado', 'por_estado')):
+            groups = sales.get(key, {})
+            if groups:
+                lines.append(f"- {title}: " + ", ".join(
+                    f"{value[0] or '(vacío)'} {count} (L{amount:,})"
+                    for value, (count, amount) in sorted(groups.items(), key=lambda item: -item[1][1])))
+        cities = sorted(sales.get('por_ciudad', {}).items(), key=lambda item: -item[1][1])
+        if cities:
+            lines.append("- Ciudades con más ventas: " + ", ".join(
+                f"{value[0] or '(vacío)'} L{amount:,}" for value, (count, amount) in cities[:top_cities]))
+        return "\n".join(lines)
+    
     def _save_report(self, report_content: str) -> str:
         """Guarda el reporte en archivo"""
         # Crear directorio si no existe
@@ -428,6 +1262,8 @@ ARCHIVOS GENERADOS:
         with open(report_file, 'w', encoding='utf-8') as f:
             f.write(report_content)
         
+        ArtifactManifest().register(str(report_file), 'report')
+        
         return str(report_file)
 
 
@@ -441,62 +1277,445 @@ class EmailProcessor:
         
         # Inicializar componentes
         self.log_manager = LogManager(self.path_config)
-        self.email_validator = EmailValidator()
-        self.message_builder = EmailMessageBuilder(self.smtp_config)
+        self.email_validator = EmailValidator(
+            check_domain=VALIDATION_CONFIG.get('check_domain', False),
+            use_idna=VALIDATION_CONFIG.get('idna', False)
+        )
+        self.invoice_store = InvoiceStore()
+        self.message_builder = EmailMessageBuilder(self.smtp_config, self.invoice_store)
         self.email_sender = EmailSender(self.smtp_config)
         self.pending_manager = PendingFileManager(self.path_config.pending_file)
         self.report_generator = ReportGenerator(self.path_config, self.log_manager)
+        
+        # Usados por el modo demonio (SenderDaemon)
+        self.connection_pool: Optional[SMTPConnectionPool] = None
+        self.stop_requested: Optional[threading.Event] = None
+        self.retry_later: List[str] = []
+        self.rejected: List[str] = []
+        self._retry_lock = threading.Lock()
+        
+        # Cola compartida con arrendamientos (QUEUE_CONFIG / --cola)
+        self.work_queue: Optional[WorkQueue] = None
+        self.worker = worker_id()
+        
+        # Límite de tiempo de la ejecución única; las facturas que no alcanzan quedan en not_attempted
+        self.budget: Optional[RunBudget] = None
+        self.not_attempted: List[str] = []
+        # Filas de tramos de pendientes que ni se leyeron al detenerse (solo se cuentan)
+        self.unread_rows = 0
+        
+        # Destinatarios con rebote permanente (SUPPRESSION_CONFIG)
+        self.suppression: Optional[SuppressionList] = None
+        if SUPPRESSION_CONFIG.get('enabled', False):
+            self.suppression = SuppressionList()
+        self.suppressed = 0
+        
+        # Envíos simultáneos ajustados por latencia y 4xx (AUTOTUNE_CONFIG)
+        self.tuner: Optional[ConcurrencyTuner] = None
+        if AUTOTUNE_CONFIG.get('enabled', False):
+            self.tuner = ConcurrencyTuner(initial=int(DELIVERY_CONFIG.get('max_workers', 1)))
+        
+        # Fallas sistémicas del servidor SMTP (CIRCUIT_BREAKER_CONFIG)
+        self.breaker: Optional[CircuitBreaker] = None
+        if CIRCUIT_BREAKER_CONFIG.get('enabled', False):
+            self.breaker = CircuitBreaker()
+        
+        # Redirección de prueba (TEST_REDIRECT_CONFIG / --redirigir-prueba)
+        self.redirector: Optional[TestRedirector] = None
+        if TEST_REDIRECT_CONFIG.get('enabled', False):
+            self.redirector = TestRedirector(
+                float(TEST_REDIRECT_CONFIG['fraction']), TEST_REDIRECT_CONFIG['recipients'],
+                TEST_REDIRECT_CONFIG.get('salt', '')
+            )
+        self.redirected = 0
+        
+        # Bandeja de salida: mensajes construidos en procesos aparte (SPOOL_CONFIG / --bandeja)
+        self.spool: Optional[MessageSpool] = MessageSpool(invoice_store=self.invoice_store) if SPOOL_CONFIG.get('enabled', False) else None
     
-    def process_pending_emails(self) -> Tuple[int, int, int]:
-        """Procesa archivo de pendientes y envía correos"""
+    def process_pending_emails(self, skip: Optional[Set[str]] = None) -> Tuple[int, int, int]:
+        """Procesa archivo de pendientes y envía correos
         
-        if not os.path.exists(self.path_config.pending_file):
+        Las filas cuyo PDF está en 'skip' se dejan en pendientes sin intentarlas.
+        Al terminar, retry_later contiene los PDFs fallidos, inválidos o diferidos.
+        Con work_queue las facturas se toman de la cola compartida (_process_queue).
+        """
+        self.retry_later = []
+        self.rejected = []
+        self.not_attempted = []
+        self.unread_rows = 0
+        self.redirected = 0
+        self.suppressed = 0
+        if self.breaker is not None:
+            self.breaker.start_run()
+        if self.tuner is not None:
+            self.tuner.start_run()
+        
+        if self.work_queue is None and not os.path.exists(self.path_config.pending_file):
             logging.error(f"Archivo de pendientes no encontrado: {self.path_config.pending_file}")
             return 0, 0, 0
         
         # Inicializar log de envíos si no existe
         self._initialize_shipment_log()
         
-        successful_rows = []
-        total_processed = 0
-        successful_count = 0
-        failed_count = 0
-        
         self.log_manager.log_daily("=== INICIO DE ENVÍO DE CORREOS ===")
         
-        try:
-            with open(self.path_config.pending_file, 'r', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile)
-                
-                for row_num, row in enumerate(reader):
-                    if len(row) < 2:
-                        continue
-                    
-                    pdf_path = row[0].strip()
-                    email = row[1].strip()
-                    total_processed += 1
-                    
-                    logging.info(f"Procesando {total_processed}: {pdf_path} -> {email}")
-                    
-                    # Procesar envío
-                    success = self._process_single_email(pdf_path, email, row_num, successful_rows)
-                    
-                    if success:
-                        successful_count += 1
-                    else:
-                        failed_count += 1
+        if self.work_queue is not None:
+            total_processed, successful_count, failed_count, deferred_count = self._process_queue()
+        else:
+            try:
+                index = self.pending_manager.open_index()
+            except Exception as e:
+                logging.error(f"Error procesando archivo de pendientes: {str(e)}")
+                return 0, 0, 0
+            
+            successful_rows = array('Q')
+            total_processed, successful_count, failed_count, deferred_count = self._process_pending_index(
+                index, skip, successful_rows
+            )
+            
+            # Actualizar archivo de pendientes
+            self.pending_manager.update_pending_file(successful_rows)
+        
+        if self.suppression is not None:
+            self.suppression.save()
+        
+        # Log final
+        self._log_final_summary(total_processed, successful_count, failed_count, deferred_count)
         
+        return successful_count, failed_count, total_processed
+    
+    def _process_pending_index(self, index: PendingIndex, skip: Optional[Set[str]],
+                               successful_rows: array) -> Tuple[int, int, int, int]:
+        """Envía el archivo de pendientes por tramos de 'pending_chunk_rows' filas
+        
+        Solo las filas del tramo en curso existen como objetos; la prioridad y
+        la agrupación por dominio se aplican dentro de cada tramo. Si se pide
+        detener o se agota el presupuesto, los tramos restantes quedan en
+        pendientes. Los números de fila enviados se agregan a 'successful_rows'.
+        Devuelve (total, exitosos, fallidos, diferidos).
+        """
+        chunk_rows = max(1, int(LIMITS.get('pending_chunk_rows', 50000)))
+        totals = [0, 0, 0, 0]
+        
+        for start in range(0, len(index), chunk_rows):
+            if start and self._should_stop():
+                self.unread_rows = len(index) - start
+                logging.info(f"{self.unread_rows} filas de pendientes quedan para la próxima ejecución")
+                break
+            rows = self._read_pending_rows(index, start, start + chunk_rows)
+            if skip:
+                rows = [row for row in rows if row.pdf_path not in skip]
+            chunk_successful: List[int] = []
+            counts = self._send_rows(rows, chunk_successful)
+            successful_rows.extend(chunk_successful)
+            totals[0] += len(rows)
+            for position, count in enumerate(counts, 1):
+                totals[position] += count
+        
+        return totals[0], totals[1], totals[2], totals[3]
+    
+    def _send_rows(self, rows: List[PendingRow], successful_rows: List[int]) -> Tuple[int, int, int]:
+        """Prevalida, agrupa y entrega filas; devuelve (exitosos, fallidos, diferidos)"""
+        # Validar todo el lote antes de enviar
+        rows, invalid_count = self._prevalidate_rows(rows)
+        deliveries = PriorityScheduler().order(self._build_deliveries(rows))
+        
+        # Con bandeja, los mensajes se construyen en orden de prioridad mientras se entregan
+        if self.spool is not None and deliveries:
+            self.spool.start(self.smtp_config)
+            for delivery in deliveries:
+                email, _ = self._recipient_for(delivery)
+                self.spool.submit(self._spool_name(delivery), email, self._invoices_for(delivery))
+        
+        # Procesar envíos
+        if DELIVERY_CONFIG.get('group_by_domain', False):
+            successful_count, failed_count, deferred_count = self._deliver_by_domain(deliveries, successful_rows)
+        else:
+            successful_count, failed_count, deferred_count = self._deliver_batch(
+                '', deliveries, self._acquire_connection(), successful_rows
+            )
+        
+        return successful_count, failed_count + invalid_count, deferred_count
+    
+    def _process_queue(self) -> Tuple[int, int, int, int]:
+        """Envía lotes arrendados de la cola compartida hasta vaciarla
+        
+        Primero se importa el archivo de pendientes. Mientras se envía un lote sus
+        arrendamientos se renuevan en segundo plano; al terminar, las enviadas se
+        marcan, las inválidas se apartan, las fallidas o diferidas vuelven a la
+        cola tras 'retry_seconds' y las no intentadas vuelven de inmediato.
+        Devuelve (total, exitosos, fallidos, diferidos).
+        """
+        queue = self.work_queue
+        try:
+            imported = import_pending_file(queue, self.pending_manager)
+            if imported:
+                logging.info(f"{imported} facturas importadas a la cola de envíos")
         except Exception as e:
-            logging.error(f"Error procesando archivo de pendientes: {str(e)}")
+            logging.error(f"Error importando pendientes a la cola: {str(e)}")
+        
+        batch_size = max(1, int(QUEUE_CONFIG.get('batch_size', 50)))
+        retry_delay = float(QUEUE_CONFIG.get('retry_seconds', 300))
+        total = successful = failed = deferred = 0
+        
+        while not self._should_stop():
+            items = queue.claim(self.worker, batch_size)
+            if not items:
+                break
+            
+            rows = [PendingRow(item.id, item.pdf_path, item.email, item.priority, item.queued_at)
+                    for item in items]
+            ids_by_pdf = {item.pdf_path: item.id for item in items}
+            retry_start, rejected_start = len(self.retry_later), len(self.rejected)
+            successful_rows: List[int] = []
+            
+            with queue.lease_keeper(self.worker):
+                batch_successful, batch_failed, batch_deferred = self._send_rows(rows, successful_rows)
+            
+            done = set(successful_rows)
+            rejected = {ids_by_pdf[pdf] for pdf in self.rejected[rejected_start:]}
+            retry = {ids_by_pdf[pdf] for pdf in self.retry_later[retry_start:]} - rejected - done
+            untouched = set(ids_by_pdf.values()) - done - rejected - retry
+            
+            queue.complete(self.worker, done)
+            queue.reject(self.worker, rejected)
+            queue.release(self.worker, retry, retry_delay)
+            queue.release(self.worker, untouched)
+            
+            total += len(items)
+            successful += batch_successful
+            failed += batch_failed
+            deferred += batch_deferred
+        
+        if self.budget is not None and self.budget.exhausted:
+            logging.info(f"Límite de tiempo: quedan {queue.stats()['profundidad']} facturas en la cola")
+        
+        return total, successful, failed, deferred
+    
+    def _read_pending_rows(self, index: PendingIndex, start: int, stop: int) -> List[PendingRow]:
+        """Filas válidas del tramo [start, stop) del archivo de pendientes"""
+        rows = []
+        now = time.time()
+        reader = csv.reader(index.lines(start, stop))
+        for row_num, row in enumerate(reader, start):
+            if len(row) < 2:
+                continue
+            pdf_path = row[0].strip()
+            # Tercera columna opcional: prioridad (generador_facturas.py)
+            priority = int(row[2]) if len(row) > 2 and re.fullmatch(r'-?\d+', row[2].strip()) else 0
+            # La fecha del PDF aproxima cuándo entró a pendientes
+            queued_at = os.path.getmtime(pdf_path) if os.path.exists(pdf_path) else now
+            rows.append(PendingRow(row_num, pdf_path, row[1].strip(), priority, queued_at))
+        return rows
+    
+    def _acquire_connection(self, host: Optional[str] = None, port: Optional[int] = None) -> SMTPConnection:
+        """Conexión del pool del demonio o, en ejecución única, una nueva"""
+        if self.connection_pool is not None:
+            return self.connection_pool.acquire(host, port)
+        return SMTPConnection(self.email_sender, host, port)
+    
+    def _release_connection(self, connection: SMTPConnection):
+        if self.connection_pool is not None:
+            self.connection_pool.release(connection)
+        else:
+            connection.close()
+    
+    def _should_stop(self, units: int = 1) -> bool:
+        """Detención pedida por el demonio, circuito SMTP abandonado o presupuesto
+        de tiempo insuficiente para 'units' facturas"""
+        if self.stop_requested is not None and self.stop_requested.is_set():
+            return True
+        if self.breaker is not None and self.breaker.abandoned:
+            return True
+        return self.budget is not None and not self.budget.allows(units)
+    
+    def _stop_reason(self) -> str:
+        if self.breaker is not None and self.breaker.abandoned:
+            return "circuito SMTP abierto"
+        if self.budget is not None and self.budget.exhausted:
+            return "límite de tiempo"
+        return "detención"
+    
+    def _mark_retry(self, rows: List[PendingRow]):
+        with self._retry_lock:
+            self.retry_later.extend(row.pdf_path for row in rows)
+    
+    def _prevalidate_rows(self, rows: List[PendingRow]) -> Tuple[List[PendingRow], int]:
+        """Separa en una sola pasada las filas entregables de las inválidas
+        
+        Cada dirección distinta se valida una sola vez; las filas inválidas se
+        registran en el log de envíos y permanecen en pendientes. Las de
+        destinatarios suprimidos por rebote permanente se registran como
+        'suprimido' y tampoco se intentan.
+        """
+        deliverable = []
+        invalid = 0
+        
+        for row in rows:
+            normalized = self.email_validator.check(row.email)
+            if normalized is None:
+                logging.error(f"Email inválido: {row.email}")
+                self.log_manager.log_shipment(row.pdf_path, row.email, "Email inválido")
+                self._mark_retry([row])
+                self.rejected.append(row.pdf_path)
+                invalid += 1
+                continue
+            
+            if not self.invoice_store.exists(row.pdf_path):
+                logging.error(f"PDF no encontrado: {row.pdf_path}")
+                self.log_manager.log_shipment(row.pdf_path, row.email, "PDF no encontrado")
+                self._mark_retry([row])
+                self.rejected.append(row.pdf_path)
+                invalid += 1
+                continue
+            
+            if self.suppression is not None and self.suppression.contains(normalized):
+                logging.info("Destinatario suprimido: %s -> %s", row.pdf_path, normalized,
+                             extra={'categoria': 'envio', 'pdf': row.pdf_path, 'correo': normalized})
+                self.log_manager.log_shipment(row.pdf_path, row.email, "suprimido")
+                self._mark_retry([row])
+                self.rejected.append(row.pdf_path)
+                self.suppressed += 1
+                continue
+            
+            row.email = normalized
+            deliverable.append(row)
+        
+        logging.info(
+            f"Prevalidación: {len(deliverable)} entregables, {invalid} inválidas "
+            f"({self.email_validator.distinct_checked} direcciones distintas)"
+        )
+        return deliverable, invalid
+    
+    @staticmethod
+    def _encoded_size(size: int) -> int:
+        """Bytes de un adjunto dentro del mensaje: base64 en líneas de 76 con CRLF, más sus encabezados"""
+        encoded = 4 * -(-size // 3)
+        return encoded + 2 * -(-encoded // 76) + 512
+    
+    def _build_deliveries(self, rows: List[PendingRow]) -> List[List[PendingRow]]:
+        """Agrupa las filas en envíos (un mensaje por elemento)
+        
+        Con 'coalesce_by_recipient' las facturas de un mismo destinatario viajan
+        juntas en un solo mensaje, sin que los adjuntos ya codificados en base64
+        superen LIMITS['max_file_size_mb'] (el límite habitual de los servidores
+        se aplica al mensaje, no a los PDFs).
+        """
+        if not DELIVERY_CONFIG.get('coalesce_by_recipient', False):
+            return [[row] for row in rows]
+        
+        max_bytes = LIMITS['max_file_size_mb'] * 1024 * 1024
+        by_recipient: Dict[str, List[PendingRow]] = {}
+        for row in rows:
+            by_recipient.setdefault(row.email.lower(), []).append(row)
+        
+        deliveries = []
+        for recipient_rows in by_recipient.values():
+            current: List[PendingRow] = []
+            current_size = 0
+            for row in recipient_rows:
+                size = self._encoded_size(self.invoice_store.size(row.pdf_path))
+                if current and current_size + size > max_bytes:
+                    deliveries.append(current)
+                    current, current_size = [], 0
+                current.append(row)
+                current_size += size
+            deliveries.append(current)
+        
+        if len(deliveries) < len(rows):
+            logging.info(f"{len(rows)} facturas agrupadas en {len(deliveries)} mensajes por destinatario")
+        return deliveries
+    
+    def _deliver_by_domain(self, deliveries: List[List[PendingRow]], successful_rows: List[int]) -> Tuple[int, int, int]:
+        """Entrega los pendientes agrupados por dominio en paralelo
+        
+        Cada lote usa su propia conexión SMTP, de modo que un dominio lento o
+        con greylisting solo retrasa sus propios envíos. Con el ajuste automático
+        hay hasta 'max_concurrency' hilos y el tuner decide cuántos envían a la vez.
+        """
+        batcher = DomainBatcher(DELIVERY_CONFIG)
+        batches = batcher.split(deliveries)
+        if not batches:
             return 0, 0, 0
         
-        # Actualizar archivo de pendientes
-        self.pending_manager.update_pending_file(successful_rows)
+        logging.info(f"Entregando {len(deliveries)} correos en {len(batches)} lotes por dominio")
         
-        # Log final
-        self._log_final_summary(total_processed, successful_count, failed_count)
+        workers = self.tuner.maximum if self.tuner is not None else int(DELIVERY_CONFIG.get('max_workers', 1))
+        max_workers = max(1, min(workers, len(batches)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for domain, domain_deliveries in batches:
+                host, port = batcher.relay_for(domain)
+                connection = self._acquire_connection(host, port)
+                futures.append(executor.submit(
+                    self._deliver_batch, domain, domain_deliveries, connection, successful_rows
+                ))
+            results = [future.result() for future in futures]
         
-        return successful_count, failed_count, total_processed
+        successful = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        deferred = sum(r[2] for r in results)
+        return successful, failed, deferred
+    
+    def _deliver_batch(self, domain: str, deliveries: List[List[PendingRow]], connection: SMTPConnection,
+                       successful_rows: List[int]) -> Tuple[int, int, int]:
+        """Envía un lote de mensajes por una misma conexión
+        
+        Tras varios errores temporales (4xx) seguidos el resto del lote se difiere
+        y queda en pendientes para la próxima ejecución. Lo mismo ocurre, sin
+        registrarse, con lo que no alcanza el presupuesto de tiempo o lo que
+        queda cuando se abandona el circuito SMTP. Los contadores son por factura.
+        """
+        defer_threshold = int(DELIVERY_CONFIG.get('defer_after_temp_failures', 0))
+        successful = failed = deferred = 0
+        consecutive_temporary = 0
+        not_attempted = 0
+        
+        try:
+            for delivery in deliveries:
+                if self._should_stop(len(delivery)) or (
+                        self.breaker is not None
+                        and not self.breaker.wait_turn(lambda: self._should_stop(len(delivery)))):
+                    # Detención ordenada: el resto queda en pendientes sin registrarse
+                    not_attempted += len(delivery)
+                    with self._retry_lock:
+                        self.not_attempted.extend(row.pdf_path for row in delivery)
+                    continue
+                
+                if defer_threshold and consecutive_temporary >= defer_threshold:
+                    for row in delivery:
+                        self.log_manager.log_shipment(row.pdf_path, row.email, "diferido")
+                    self._mark_retry(delivery)
+                    deferred += len(delivery)
+                    continue
+                
+                for row in delivery:
+                    logging.info("Procesando %d: %s -> %s", row.row_num + 1, row.pdf_path, row.email,
+                                 extra={'categoria': 'fila', 'pdf': row.pdf_path, 'correo': row.email})
+                
+                result = self._process_delivery(delivery, connection, successful_rows)
+                if self.budget is not None:
+                    self.budget.record(len(delivery))
+                
+                if result.success:
+                    successful += len(delivery)
+                    consecutive_temporary = 0
+                else:
+                    failed += len(delivery)
+                    self._mark_retry(delivery)
+                    consecutive_temporary = consecutive_temporary + 1 if result.is_temporary else 0
+        finally:
+            self._release_connection(connection)
+            if self.breaker is not None:
+                self.breaker.release_probe()
+        
+        if not_attempted:
+            logging.info(f"Dominio {domain or '(sin dominio)'}: {not_attempted} envíos quedan pendientes "
+                         f"por {self._stop_reason()}")
+        if deferred:
+            logging.warning(f"Dominio {domain or '(sin dominio)'}: {deferred} envíos diferidos por errores temporales")
+        
+        return successful, failed, deferred
     
     def _initialize_shipment_log(self):
         """Inicializa el archivo de log de envíos"""
@@ -506,50 +1725,111 @@ class EmailProcessor:
             
             with open(self.path_config.log_envios, 'w', newline='', encoding='utf-8') as csvfile:
                 writer = csv.writer(csvfile)
-                writer.writerow(['pdf_file', 'email', 'status'])
+                writer.writerow(['pdf_file', 'email', 'status', 'original'])
+    
+    def _recipient_for(self, delivery: List[PendingRow]) -> Tuple[str, str]:
+        """(destinatario efectivo, original si se redirigió a prueba o '')"""
+        original = delivery[0].email
+        test_recipient = self.redirector.target(original) if self.redirector is not None else None
+        if test_recipient:
+            return test_recipient, original
+        return original, ''
+    
+    @staticmethod
+    def _invoices_for(delivery: List[PendingRow]) -> List[Tuple[str, str]]:
+        """(pdf_path, invoice_id) de cada factura del envío"""
+        return [
+            (row.pdf_path, os.path.basename(row.pdf_path).replace('factura_', '').replace('.pdf', ''))
+            for row in delivery
+        ]
     
-    def _process_single_email(self, pdf_path: str, email: str, row_num: int, successful_rows: List[int]) -> bool:
-        """Procesa un solo envío de correo"""
+    def _spool_name(self, delivery: List[PendingRow]) -> str:
+        return MessageSpool.name_for([invoice_id for _, invoice_id in self._invoices_for(delivery)])
+    
+    def _process_delivery(self, delivery: List[PendingRow], connection: SMTPConnection,
+                          successful_rows: List[int]) -> DeliveryResult:
+        """Procesa un envío ya prevalidado (una o varias facturas al mismo destinatario)"""
+        email, original = self._recipient_for(delivery)
+        if original:
+            logging.info("Envío redirigido a prueba: %s -> %s", original, email,
+                         extra={'categoria': 'envio', 'correo': email, 'original': original})
+        invoices = self._invoices_for(delivery)
         
-        # Validar email
-        if not self.email_validator.validate_email(email):
-            logging.error(f"Email inválido: {email}")
-            self.log_manager.log_shipment(pdf_path, email, "Email inválido")
-            return False
+        # Crear mensaje (con bandeja ya está construido o en construcción)
+        error = "Error creando mensaje"
+        if self.spool is not None:
+            message, error = self.spool.get(self._spool_name(delivery))
+        elif len(invoices) == 1:
+            pdf_path, invoice_id = invoices[0]
+            message = self.message_builder.create_invoice_message(email, pdf_path, invoice_id)
+        else:
+            message = self.message_builder.create_multi_invoice_message(email, invoices)
         
-        # Verificar que el PDF existe
-        if not os.path.exists(pdf_path):
-            logging.error(f"PDF no encontrado: {pdf_path}")
-            self.log_manager.log_shipment(pdf_path, email, "PDF no encontrado")
-            return False
+        if message is None:
+            logging.error("%s: %s", error, ', '.join(row.pdf_path for row in delivery))
+            for row in delivery:
+                self.log_manager.log_shipment(row.pdf_path, email, "Error creando mensaje", original)
+            return DeliveryResult(False, "Error creando mensaje")
         
-        # Extraer ID de factura del nombre del archivo
-        invoice_id = os.path.basename(pdf_path).replace('factura_', '').replace('.pdf', '')
+        # Enviar correo; un mensaje de la bandeja que falla queda para el reintento
+        if self.tuner is not None:
+            with self.tuner.slot():
+                started = time.monotonic()
+                result = connection.send(message, email)
+            self.tuner.record(result, time.monotonic() - started)
+        else:
+            result = connection.send(message, email)
+        if self.breaker is not None:
+            self.breaker.record(result)
+        if (self.suppression is not None and not result.success and result.connection_ok
+                and self.suppression.is_permanent(result.smtp_code)):
+            # Rechazo permanente del destinatario: no se vuelve a intentar hasta que venza.
+            # Se suprime el destinatario real, que es el que revisa la prevalidación
+            self.suppression.add(original or email, result.smtp_code, result.detail)
+        if self.spool is not None and result.success:
+            self.spool.remove(self._spool_name(delivery))
         
-        # Crear mensaje
-        message = self.message_builder.create_invoice_message(email, pdf_path, invoice_id)
-        if message is None:
-            self.log_manager.log_shipment(pdf_path, email, "Error creando mensaje")
-            return False
+        for row in delivery:
+            if result.success:
+                logging.info("Enviado exitosamente: %s -> %s", row.pdf_path, email,
+                             extra={'categoria': 'envio', 'pdf': row.pdf_path, 'correo': email})
+                self.log_manager.log_shipment(row.pdf_path, email, "exitoso", original)
+                successful_rows.append(row.row_num)
+            else:
+                logging.error("Error enviando: %s -> %s - %s", row.pdf_path, email, result.detail,
+                              extra={'categoria': 'envio', 'pdf': row.pdf_path, 'correo': email})
+                self.log_manager.log_shipment(row.pdf_path, email, "fallido", original)
         
-        # Enviar correo
-        success, result = self.email_sender.send_email(message, email)
+        if original and result.success:
+            with self._retry_lock:
+                self.redirected += len(delivery)
         
-        if success:
-            logging.info(f"Enviado exitosamente: {pdf_path} -> {email}")
-            self.log_manager.log_shipment(pdf_path, email, "exitoso")
-            successful_rows.append(row_num)
-            return True
-        else:
-            logging.error(f"Error enviando: {pdf_path} -> {email} - {result}")
-            self.log_manager.log_shipment(pdf_path, email, "fallido")
-            return False
+        return result
     
-    def _log_final_summary(self, total: int, successful: int, failed: int):
+    def _log_final_summary(self, total: int, successful: int, failed: int, deferred: int = 0):
         """Registra resumen final del procesamiento"""
+        not_attempted = len(self.not_attempted) + self.unread_rows
         self.log_manager.log_daily(f"Total procesados: {total}")
         self.log_manager.log_daily(f"Exitosos: {successful}")
         self.log_manager.log_daily(f"Fallidos: {failed}")
+        if deferred:
+            self.log_manager.log_daily(f"Diferidos: {deferred}")
+        if self.redirected:
+            self.log_manager.log_daily(f"Redirigidos a prueba: {self.redirected}")
+        if self.suppressed:
+            self.log_manager.log_daily(f"Suprimidos por rebote permanente: {self.suppressed}")
+        if self.tuner is not None and self.tuner.sends:
+            self.log_manager.log_daily(self.tuner.summary())
+        if self.breaker is not None and self.breaker.trips:
+            self.log_manager.log_daily(self.breaker.summary())
+        if self.breaker is not None and self.breaker.abandoned:
+            self.log_manager.log_daily(f"No intentadas por circuito SMTP abierto: {not_attempted}")
+        elif self.budget is not None and self.budget.exhausted:
+            self.log_manager.log_daily(self.budget.summary(not_attempted))
+            for pdf_path in self.not_attempted:
+                self.log_manager.log_daily(f"No enviada por límite de tiempo: {pdf_path}")
+            if self.unread_rows:
+                self.log_manager.log_daily(f"Filas de pendientes sin leer por límite de tiempo: {self.unread_rows}")
         self.log_manager.log_daily("=== FIN DE ENVÍO DE CORREOS ===")
         
         # Resumen en pantalla
@@ -557,6 +1837,19 @@ class EmailProcessor:
         print(f"Total procesados: {total}")
         print(f"Exitosos: {successful}")
         print(f"Fallidos: {failed}")
+        if deferred:
+            print(f"Diferidos: {deferred}")
+        if not_attempted and (self.budget is not None and self.budget.exhausted or
+                              self.breaker is not None and self.breaker.abandoned):
+            print(f"No intentados ({self._stop_reason()}): {not_attempted}")
+        if self.tuner is not None and self.tuner.sends:
+            print(self.tuner.summary())
+        if self.breaker is not None and self.breaker.trips:
+            print(self.breaker.summary())
+        if self.redirected:
+            print(f"Redirigidos a prueba: {self.redirected}")
+        if self.suppressed:
+            print(f"Suprimidos (rebote permanente): {self.suppressed}")
         print(f"Log de envíos: {self.path_config.log_envios}")
     
     def send_admin_report(self, report_file: str):
@@ -588,6 +1881,172 @@ class EmailProcessor:
             logging.error(f"Error enviando reporte al administrador: {str(e)}")
 
 
+class SenderDaemon:
+    """Modo demonio: vigila el archivo de pendientes y envía en cuanto cambia
+    
+    Revisa cada 'poll_interval' segundos el inodo, tamaño y fecha de
+    modificación del archivo, mantiene abiertas las conexiones SMTP entre
+    ciclos y publica la profundidad de la cola y la antigüedad del pendiente
+    más viejo en FILES['sender_status']. Con la cola compartida (--cola) el
+    archivo solo se importa y los reintentos los programa la propia cola.
+    """
+    
+    def __init__(self, processor: EmailProcessor, config: Dict = DAEMON_CONFIG):
+        self.processor = processor
+        self.config = config
+        self.pending_file = processor.path_config.pending_file
+        self.pid_file = get_path('sender_pid')
+        self.status_file = get_path('sender_status')
+        
+        self.stop_event = threading.Event()
+        self.pool = SMTPConnectionPool(processor.email_sender, float(config.get('idle_close_seconds', 240)))
+        processor.connection_pool = self.pool
+        processor.stop_requested = self.stop_event
+        
+        self.started = time.time()
+        self.first_seen: Dict[str, float] = {}   # PDF -> momento en que entró a la cola
+        self.retry_at: Dict[str, float] = {}     # PDF -> momento del próximo intento
+        self.totals = {'ciclos': 0, 'exitosos': 0, 'fallidos': 0}
+    
+    @staticmethod
+    def running_pid() -> Optional[int]:
+        """PID del demonio en ejecución, si lo hay"""
+        pid_file = get_path('sender_pid')
+        try:
+            pid = int(pid_file.read_text().strip())
+            os.kill(pid, 0)
+            return pid
+        except (OSError, ValueError):
+            return None
+    
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.pending_file)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+    
+    def _handle_signal(self, signum, frame):
+        logging.info(f"Señal {signum} recibida: se termina el envío en curso y se detiene el demonio")
+        self.stop_event.set()
+    
+    def queue_status(self) -> Dict:
+        """Profundidad de la cola, filas listas para enviar y antigüedad del pendiente más viejo"""
+        if self.processor.work_queue is not None:
+            return self.processor.work_queue.stats()
+        
+        now = time.time()
+        pdfs = []
+        if os.path.exists(self.pending_file):
+            with open(self.pending_file, 'r', encoding='utf-8') as f:
+                pdfs = [row[0].strip() for row in csv.reader(f) if len(row) >= 2]
+        
+        for pdf in pdfs:
+            if pdf not in self.first_seen:
+                # Al arrancar, la fecha del PDF aproxima cuándo entró a la cola
+                self.first_seen[pdf] = os.path.getmtime(pdf) if os.path.exists(pdf) else now
+        present = set(pdfs)
+        self.first_seen = {pdf: t for pdf, t in self.first_seen.items() if pdf in present}
+        self.retry_at = {pdf: t for pdf, t in self.retry_at.items() if pdf in present}
+        
+        oldest = min(self.first_seen.values()) if self.first_seen else None
+        return {
+            'profundidad': len(pdfs),
+            'listos': sum(1 for pdf in present if self.retry_at.get(pdf, 0) <= now),
+            'antiguedad_max_segundos': round(now - oldest, 1) if oldest is not None else 0,
+        }
+    
+    def _write_status(self, status: Dict):
+        """Publica el estado del demonio en un archivo JSON"""
+        data = dict(status, pid=os.getpid(), iniciado=datetime.datetime.fromtimestamp(self.started).isoformat(),
+                    actualizado=datetime.datetime.now().isoformat(), **self.totals)
+        tmp_file = self.status_file.with_name(self.status_file.name + '.tmp')
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_file, self.status_file)
+    
+    def _run_cycle(self):
+        now = time.time()
+        skip = {pdf for pdf, t in self.retry_at.items() if t > now}
+        successful, failed, _ = self.processor.process_pending_emails(skip)
+        
+        if self.processor.work_queue is None:
+            retry = now + float(self.config.get('retry_interval', 300))
+            for pdf in self.processor.retry_later:
+                self.retry_at[pdf] = retry
+        
+        self.totals['ciclos'] += 1
+        self.totals['exitosos'] += successful
+        self.totals['fallidos'] += failed
+    
+    def run(self) -> int:
+        """Bucle principal; devuelve el código de salida"""
+        other = self.running_pid()
+        if other is not None and other != os.getpid():
+            logging.error(f"Ya hay un enviador en modo demonio en ejecución (PID {other})")
+            return 1
+        
+        self.pid_file.parent.mkdir(parents=True, exist_ok=True)
+        self.pid_file.write_text(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        
+        poll_interval = float(self.config.get('poll_interval', 1.0))
+        status_interval = float(self.config.get('status_interval', 30))
+        logging.info(f"=== ENVIADOR EN MODO DEMONIO (PID {os.getpid()}) ===")
+        self.processor.log_manager.log_daily("Enviador iniciado en modo demonio")
+        
+        last_signature = None
+        recheck = True
+        next_status = 0.0
+        try:
+            while not self.stop_event.is_set():
+                now = time.time()
+                signature = self._signature()
+                retry_due = any(t <= now for t in self.retry_at.values())
+                changed = signature is not None and signature != last_signature
+                
+                if self.processor.work_queue is not None:
+                    # Otros procesos también alimentan la cola: se consulta en cada vuelta
+                    last_signature = signature
+                    if changed or self.queue_status()['listos'] > 0:
+                        self._run_cycle()
+                        next_status = 0.0
+                elif signature is not None and (recheck or retry_due or changed):
+                    last_signature = signature
+                    status = self.queue_status()
+                    # Tras un ciclo se vuelve a revisar: pudieron anexarse filas mientras se enviaba
+                    recheck = status['listos'] > 0
+                    if recheck:
+                        self._run_cycle()
+                        next_status = 0.0
+                
+                if time.time() >= next_status:
+                    status = self.queue_status()
+                    self._write_status(status)
+                    self.pool.close_idle()
+                    if status['profundidad']:
+                        logging.info(f"Cola: {status['profundidad']} pendientes, "
+                                     f"el más antiguo hace {status['antiguedad_max_segundos']:.0f} s")
+                    next_status = time.time() + status_interval
+                
+                self.stop_event.wait(poll_interval)
+        finally:
+            if self.processor.work_queue is not None:
+                self.processor.work_queue.release_all(self.processor.worker)
+            self.pool.close_all()
+            if self.processor.spool is not None:
+                self.processor.spool.close()
+            self._write_status(self.queue_status())
+            try:
+                self.pid_file.unlink()
+            except FileNotFoundError:
+                pass
+            self.processor.log_manager.log_daily("Enviador en modo demonio detenido")
+            logging.info("=== ENVIADOR EN MODO DEMONIO DETENIDO ===")
+        
+        return 0
+
+
 def main():
     """Función principal del sistema de envío"""
     
@@ -598,15 +2057,55 @@ def main():
         # Crear procesador de correos
         processor = EmailProcessor(config_manager)
         
+        if '--registro-json' in sys.argv[1:]:
+            processor.log_manager.use_queue_logging()
+        
+        profiler, _ = StageProfiler.from_argv('enviador', sys.argv[1:], logging.info)
+        
+        if QUEUE_CONFIG.get('enabled', False) or '--cola' in sys.argv[1:]:
+            processor.work_queue = WorkQueue()
+        
+        if '--bandeja' in sys.argv[1:] and processor.spool is None:
+            processor.spool = MessageSpool(invoice_store=processor.invoice_store)
+        
+        if '--redirigir-prueba' in sys.argv[1:]:
+            fraction = float(sys.argv[sys.argv.index('--redirigir-prueba') + 1])
+            processor.redirector = TestRedirector(fraction, TEST_REDIRECT_CONFIG['recipients'],
+                                                  TEST_REDIRECT_CONFIG.get('salt', ''))
+        if processor.redirector is not None:
+            logging.info(f"Redirección de prueba activa: {processor.redirector.fraction:.0%} de los destinatarios")
+        
+        if '--demonio' in sys.argv[1:]:
+            with profiler.stage('demonio'):
+                exit_code = SenderDaemon(processor).run()
+            sys.exit(exit_code)
+        
+        processor.budget = RunBudget.for_stage('enviador', RunBudget.parse_arg(sys.argv[1:]))
+        if processor.budget.limited:
+            logging.info(f"Presupuesto de tiempo: {processor.budget.seconds:.0f} s")
+        
         logging.info("=== INICIANDO SISTEMA DE ENVÍO DE FACTURAS ===")
         
-        # Procesar envíos pendientes
-        successful, failed, total = processor.process_pending_emails()
+        # Con el demonio activo, esta ejecución solo genera el reporte diario
+        # (con la cola compartida ambos pueden enviar a la vez sin duplicar)
+        daemon_pid = SenderDaemon.running_pid()
+        if daemon_pid is not None and processor.work_queue is None:
+            logging.info(f"Enviador en modo demonio activo (PID {daemon_pid}): se omite el envío")
+            successful, failed, total = 0, 0, 0
+        else:
+            # Procesar envíos pendientes
+            with profiler.stage('envio'):
+                try:
+                    successful, failed, total = processor.process_pending_emails()
+                finally:
+                    if processor.spool is not None:
+                        processor.spool.close()
         
         # Generar y enviar reporte diario
-        report_file = processor.report_generator.generate_daily_report()
-        if report_file:
-            processor.send_admin_report(report_file)
+        with profiler.stage('reporte'):
+            report_file = processor.report_generator.generate_daily_report()
+            if report_file:
+                processor.send_admin_report(report_file)
         
         logging.info("=== SISTEMA DE ENVÍO COMPLETADO ===")
         
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Estampador de Facturas
+Compila la plantilla LaTeX una sola vez con los campos vacíos, registrando la
+posición de cada campo, y genera cada factura escribiendo sobre ese PDF base
+una capa de texto con los valores (actualización incremental del PDF, sin
+pdflatex). Las filas que no caben en el diseño se devuelven para compilarlas
+con LaTeX
+
+Lo usa generador_facturas.py --estampar
+"""
+
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config_paths import PDF_OPTIMIZE_CONFIG, STAMP_CONFIG, get_path
+from generador_facturas import (
+    FIELDS, InvoiceRecord, InvoiceTemplate, LatexCompiler, PdfReader, PdfWriter, log_message
+)
+from optimizador_pdf import PdfOptimizer
+
+
+# Anchos (milésimas de em) de las fuentes estándar Times-Roman y Times-Bold, que
+# todo lector PDF trae incorporadas. Tomados de los AFM "Core 14" de Adobe
+# Systems Incorporated (Copyright (c) 1985-1997, uso y distribución libres).
+_ASCII_WIDTHS = {
+    'regular': [
+        250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+        921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+        556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+        333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+        500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+    ],
+    'bold': [
+        250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+        930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+        611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+        333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+        556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520,
+    ],
+}
+
+_SPANISH_WIDTHS = {
+    'regular': {'á': 444, 'é': 444, 'í': 278, 'ó': 500, 'ú': 500, 'Á': 722, 'É': 611, 'Í': 333,
+                'Ó': 722, 'Ú': 722, 'ñ': 500, 'Ñ': 722, 'ü': 500, 'Ü': 722, '¿': 444, '¡': 333,
+                '°': 400, 'º': 310, 'ª': 276},
+    'bold': {'á': 500, 'é': 444, 'í': 278, 'ó': 500, 'ú': 556, 'Á': 722, 'É': 667, 'Í': 389,
+             'Ó': 778, 'Ú': 722, 'ñ': 556, 'Ñ': 722, 'ü': 556, 'Ü': 722, '¿': 500, '¡': 333,
+             '°': 400, 'º': 330, 'ª': 300},
+}
+
+FONT_WIDTHS: Dict[str, Dict[str, int]] = {
+    style: dict(zip(map(chr, range(32, 127)), _ASCII_WIDTHS[style]), **_SPANISH_WIDTHS[style])
+    for style in ('regular', 'bold')
+}
+
+FONT_RESOURCES = {'regular': ('/FEstR', '/Times-Roman'), 'bold': ('/FEstB', '/Times-Bold')}
+# Formato del PDF base; al cambiarlo se recompila aunque la plantilla sea la misma
+BASE_FORMAT = 2
+
+# Registra, al enviar la página al PDF, la posición y el formato de cada \campo
+FIELD_MARKER_MACROS = r"""
+\makeatletter
+\newwrite\factura@campos
+\immediate\openout\factura@campos=\jobname.campos
+\newdimen\campo@limite
+\DeclareRobustCommand\campo[1]{%%
+  \leavevmode\pdfsavepos
+  \@ifundefined{campo@reserva@#1}{\campo@limite=\linewidth}{\campo@limite=\@nameuse{campo@reserva@#1}}%%
+  \edef\campo@escribir{\write\factura@campos{#1 \noexpand\the\pdflastxpos\space
+    \noexpand\the\pdflastypos\space\f@size\space\f@series\space\the\campo@limite}}%%
+  \campo@escribir
+  \@ifundefined{campo@reserva@#1}{}{\hspace*{\campo@limite}}}
+%(reservations)s
+\makeatother
+"""
+
+PT_TO_BP = 72 / 72.27
+SP_TO_BP = PT_TO_BP / 65536
+
+
+@dataclass
+class FieldSlot:
+    """Lugar de la página base donde se escribe un campo"""
+    name: str
+    x: float            # puntos PDF desde la esquina inferior izquierda
+    y: float            # línea base
+    size: float
+    style: str          # 'regular' | 'bold'
+    limit: float        # ancho disponible
+
+
+class InvoiceStamper:
+    """Genera facturas escribiendo los valores sobre un PDF base precompilado"""
+
+    def __init__(self, template: InvoiceTemplate, compiler: LatexCompiler,
+                 work_dir: Optional[str] = None, config: Dict = STAMP_CONFIG):
+        self.template = template
+        self.compiler = compiler
+        self.config = config
+        self.work_dir = Path(work_dir) if work_dir else get_path('temp') / 'latex'
+        self.base_file = Path(get_path('stamp_base'))
+        self.layout_file = self.base_file.with_suffix('.json')
+
+        self.slots: List[FieldSlot] = []
+        self._base_bytes = b''
+        self._layout: Dict = {}
+
+    # --- PDF base --------------------------------------------------------
+
+    def _template_key(self) -> str:
+        """Huella de la plantilla y de la configuración que determinan el PDF base"""
+        source = (f"{BASE_FORMAT}\n" + self.template.source
+                  + json.dumps(self.config['reserved_widths'], sort_keys=True))
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def _base_source(self) -> str:
+        """Plantilla con cada {campo} reemplazado por un marcador de posición"""
+        reservations = "\n".join(
+            f"\\@namedef{{campo@reserva@{name}}}{{{width}}}"
+            for name, width in self.config['reserved_widths'].items()
+        )
+        macros = FIELD_MARKER_MACROS % {'reservations': reservations}
+
+        source = self.template.source
+        for name in FIELDS:
+            source = source.replace('{' + name + '}', '\\campo{' + name + '}')
+        begin = source.index('\\begin{document}')
+        return source[:begin] + macros + source[begin:]
+
+    @staticmethod
+    def _read_slots(positions_file: Path) -> List[FieldSlot]:
+        """Lee las posiciones escritas por \\campo (sp, pt y serie de LaTeX)"""
+        slots = []
+        with open(positions_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 6:
+                    continue
+                name, x, y, size, series, limit = parts
+                slots.append(FieldSlot(
+                    name=name,
+                    x=int(x) * SP_TO_BP,
+                    y=int(y) * SP_TO_BP,
+                    size=float(size) * PT_TO_BP,
+                    style='bold' if series.startswith('b') else 'regular',
+                    limit=float(limit.rstrip('pt')) * PT_TO_BP,
+                ))
+        return slots
+
+    def _build_base(self) -> bool:
+        """Compila la plantilla vacía y prepara el PDF base para anexarle capas"""
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.base_file.parent.mkdir(parents=True, exist_ok=True)
+
+        tex_file = self.work_dir / 'base_factura.tex'
+        tex_file.write_text(self._base_source(), encoding='utf-8')
+        log_message("INFO", f"Compilando PDF base para estampado: {tex_file.name}")
+        # Dos pasadas para LastPage; .campos queda con las posiciones de la última
+        success, log_file = self.compiler.compile(str(tex_file), str(self.work_dir), passes=2)
+        tex_file.unlink()
+        compiled = self.work_dir / 'base_factura.pdf'
+        positions_file = self.work_dir / 'base_factura.campos'
+
+        if not success or not compiled.exists() or not positions_file.exists():
+            for error in self.compiler.extract_errors(log_file):
+                log_message("ERROR", f"  {error}")
+            return False
+
+        slots = self._read_slots(positions_file)
+        positions_file.unlink()
+
+        # Fuentes compactas una sola vez; las capas no agregan fuentes incrustadas
+        if PDF_OPTIMIZE_CONFIG['enabled']:
+            before, after = PdfOptimizer(tools=['ghostscript']).optimize(str(compiled))
+            log_message("INFO", f"PDF base: {before} bytes -> {after} bytes")
+
+        reader = PdfReader(str(compiled))
+        if len(reader.pages) != 1:
+            log_message("WARNING", "La plantilla ocupa más de una página; no se puede estampar")
+            compiled.unlink()
+            return False
+
+        # Se reescribe con tabla xref clásica y la página apuntando a una capa vacía
+        # (objeto propio) y a dos fuentes estándar; cada factura solo redefine esa capa.
+        # El contenido de pdfTeX va entre q/Q: la capa parte del estado gráfico inicial
+        # (sin el color, la matriz ni el modo de texto que deje la página)
+        from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject
+
+        writer = PdfWriter(clone_from=reader)
+        page = writer.pages[0]
+        overlay = writer._add_object(DecodedStreamObject())
+        contents = page.get('/Contents')
+        if isinstance(contents.get_object(), ArrayObject):
+            refs = list(contents.get_object())
+        else:
+            refs = [contents]
+        save, restore = DecodedStreamObject(), DecodedStreamObject()
+        save.set_data(b'q\n')
+        restore.set_data(b'\nQ\n')
+        page[NameObject('/Contents')] = ArrayObject(
+            [writer._add_object(save)] + refs + [writer._add_object(restore), overlay])
+
+        resources = page['/Resources'].get_object()
+        fonts = resources.get('/Font', DictionaryObject()).get_object()
+        for resource, base_font in FONT_RESOURCES.values():
+            fonts[NameObject(resource)] = DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'),
+                NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject(base_font),
+                NameObject('/Encoding'): NameObject('/WinAnsiEncoding'),
+            })
+        resources[NameObject('/Font')] = fonts
+
+        with open(self.base_file, 'wb') as out:
+            writer.write(out)
+        compiled.unlink()
+
+        data = self.base_file.read_bytes()
+        written = PdfReader(str(self.base_file))
+        startxref = int(re.findall(rb'startxref\s+(\d+)', data)[-1])
+        if not data[startxref:].startswith(b'xref'):
+            log_message("WARNING", "El PDF base no tiene tabla xref clásica; no se puede estampar")
+            return False
+
+        layout = {
+            'template': self._template_key(),
+            'size': int(written.trailer['/Size']),
+            'root': written.trailer.raw_get('/Root').idnum,
+            'info': written.trailer.raw_get('/Info').idnum if '/Info' in written.trailer else None,
+            'overlay': written.pages[0]['/Contents'][-1].idnum,
+            'startxref': startxref,
+            'slots': [slot.__dict__ for slot in slots],
+        }
+        self.layout_file.write_text(json.dumps(layout, ensure_ascii=False, indent=1), encoding='utf-8')
+        return True
+
+    def prepare(self) -> bool:
+        """Carga el PDF base, compilándolo si falta o si la plantilla cambió"""
+        if PdfReader is None:
+            log_message("WARNING", "El estampado requiere pypdf para preparar el PDF base")
+            return False
+
+        current = None
+        if self.layout_file.exists() and self.base_file.exists():
+            current = json.loads(self.layout_file.read_text(encoding='utf-8'))
+        if current is None or current.get('template') != self._template_key():
+            if not self._build_base():
+                return False
+            current = json.loads(self.layout_file.read_text(encoding='utf-8'))
+
+        self._layout = current
+        self.slots = [FieldSlot(**slot) for slot in current['slots']]
+        self._base_bytes = self.base_file.read_bytes()
+        if not self._base_bytes.endswith(b'\n'):
+            self._base_bytes += b'\n'
+        return bool(self.slots)
+
+    # --- Estampado -------------------------------------------------------
+
+    @staticmethod
+    def text_width(text: str, style: str, size: float) -> Optional[float]:
+        """Ancho del texto en puntos PDF (None si tiene caracteres sin métrica)"""
+        widths = FONT_WIDTHS[style]
+        total = 0
+        for char in text:
+            width = widths.get(char)
+            if width is None:
+                return None
+            total += width
+        return total * size / 1000
+
+    @staticmethod
+    def _pdf_string(text: str) -> bytes:
+        encoded = text.encode('cp1252')
+        return b'(' + encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+    def overlay(self, record: InvoiceRecord) -> Optional[bytes]:
+        """Capa de texto con los valores de la factura (None si alguno no cabe)"""
+        ops = [b'BT']
+        for slot in self.slots:
+            value = record.fields.get(slot.name, '')
+            if not value:
+                continue
+            width = self.text_width(value, slot.style, slot.size)
+            if width is None or width > slot.limit:
+                return None
+            font = FONT_RESOURCES[slot.style][0].encode('ascii')
+            ops.append(b'%s %.2f Tf 1 0 0 1 %.2f %.2f Tm %s Tj' % (
+                font, slot.size, slot.x, slot.y, self._pdf_string(value)))
+        ops.append(b'ET')
+        return b'\n'.join(ops)
+
+    def stamp(self, record: InvoiceRecord, pdf_path: str) -> bool:
+        """Escribe factura_<id>.pdf como PDF base + actualización incremental
+
+        Devuelve False si la fila no cabe en el diseño y debe compilarse con LaTeX.
+        """
+        content = self.overlay(record)
+        if content is None:
+            return False
+
+        layout = self._layout
+        base = self._base_bytes
+        overlay_obj = b'%d 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n' % (
+            layout['overlay'], len(content), content)
+        xref_offset = len(base) + len(overlay_obj)
+        info = b' /Info %d 0 R' % layout['info'] if layout.get('info') else b''
+        update = (
+            overlay_obj
+            + b'xref\n0 1\n0000000000 65535 f \n%d 1\n%010d 00000 n \n' % (layout['overlay'], len(base))
+            + b'trailer\n<< /Size %d /Root %d 0 R%s /Prev %d >>\n' % (
+                layout['size'], layout['root'], info, layout['startxref'])
+            + b'startxref\n%d\n%%%%EOF\n' % xref_offset
+        )
+
+        tmp_path = pdf_path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(base)
+            out.write(update)
+        os.replace(tmp_path, pdf_path)
+        return True
@@ -12,6 +12,9 @@ from faker import Faker
 import os
 import sys
 
+from almacen_ventas import SalesStore
+from perfilado import StageProfiler
+
 # Configuración inicial
 fake = Faker('es_ES')  # Configurar para español
 Faker.seed(0)
@@ -135,17 +138,31 @@ def main():
     # Cambiar al directorio de datos
     os.chdir('datos')
     
+    # Perfilado por etapas (--perfilar cpu,memoria o PERFILAR)
+    try:
+        perfilador, argumentos = StageProfiler.from_argv('generador_compras', sys.argv[1:])
+    except (ValueError, IndexError) as e:
+        print(f"Error: {e or 'falta el valor de --perfilar'}")
+        sys.exit(1)
+    
     # Obtener número de compras desde argumentos o usar valor por defecto
     num_compras = 10
-    if len(sys.argv) > 1:
+    if argumentos:
         try:
-            num_compras = int(sys.argv[1])
+            num_compras = int(argumentos[0])
         except ValueError:
             print("Error: El número de compras debe ser un entero")
             sys.exit(1)
     
     # Generar lote de compras
-    archivo, exitosas, errores = generar_lote_compras(num_compras)
+    with perfilador.stage('generacion'):
+        archivo, exitosas, errores = generar_lote_compras(num_compras)
+    
+    # Columnas y agregados del lote para el reporte diario (almacen_ventas.py)
+    if exitosas:
+        with perfilador.stage('almacen'):
+            batch = SalesStore().ingest(archivo)
+        print(f"Lote agregado al almacén de ventas: {batch.path.name}")
     
     # Resumen
     print(f"\n=== RESUMEN DE GENERACIÓN ===")
@@ -0,0 +1,666 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sistema de Generación de Facturas (versión Python)
+Procesa archivos CSV de compras y genera facturas PDF usando la plantilla LaTeX.
+Además del modo individual (una compilación por factura, igual que
+generador_facturas.sh) ofrece un modo por lotes que compila N facturas en un
+solo documento y luego lo separa en los factura_<id>.pdf individuales.
+Con --estampar, las facturas que caben en el diseño se generan sin pdflatex
+escribiendo los valores sobre un PDF base (estampador_facturas.py)
+
+Con un presupuesto de tiempo (--presupuesto SEGUNDOS, PRESUPUESTO_SEGUNDOS o
+RUN_BUDGET_CONFIG) deja de tomar facturas cuando ya no alcanzarían a terminar.
+Con --incremental procesa solo las compras nuevas de todos los lotes (marcas
+de agua de ingesta_compras.py) y anexa a pendientes en lugar de reemplazarlo
+
+Uso: python3 generador_facturas.py [archivo_csv] [--plantilla archivo.tex] [--lote N | --servidor] [--estampar]
+                                   [--presupuesto SEGUNDOS] [--incremental] [--perfilar cpu,memoria]
+"""
+
+import csv
+import datetime
+import fcntl
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config_paths import PDF_OPTIMIZE_CONFIG, PRIORITY_CONFIG, get_path
+from almacen_facturas import InvoiceStore
+from optimizador_pdf import PdfOptimizer
+from perfilado import StageProfiler
+from presupuesto_ejecucion import RunBudget
+from retencion import ArtifactManifest
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf es opcional; sin él se usa qpdf para separar páginas
+    PdfReader = PdfWriter = None
+
+
+# Campos del CSV de compras (mismo orden que generador_compras.py)
+FIELDS = [
+    'id_transaccion', 'fecha_emision', 'nombre', 'correo', 'telefono',
+    'direccion', 'ciudad', 'cantidad', 'monto', 'pago', 'estado_pago',
+    'ip', 'timestamp', 'observaciones'
+]
+
+REQUIRED_FIELDS = ['id_transaccion', 'nombre', 'correo']
+
+LATEX_SPECIAL_CHARS = {
+    '\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#',
+    '_': r'\_', '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'
+}
+
+PAGE_MARKER = 'FACTURA-PAGINA'
+
+
+def log_message(level: str, message: str):
+    """Registra un mensaje en el log diario con el mismo formato que los scripts bash"""
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    line = f"{timestamp} [{level}] {message}"
+    print(line)
+
+    daily_log = get_path('daily_log')
+    daily_log.parent.mkdir(parents=True, exist_ok=True)
+    with open(daily_log, 'a', encoding='utf-8') as f:
+        f.write(line + "\n")
+
+
+def latex_escape(value: str) -> str:
+    """Escapa los caracteres especiales de LaTeX en un valor del CSV"""
+    return ''.join(LATEX_SPECIAL_CHARS.get(char, char) for char in value)
+
+
+@dataclass
+class InvoiceRecord:
+    """Compra leída del CSV, lista para facturar"""
+    line_number: int
+    fields: Dict[str, str]
+
+    @property
+    def invoice_id(self) -> str:
+        return self.fields['id_transaccion']
+
+    @property
+    def email(self) -> str:
+        return self.fields['correo']
+
+    @property
+    def priority(self) -> int:
+        """Prioridad de envío según cliente VIP, tipo y estado del pago (PRIORITY_CONFIG)"""
+        priority = 0
+        if any(marker in self.fields['observaciones'] for marker in PRIORITY_CONFIG['vip_markers']):
+            priority += PRIORITY_CONFIG['vip']
+        if self.fields['pago'] == 'Pago completo':
+            priority += PRIORITY_CONFIG['full_payment']
+        if self.fields['estado_pago'] == 'Fallido':
+            priority += PRIORITY_CONFIG['failed_payment']
+        return priority
+
+
+@dataclass
+class GenerationStats:
+    """Contadores de una ejecución del generador"""
+    total: int = 0
+    successful: int = 0
+    failed: int = 0
+    generated: List[Tuple[str, str, int]] = field(default_factory=list)  # (pdf_path, correo, prioridad)
+    compiled: List[str] = field(default_factory=list)               # PDFs salidos de pdflatex
+    skipped: List[str] = field(default_factory=list)                # Ids que no alcanzó el presupuesto
+    invoiced: List[str] = field(default_factory=list)               # Ids con PDF generado
+
+
+class InvoiceTemplate:
+    """Plantilla LaTeX con placeholders {campo}"""
+
+    def __init__(self, template_file: str):
+        self.template_file = template_file
+        with open(template_file, 'r', encoding='utf-8') as f:
+            self.source = f.read()
+
+        begin = self.source.index('\\begin{document}')
+        end = self.source.rindex('\\end{document}')
+        self.preamble = self.source[:begin]
+        self.body = self.source[begin + len('\\begin{document}'):end]
+
+    @staticmethod
+    def substitute(text: str, record: InvoiceRecord) -> str:
+        """Sustituye cada {campo} por su valor escapado"""
+        for name in FIELDS:
+            text = text.replace('{' + name + '}', latex_escape(record.fields.get(name, '')))
+        return text
+
+    def render(self, record: InvoiceRecord) -> str:
+        """Documento completo de una sola factura"""
+        return self.substitute(self.source, record)
+
+    def _split_preamble(self) -> Tuple[str, List[str]]:
+        """Separa el preámbulo común de las líneas que dependen de cada factura
+
+        Las líneas con placeholders (p. ej. el encabezado con el número de factura)
+        o con LastPage se repiten al inicio de cada factura del lote.
+        """
+        shared, per_invoice = [], []
+        placeholders = tuple('{' + name + '}' for name in FIELDS)
+        for line in self.preamble.splitlines():
+            if any(p in line for p in placeholders) or 'LastPage' in line:
+                per_invoice.append(line)
+            else:
+                shared.append(line)
+        return "\n".join(shared) + "\n", per_invoice
+
+    def batch_preamble(self) -> str:
+        """Preámbulo común más \\begin{document} para documentos con varias facturas"""
+        preamble, _ = self._split_preamble()
+        return (
+            preamble
+            + '\\begin{document}\n'
+            + '\\makeatletter\\@ifpackageloaded{hyperref}{\\hypersetup{pageanchor=false}}{}\\makeatother\n'
+        )
+
+    def render_page(self, record: InvoiceRecord) -> str:
+        """Contenido de una factura dentro de un documento de varias facturas
+
+        Repite el encabezado propio de la factura y numera sus páginas contra una
+        etiqueta final exclusiva en lugar de LastPage.
+        """
+        _, per_invoice = self._split_preamble()
+        end_label = f"FacturaFin-{record.invoice_id}"
+        prologue = "\n".join(line.replace('{LastPage}', '{' + end_label + '}') for line in per_invoice)
+        return (
+            f"{self.substitute(prologue, record)}\n"
+            f"{self.substitute(self.body, record)}\n"
+            f"\\label{{{end_label}}}\n"
+        )
+
+    def render_batch(self, records: List[InvoiceRecord]) -> str:
+        """Documento con una factura por página (o grupo de páginas)
+
+        Cada factura reinicia el contador de páginas y deja en el log la página
+        absoluta en la que empieza, para poder separar el PDF después.
+        """
+        parts = [self.batch_preamble()]
+        for record in records:
+            parts.append(
+                "\\clearpage\n\\setcounter{page}{1}\n"
+                f"\\typeout{{{PAGE_MARKER}:{record.invoice_id}:\\the\\numexpr\\value{{abspage}}+1\\relax}}\n"
+                + self.render_page(record)
+            )
+        parts.append('\\end{document}\n')
+        return ''.join(parts)
+
+
+class LatexCompiler:
+    """Compilador pdflatex con la misma extracción de errores que generador_facturas.sh"""
+
+    def __init__(self, log_dir: Optional[str] = None):
+        self.log_dir = Path(log_dir) if log_dir else get_path('logs')
+
+    @staticmethod
+    def extract_errors(log_file: str, limit: int = 5) -> List[str]:
+        """Equivalente a grep "!" log | head -5"""
+        errors = []
+        if not os.path.exists(log_file):
+            return errors
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if '!' in line:
+                    errors.append(line.rstrip())
+                    if len(errors) >= limit:
+                        break
+        return errors
+
+    def compile(self, tex_file: str, output_dir: str, passes: int = 1) -> Tuple[bool, str]:
+        """Compila tex_file en output_dir; devuelve (éxito, log de pdflatex)"""
+        base_name = Path(tex_file).stem
+        log_file = str(self.log_dir / f"{base_name}.log")
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+
+        for _ in range(passes):
+            with open(log_file, 'w', encoding='utf-8') as log:
+                result = subprocess.run(
+                    ['pdflatex', f'-output-directory={output_dir}', '-interaction=nonstopmode', tex_file],
+                    stdout=log, stderr=subprocess.STDOUT
+                )
+            if result.returncode != 0:
+                return False, log_file
+
+        self.cleanup(os.path.join(output_dir, base_name))
+        return True, log_file
+
+    @staticmethod
+    def cleanup(base_path: str):
+        """Elimina los auxiliares de LaTeX que quedan junto al PDF"""
+        for extension in ('.aux', '.log', '.out', '.fls', '.fdb_latexmk'):
+            try:
+                os.remove(base_path + extension)
+            except FileNotFoundError:
+                pass
+
+
+class PdfSplitter:
+    """Separa un PDF de lote en un archivo por factura"""
+
+    @staticmethod
+    def page_count(pdf_file: str) -> int:
+        if PdfReader is not None:
+            return len(PdfReader(pdf_file).pages)
+        output = subprocess.run(['qpdf', '--show-npages', pdf_file],
+                                capture_output=True, text=True, check=True)
+        return int(output.stdout.strip())
+
+    @staticmethod
+    def page_ranges(log_file: str, invoice_ids: List[str], total_pages: int) -> Dict[str, Tuple[int, int]]:
+        """Rangos de páginas (1-based, inclusivos) por factura a partir del log de LaTeX"""
+        starts: Dict[str, int] = {}
+        pattern = re.compile(PAGE_MARKER + r':([^:\s]+):(\d+)')
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            for match in pattern.finditer(f.read()):
+                starts[match.group(1)] = int(match.group(2))
+
+        ranges = {}
+        ordered = [i for i in invoice_ids if i in starts]
+        for position, invoice_id in enumerate(ordered):
+            first = starts[invoice_id]
+            last = starts[ordered[position + 1]] - 1 if position + 1 < len(ordered) else total_pages
+            ranges[invoice_id] = (first, last)
+        return ranges
+
+    def split(self, pdf_file: str, ranges: Dict[str, Tuple[int, int]], targets: Dict[str, str]):
+        """Escribe cada rango de páginas en su archivo destino"""
+        if PdfReader is not None:
+            reader = PdfReader(pdf_file)
+            for invoice_id, (first, last) in ranges.items():
+                writer = PdfWriter()
+                for page in range(first - 1, last):
+                    writer.add_page(reader.pages[page])
+                with open(targets[invoice_id], 'wb') as out:
+                    writer.write(out)
+            return
+
+        for invoice_id, (first, last) in ranges.items():
+            subprocess.run(['qpdf', '--empty', '--pages', pdf_file, f'{first}-{last}', '--',
+                            targets[invoice_id]], check=True)
+
+
+class InvoiceGenerator:
+    """Generador de facturas PDF a partir de un CSV de compras"""
+
+    def __init__(self, template_file: str, batch_size: int = 0, use_server: bool = False,
+                 stamp: bool = False, budget: Optional[RunBudget] = None):
+        self.template = InvoiceTemplate(template_file)
+        self.batch_size = batch_size
+        self.use_server = use_server
+        self.stamp = stamp
+        self.budget = budget or RunBudget(None)
+        self.compiler = LatexCompiler()
+        self.splitter = PdfSplitter()
+        self.store = InvoiceStore()
+        self.manifest = ArtifactManifest()
+        self.work_dir = get_path('temp') / 'latex'
+
+    @staticmethod
+    def record_from_row(row: Dict[str, str], line_number: int) -> Optional[InvoiceRecord]:
+        """Compra a partir de una fila del CSV; None si faltan campos obligatorios"""
+        fields = {name: (row.get(name) or '').strip().strip('"').strip() for name in FIELDS}
+        if any(not fields[name] for name in REQUIRED_FIELDS):
+            return None
+        return InvoiceRecord(line_number, fields)
+
+    @classmethod
+    def read_records(cls, csv_file: str) -> Tuple[List[InvoiceRecord], int]:
+        """Lee las compras válidas del CSV; devuelve también el número de filas inválidas"""
+        records, invalid = [], 0
+        with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            for line_number, row in enumerate(reader, start=2):
+                record = cls.record_from_row(row, line_number)
+                if record is None:
+                    log_message("ERROR", f"Línea {line_number}: Campos obligatorios faltantes")
+                    invalid += 1
+                    continue
+                records.append(record)
+        return records, invalid
+
+    def generate(self, records: List[InvoiceRecord], stats: GenerationStats):
+        """Genera los PDFs, en lotes si batch_size > 1
+
+        Las facturas que ya no caben en el presupuesto de tiempo quedan en stats.skipped.
+        """
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        output_dir = self.store.shard_dir(datetime.date.today())
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.stamp:
+            records = self._generate_stamped(records, output_dir, stats)
+
+        if not records:
+            return
+        if self.use_server:
+            self._generate_with_server(records, output_dir, stats)
+        elif self.batch_size > 1:
+            for start in range(0, len(records), self.batch_size):
+                batch = records[start:start + self.batch_size]
+                if not self.budget.allows(len(batch)):
+                    stats.skipped.extend(record.invoice_id for record in records[start:])
+                    break
+                if len(batch) == 1:
+                    self._generate_single(batch[0], output_dir, stats)
+                else:
+                    self._generate_batch(batch, output_dir, stats)
+        else:
+            for position, record in enumerate(records):
+                if not self.budget.allows():
+                    stats.skipped.extend(r.invoice_id for r in records[position:])
+                    break
+                self._generate_single(record, output_dir, stats)
+
+    def _record_success(self, record: InvoiceRecord, pdf_path: Path, log_file: Optional[str],
+                        stats: GenerationStats, compiled: bool = True):
+        relative = ArtifactManifest.relative_path(str(pdf_path))
+        stats.successful += 1
+        stats.generated.append((relative, record.email, record.priority))
+        stats.invoiced.append(record.invoice_id)
+        if compiled:
+            stats.compiled.append(str(pdf_path))
+        artifacts = [(relative, 'pdf', None)]
+        if log_file:
+            artifacts.append((log_file, 'log', None))
+        self.manifest.register_many(artifacts)
+        log_message("INFO", f"PDF generado: {relative}")
+
+    def _record_failure(self, record: InvoiceRecord, log_file: Optional[str], stats: GenerationStats,
+                        errors: Optional[List[str]] = None):
+        stats.failed += 1
+        if errors is None:
+            errors = self.compiler.extract_errors(log_file)
+        if errors:
+            log_message("ERROR", f"Error de compilación en factura_{record.invoice_id}.tex:")
+            for error in errors:
+                log_message("ERROR", f"  {error}")
+        log_message("ERROR", f"Error compilando factura {record.invoice_id}")
+        if log_file:
+            self.manifest.register(log_file, 'log')
+
+    def _generate_single(self, record: InvoiceRecord, output_dir: Path, stats: GenerationStats):
+        """Una compilación por factura (comportamiento de generador_facturas.sh)"""
+        tex_file = self.work_dir / f"factura_{record.invoice_id}.tex"
+        tex_file.write_text(self.template.render(record), encoding='utf-8')
+
+        log_message("INFO", f"Compilando {tex_file.name}")
+        success, log_file = self.compiler.compile(str(tex_file), str(output_dir))
+        tex_file.unlink()
+        self.budget.record()
+
+        if success:
+            self._record_success(record, output_dir / f"factura_{record.invoice_id}.pdf", log_file, stats)
+        else:
+            self._record_failure(record, log_file, stats)
+
+    def _generate_batch(self, records: List[InvoiceRecord], output_dir: Path, stats: GenerationStats):
+        """Compila el lote en un solo documento y lo separa por factura
+
+        Si el lote no compila o no se puede separar, se recurre al modo individual
+        para que una fila problemática no invalide las demás.
+        """
+        batch_name = f"lote_{records[0].invoice_id}_{len(records)}"
+        tex_file = self.work_dir / f"{batch_name}.tex"
+        tex_file.write_text(self.template.render_batch(records), encoding='utf-8')
+
+        log_message("INFO", f"Compilando lote de {len(records)} facturas: {tex_file.name}")
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as batch_dir:
+            # Dos pasadas para resolver la numeración "Página x de y" de cada factura
+            success, log_file = self.compiler.compile(str(tex_file), batch_dir, passes=2)
+            tex_file.unlink()
+
+            if success:
+                batch_pdf = os.path.join(batch_dir, f"{batch_name}.pdf")
+                try:
+                    ids = [record.invoice_id for record in records]
+                    ranges = self.splitter.page_ranges(log_file, ids, self.splitter.page_count(batch_pdf))
+                    targets = {i: str(output_dir / f"factura_{i}.pdf") for i in ranges}
+                    self.splitter.split(batch_pdf, ranges, targets)
+                except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                    log_message("WARNING", f"No se pudo separar el lote {batch_name}: {e}")
+                    ranges = {}
+
+                self.manifest.register(log_file, 'log')
+                self.budget.record(len(ranges))
+                for record in records:
+                    if record.invoice_id in ranges:
+                        self._record_success(record, output_dir / f"factura_{record.invoice_id}.pdf",
+                                             None, stats)
+                    else:
+                        self._generate_single(record, output_dir, stats)
+                return
+
+        log_message("WARNING", f"Lote {batch_name} falló, compilando sus facturas individualmente")
+        for error in self.compiler.extract_errors(log_file):
+            log_message("ERROR", f"  {error}")
+        for record in records:
+            self._generate_single(record, output_dir, stats)
+
+    def _generate_stamped(self, records: List[InvoiceRecord], output_dir: Path,
+                          stats: GenerationStats) -> List[InvoiceRecord]:
+        """Estampa las facturas que caben en el diseño; devuelve las que requieren LaTeX"""
+        # Importación diferida: estampador_facturas depende de las clases de este módulo
+        from estampador_facturas import InvoiceStamper
+
+        stamper = InvoiceStamper(self.template, self.compiler, str(self.work_dir))
+        if not stamper.prepare():
+            log_message("WARNING", "Estampado no disponible, se compilan todas las facturas con LaTeX")
+            return records
+
+        fallback = []
+        for position, record in enumerate(records):
+            if not self.budget.allows():
+                stats.skipped.extend(r.invoice_id for r in records[position:])
+                break
+            pdf_path = output_dir / f"factura_{record.invoice_id}.pdf"
+            if stamper.stamp(record, str(pdf_path)):
+                self.budget.record()
+                self._record_success(record, pdf_path, None, stats, compiled=False)
+            else:
+                fallback.append(record)
+
+        if fallback:
+            log_message("INFO", f"{len(fallback)} facturas no caben en el diseño estampado, se compilan con LaTeX")
+        return fallback
+
+    def _generate_with_server(self, records: List[InvoiceRecord], output_dir: Path, stats: GenerationStats):
+        """Compila mediante procesos pdflatex calientes (servidor_latex.py)"""
+        # Importación diferida: servidor_latex depende de las clases de este módulo
+        from servidor_latex import LatexCompileServer
+
+        server = LatexCompileServer(self.template, str(self.work_dir))
+        log_message("INFO", f"Compilando {len(records)} facturas con {server.workers} procesos pdflatex calientes")
+        results = server.compile_many(records, str(output_dir), self.budget)
+
+        for record in records:
+            result = results.get(record.invoice_id)
+            if result is not None and result.success:
+                self._record_success(record, Path(result.pdf_path), None, stats)
+            elif result is None and self.budget.exhausted:
+                stats.skipped.append(record.invoice_id)
+            else:
+                self._record_failure(record, None, stats, result.errors if result else [])
+
+
+def find_latest_csv() -> Optional[str]:
+    """Archivo de compras más reciente en datos/ (equivalente a ls -t | head -1)"""
+    candidates = glob.glob(str(get_path('data') / 'compras_lote_*.csv'))
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def write_pending(generated: List[Tuple[str, str, int]], append: bool = False):
+    """Escribe las facturas generadas (pdf,correo,prioridad) en pendientes
+
+    Con append se anexan conservando lo que aún no se envió. Se usa el mismo
+    bloqueo que enviador.PendingFileManager para no intercalarse con su reescritura.
+    """
+    pending_file = get_path('pending')
+    pending_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(pending_file) + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(pending_file, 'a' if append else 'w', encoding='utf-8', newline='') as f:
+            for pdf_path, email, priority in generated:
+                f.write(f"{pdf_path},{email},{priority}\n")
+
+    for pdf_path, email, _ in generated:
+        log_message("INFO", f"Factura agregada a pendientes: {os.path.basename(pdf_path)} -> {email}")
+
+
+def log_sales_summary(records: List[InvoiceRecord], incremental: bool = False):
+    """Totales de ventas de la ejecución en el log diario
+
+    En modo incremental son totales de las compras nuevas. El reporte diario
+    calcula sus totales desde el almacén de ventas (almacen_ventas.py).
+    """
+    total_monto = sum(int(r.fields['monto']) for r in records if r.fields['monto'].isdigit())
+    pagos_completos = sum(1 for r in records if r.fields['pago'] == 'Pago completo')
+    if incremental:
+        log_message("INFO", f"Monto nuevo procesado: L{total_monto}")
+        log_message("INFO", f"Pagos completos nuevos: {pagos_completos}")
+    else:
+        log_message("INFO", f"Monto total procesado: L{total_monto}")
+        log_message("INFO", f"Pagos completos: {pagos_completos}")
+
+
+def parse_args(argv: List[str]) -> Tuple[Optional[str], str, int, bool, bool, Optional[float], bool]:
+    """Interpreta [archivo_csv] [--plantilla archivo] [--lote N] [--servidor] [--estampar] [--presupuesto S]
+    [--incremental]"""
+    csv_file, template_file, batch_size, use_server, stamp = None, str(get_path('template')), 0, False, False
+    budget_seconds, incremental = None, False
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-h', '--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif arg == '--lote':
+            batch_size = int(args.pop(0)) if args else 50
+        elif arg == '--plantilla':
+            template_file = args.pop(0)
+        elif arg == '--servidor':
+            use_server = True
+        elif arg == '--estampar':
+            stamp = True
+        elif arg == '--presupuesto':
+            budget_seconds = float(args.pop(0))
+        elif arg == '--incremental':
+            incremental = True
+        else:
+            csv_file = arg
+    return csv_file, template_file, batch_size, use_server, stamp, budget_seconds, incremental
+
+
+def main():
+    """Función principal"""
+    try:
+        profiler, argv = StageProfiler.from_argv('generador_facturas', sys.argv[1:],
+                                                 lambda message: log_message("INFO", message))
+        csv_file, template_file, batch_size, use_server, stamp, budget_seconds, incremental = parse_args(argv)
+    except (ValueError, IndexError):
+        print("Error: argumentos inválidos (use --help)")
+        sys.exit(1)
+
+    ingestor = None
+    if incremental:
+        # Importación diferida: ingesta_compras depende de las clases de este módulo
+        from ingesta_compras import PurchaseIngestor
+        ingestor = PurchaseIngestor()
+        csv_files = [csv_file] if csv_file else ingestor.sources()
+    else:
+        csv_file = csv_file or find_latest_csv()
+        csv_files = [csv_file] if csv_file else []
+
+    log_message("INFO", "=== INICIO DE GENERACIÓN DE FACTURAS ===")
+    if incremental:
+        log_message("INFO", f"Modo incremental: {len(csv_files)} archivos de compras")
+    else:
+        log_message("INFO", f"Archivo CSV: {csv_file}")
+    log_message("INFO", f"Plantilla: {template_file}")
+    if use_server:
+        log_message("INFO", "Modo servidor: procesos pdflatex calientes")
+    elif batch_size > 1:
+        log_message("INFO", f"Modo por lotes: {batch_size} facturas por compilación")
+    if stamp:
+        log_message("INFO", "Estampado sobre PDF base activado (LaTeX solo para filas que no caben)")
+
+    missing = [f for f in csv_files if not os.path.exists(f)]
+    if not csv_files or missing:
+        log_message("ERROR", f"Archivo CSV no encontrado: {missing[0] if missing else csv_file}")
+        sys.exit(1)
+    if not os.path.exists(template_file):
+        log_message("ERROR", f"Plantilla LaTeX no encontrada: {template_file}")
+        sys.exit(1)
+    if shutil.which('pdflatex') is None:
+        log_message("ERROR", "pdflatex no está instalado o no está en PATH")
+        sys.exit(1)
+    if (batch_size > 1 or use_server) and PdfReader is None and shutil.which('qpdf') is None:
+        log_message("ERROR", "Los modos por lotes y servidor requieren pypdf o qpdf para separar las páginas")
+        sys.exit(1)
+
+    budget = RunBudget.for_stage('generador', budget_seconds)
+    if budget.limited:
+        log_message("INFO", f"Presupuesto de tiempo: {budget.seconds:.0f} s")
+
+    generator = InvoiceGenerator(template_file, batch_size, use_server, stamp, budget)
+    with profiler.stage('lectura'):
+        if ingestor is not None:
+            records, invalid = ingestor.read_new(csv_files)
+        else:
+            records, invalid = generator.read_records(csv_file)
+    if ingestor is not None and not records:
+        ingestor.commit([], [])
+        log_message("INFO", f"No hay compras nuevas ({invalid} filas inválidas)")
+        log_message("INFO", "=== FIN DE GENERACIÓN DE FACTURAS ===")
+        return
+
+    stats = GenerationStats(total=len(records) + invalid, failed=invalid)
+    log_message("INFO", "Procesando facturas...")
+    with profiler.stage('generacion'):
+        generator.generate(records, stats)
+
+    if stats.skipped:
+        log_message("WARNING", budget.summary(len(stats.skipped)))
+        for invoice_id in stats.skipped:
+            log_message("WARNING", f"Factura no generada por límite de tiempo: {invoice_id}")
+
+    # Las facturas estampadas ya comparten el PDF base optimizado
+    if budget.exhausted:
+        log_message("INFO", "Optimización de PDFs omitida por límite de tiempo")
+    elif PDF_OPTIMIZE_CONFIG['enabled'] and stats.compiled:
+        optimizer = PdfOptimizer()
+        if optimizer.available:
+            with profiler.stage('optimizacion'):
+                log_message("INFO", optimizer.optimize_many(stats.compiled).summary())
+
+    # Primero pendientes y luego las marcas: si se interrumpe entre ambos, la
+    # próxima ejecución vuelve a generar esas facturas en vez de perderlas
+    write_pending(stats.generated, append=incremental)
+    if ingestor is not None:
+        ingestor.commit(stats.invoiced, stats.skipped)
+
+    log_message("INFO", "=== RESUMEN DE GENERACIÓN ===")
+    log_message("INFO", f"Total procesadas: {stats.total}")
+    log_message("INFO", f"Exitosas: {stats.successful}")
+    log_message("INFO", f"Fallidas: {stats.failed}")
+    if stats.skipped:
+        log_message("INFO", f"Sin generar (límite de tiempo): {len(stats.skipped)}")
+    log_message("INFO", f"Archivo de pendientes: {get_path('pending')}")
+
+    log_sales_summary(records, incremental)
+    log_message("INFO", "=== FIN DE GENERACIÓN DE FACTURAS ===")
+
+
+if __name__ == "__main__":
+    main()
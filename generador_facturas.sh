@@ -9,8 +9,10 @@ set -e  # Terminar si hay errores
 TEMPLATE_FILE="plantilla_factura_IRSI.tex"
 LOG_DIR="logs"
 PDF_DIR="facturas_pdf"
+PDF_DAY_DIR="${PDF_DIR}/$(date +%Y/%m/%d)"  # Directorio diario (ver almacen_facturas.py)
 PENDING_FILE="temp/pendientes_envio.csv"
 DAILY_LOG="logs/log_diario.log"
+MANIFEST_FILE="temp/manifest_artefactos.csv"
 
 # Colores para output
 RED='\033[0;31m'
@@ -26,23 +28,81 @@ log_message() {
     echo -e "${timestamp} [${level}] ${message}" | tee -a "$DAILY_LOG"
 }
 
+# Función para escribir en pendientes con el mismo bloqueo que enviador.py y generador_facturas.py
+# (append: anexa una línea; vacio: deja el archivo vacío)
+write_pending_file() {
+    local mode=$1
+    local line=$2
+    (
+        flock 9
+        if [[ "$mode" == "append" ]]; then
+            echo "$line" >> "$PENDING_FILE"
+        else
+            > "$PENDING_FILE"
+        fi
+    ) 9>>"${PENDING_FILE}.lock"
+}
+
+# Función para registrar artefactos en el manifiesto de retención (ver retencion.py)
+# Con el bloqueo de ArtifactManifest para no anexar durante la compactación del manifiesto
+register_artifact() {
+    local path=$1
+    local category=$2
+    (
+        flock 9
+        echo "${path},${category},$(date +%s)" >> "$MANIFEST_FILE"
+    ) 9>>"${MANIFEST_FILE}.lock"
+}
+
+# Pesos de prioridad de envío desde PRIORITY_CONFIG (config_paths.py): VIP, pago completo, pago fallido, marcas VIP
+read -r PRIORITY_VIP PRIORITY_FULL PRIORITY_FAILED PRIORITY_VIP_MARKERS <<< "$(python3 -c \
+    "from config_paths import PRIORITY_CONFIG as p; print(p['vip'], p['full_payment'], p['failed_payment'], '|'.join(p['vip_markers']))" \
+    2>/dev/null || echo "100 20 -20 VIP")"
+
+# Función para calcular la prioridad de envío de una factura (igual que generador_facturas.py)
+invoice_priority() {
+    local pago=$1
+    local estado_pago=$2
+    local observaciones=$3
+    local priority=0
+    if [[ "$observaciones" =~ ($PRIORITY_VIP_MARKERS) ]]; then
+        priority=$((priority + PRIORITY_VIP))
+    fi
+    if [[ "$pago" == "Pago completo" ]]; then
+        priority=$((priority + PRIORITY_FULL))
+    fi
+    if [[ "$estado_pago" == "Fallido" ]]; then
+        priority=$((priority + PRIORITY_FAILED))
+    fi
+    echo "$priority"
+}
+
 # Función para mostrar ayuda
 show_help() {
     echo "Uso: $0 [archivo_csv] [plantilla_tex]"
+    echo "     $0 --lote N [archivo_csv]"
+    echo "     $0 --servidor [archivo_csv]"
+    echo "     $0 --estampar [--lote N | --servidor] [archivo_csv]"
+    echo "     $0 --incremental [--lote N | --servidor] [--estampar] [archivo_csv]"
     echo "Genera facturas PDF a partir de datos CSV usando plantilla LaTeX"
     echo ""
     echo "Opciones:"
     echo "  -h, --help     Mostrar esta ayuda"
+    echo "  --lote N       Compilar N facturas por ejecución de pdflatex (generador_facturas.py)"
+    echo "  --servidor     Compilar con procesos pdflatex calientes (servidor_latex.py)"
+    echo "  --estampar     Escribir los campos sobre un PDF base sin pdflatex (estampador_facturas.py)"
+    echo "  --incremental  Solo compras nuevas de todos los lotes; anexa a pendientes (ingesta_compras.py)"
     echo ""
     echo "Ejemplos:"
     echo "  $0 compras.csv plantilla_factura_IRSI.tex"
+    echo "  $0 --lote 50"
     echo "  $0  # Usa valores por defecto"
 }
 
 # Función para crear directorios necesarios
 setup_directories() {
-    mkdir -p "$LOG_DIR" "$PDF_DIR"
-    log_message "INFO" "Directorios creados: $LOG_DIR, $PDF_DIR"
+    mkdir -p "$LOG_DIR" "$PDF_DAY_DIR" "$(dirname "$MANIFEST_FILE")"
+    log_message "INFO" "Directorios creados: $LOG_DIR, $PDF_DAY_DIR"
 }
 
 # Función para validar archivos necesarios
@@ -72,7 +132,7 @@ validate_files() {
 # Función para limpiar archivos auxiliares de LaTeX
 cleanup_latex() {
     local base_name=$1
-    rm -f "${base_name}.aux" "${base_name}.log" "${base_name}.fls" "${base_name}.fdb_latexmk"
+    rm -f "${base_name}.aux" "${base_name}.log" "${base_name}.out" "${base_name}.fls" "${base_name}.fdb_latexmk"
 }
 
 # Función para sustituir placeholders en plantilla LaTeX
@@ -138,11 +198,15 @@ compile_latex() {
     log_message "INFO" "Compilando $tex_file"
     
     # Compilar con pdflatex
-    if pdflatex -output-directory="$PDF_DIR" -interaction=nonstopmode "$tex_file" > "$log_file" 2>&1; then
-        cleanup_latex "${PDF_DIR}/${base_name}"
-        log_message "INFO" "PDF generado: ${PDF_DIR}/${base_name}.pdf"
+    if pdflatex -output-directory="$PDF_DAY_DIR" -interaction=nonstopmode "$tex_file" > "$log_file" 2>&1; then
+        cleanup_latex "${PDF_DAY_DIR}/${base_name}"
+        register_artifact "${PDF_DAY_DIR}/${base_name}.pdf" "pdf"
+        register_artifact "$log_file" "log"
+        log_message "INFO" "PDF generado: ${PDF_DAY_DIR}/${base_name}.pdf"
         return 0
     else
+        register_artifact "$log_file" "log"
+        register_artifact "$tex_file" "temp"
         # Buscar errores en el log
         if grep -q "!" "$log_file"; then
             log_message "ERROR" "Error de compilación en $tex_file:"
@@ -196,8 +260,8 @@ process_invoice() {
     
     # Compilar a PDF
     if compile_latex "$tex_file"; then
-        # Agregar a lista de pendientes de envío
-        echo "${PDF_DIR}/${pdf_file},${correo}" >> "$PENDING_FILE"
+        # Agregar a lista de pendientes de envío (pdf,correo,prioridad)
+        write_pending_file append "${PDF_DAY_DIR}/${pdf_file},${correo},$(invoice_priority "$pago" "$estado_pago" "$observaciones")"
         log_message "INFO" "Factura agregada a pendientes: $pdf_file -> $correo"
         
         # Limpiar archivo temporal
@@ -221,6 +285,11 @@ main() {
         exit 0
     fi
     
+    # Modos por lotes, servidor, estampado e incremental: delegan en la versión Python
+    if [[ "$1" == "--lote" || "$1" == "--servidor" || "$1" == "--estampar" || "$1" == "--incremental" ]]; then
+        exec python3 generador_facturas.py "$@"
+    fi
+    
     # Inicializar log diario
     log_message "INFO" "=== INICIO DE GENERACIÓN DE FACTURAS ==="
     log_message "INFO" "Archivo CSV: $csv_file"
@@ -233,7 +302,7 @@ main() {
     validate_files "$csv_file" "$template_file"
     
     # Limpiar archivo de pendientes
-    > "$PENDING_FILE"
+    write_pending_file vacio
     
     # Contadores
     local total_lines=0
@@ -263,6 +332,11 @@ main() {
         
     done < "$csv_file"
     
+    # Reducir el tamaño de los PDFs antes de enviarlos
+    if [[ $successful -gt 0 ]]; then
+        log_message "INFO" "$(python3 optimizador_pdf.py --pendientes)"
+    fi
+    
     # Resumen final
     log_message "INFO" "=== RESUMEN DE GENERACIÓN ==="
     log_message "INFO" "Total procesadas: $((total_lines - 1))"
@@ -275,7 +349,7 @@ main() {
     echo -e "Total procesadas: $((total_lines - 1))"
     echo -e "Exitosas: ${GREEN}$successful${NC}"
     echo -e "Fallidas: ${RED}$failed${NC}"
-    echo -e "PDFs generados en: ${YELLOW}$PDF_DIR${NC}"
+    echo -e "PDFs generados en: ${YELLOW}$PDF_DAY_DIR${NC}"
     echo -e "Pendientes de envío: ${YELLOW}$PENDING_FILE${NC}"
     
     # Generar reporte con awk
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingesta Incremental de Compras
+Marcas de agua por archivo de compras (datos/compras_lote_*.csv): hasta qué
+byte se leyó cada archivo y qué transacciones ya se facturaron. Cada
+ejecución de generador_facturas.py --incremental lee solo lo que se anexó
+después de la marca, en todos los lotes, más las filas que fallaron en la
+ejecución anterior
+
+Los IDs de transacción solo son únicos dentro de un lote (generador_compras.py
+los repite entre lotes), así que las facturadas se recuerdan por archivo y se
+guardan como mucho las últimas 'invoiced_keep'. Si un mismo ID llega de dos
+lotes en la misma ejecución se factura una vez, con la fila del más reciente.
+Sin archivo de marcas (primera ejecución) los lotes anteriores al más reciente
+se dan por facturados y se marcan al final
+
+Lo usa generador_facturas.py --incremental
+Uso: python3 ingesta_compras.py [--estado] [--reiniciar archivo.csv]
+"""
+
+import csv
+import glob
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config_paths import INGEST_CONFIG, get_path
+from generador_facturas import InvoiceGenerator, InvoiceRecord, log_message
+
+
+@dataclass
+class SourceWatermark:
+    """Marca de agua de un archivo de compras"""
+    offset: int = 0                     # Primer byte sin leer (siempre al inicio de una línea)
+    line: int = 1                       # Número de la última línea leída
+    inode: int = 0
+    header: List[str] = field(default_factory=list)
+    invoiced: List[str] = field(default_factory=list)          # Transacciones ya facturadas
+    retry: List[Tuple[int, str, int]] = field(default_factory=list)  # (línea, texto, intentos)
+
+
+class PurchaseIngestor:
+    """Entrega las compras nuevas de todos los lotes y guarda el avance al confirmar"""
+
+    def __init__(self, state_file: Optional[str] = None, config: Dict = INGEST_CONFIG):
+        self.state_file = str(state_file or get_path('ingest_watermarks'))
+        self.max_retries = int(config.get('max_retries', 3))
+        self.invoiced_keep = int(config.get('invoiced_keep', 0))
+        self.marks: Dict[str, SourceWatermark] = self._load()
+        self._reached: Dict[str, Tuple[int, int, int, List[str]]] = {}   # fuente -> (offset, línea, inodo, encabezado)
+        self._origin: Dict[Tuple[str, str], Tuple[int, str, int]] = {}  # (fuente, id) -> (línea, texto, intentos)
+
+    def _load(self) -> Dict[str, SourceWatermark]:
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {
+            source: SourceWatermark(mark['offset'], mark['linea'], mark['inodo'], mark['encabezado'],
+                                    mark['facturadas'], [tuple(r) for r in mark['reintentar']])
+            for source, mark in data.items()
+        }
+
+    def save(self):
+        """Escribe las marcas de forma atómica"""
+        data = {
+            source: {'offset': m.offset, 'linea': m.line, 'inodo': m.inode, 'encabezado': m.header,
+                     'facturadas': m.invoiced, 'reintentar': [list(r) for r in m.retry]}
+            for source, m in self.marks.items()
+        }
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def sources() -> List[str]:
+        """Lotes de compras del más antiguo al más reciente"""
+        return sorted(glob.glob(str(get_path('data') / 'compras_lote_*.csv')), key=os.path.getmtime)
+
+    def _bootstrap(self, csv_files: List[str]):
+        """Primera ejecución: marca al final los lotes anteriores al más reciente"""
+        for csv_file in csv_files[:-1]:
+            source = os.path.abspath(csv_file)
+            with open(source, 'rb') as f:
+                first = f.readline()
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            header = next(csv.reader([first.decode('utf-8')]), [])
+            self.marks[source] = SourceWatermark(len(first) + len(complete), 1 + complete.count(b'\n'),
+                                                 os.stat(source).st_ino, header)
+            log_message("INFO", f"{os.path.basename(source)}: sin marca previa; se da por facturado")
+
+    def read_new(self, csv_files: List[str]) -> Tuple[List[InvoiceRecord], int]:
+        """Compras sin facturar de los archivos dados; devuelve también las filas inválidas
+
+        Un archivo reemplazado (otro inodo) o truncado se relee desde el principio;
+        las transacciones ya facturadas se descartan igualmente. Una última línea
+        incompleta (archivo aún en escritura) queda para la próxima ejecución.
+        """
+        if not os.path.exists(self.state_file):
+            self._bootstrap(csv_files)
+        records: Dict[str, InvoiceRecord] = {}
+        invalid = 0
+
+        for csv_file in csv_files:
+            source = os.path.abspath(csv_file)
+            mark = self.marks.get(source, SourceWatermark())
+            st = os.stat(source)
+            if mark.inode != st.st_ino or st.st_size < mark.offset:
+                if mark.offset:
+                    log_message("WARNING", f"{csv_file} fue reemplazado o truncado; se relee desde el inicio")
+                mark = SourceWatermark(header=mark.header, invoiced=mark.invoiced, retry=mark.retry)
+            self.marks[source] = mark
+            invoiced = set(mark.invoiced)
+
+            # Filas que fallaron antes: se reintentan con el encabezado que tenían
+            for line_number, text, attempts in mark.retry:
+                row = next(csv.reader([text]), [])
+                record = InvoiceGenerator.record_from_row(dict(zip(mark.header, row)), line_number)
+                if record is not None and record.invoice_id not in invoiced:
+                    records[record.invoice_id] = record
+                    self._origin[(source, record.invoice_id)] = (line_number, text, attempts)
+
+            with open(source, 'rb') as f:
+                header = mark.header
+                offset, line_number = mark.offset, mark.line
+                if offset == 0:
+                    first = f.readline()
+                    header = next(csv.reader([first.decode('utf-8')]), [])
+                    offset += len(first)
+                f.seek(offset)
+                chunk = f.read()
+
+            complete = chunk[:chunk.rfind(b'\n') + 1]
+            for text in complete.decode('utf-8').splitlines():
+                line_number += 1
+                if not text.strip():
+                    continue
+                row = next(csv.reader([text]), [])
+                record = InvoiceGenerator.record_from_row(dict(zip(header, row)), line_number)
+                if record is None:
+                    log_message("ERROR", f"{os.path.basename(source)} línea {line_number}: Campos obligatorios faltantes")
+                    invalid += 1
+                elif record.invoice_id in invoiced or (source, record.invoice_id) in self._origin:
+                    continue
+                else:
+                    # Un lote más reciente reemplaza la fila de otro con el mismo ID
+                    records.pop(record.invoice_id, None)
+                    records[record.invoice_id] = record
+                    self._origin[(source, record.invoice_id)] = (line_number, text, 0)
+
+            self._reached[source] = (offset + len(complete), line_number, st.st_ino, header)
+
+        return list(records.values()), invalid
+
+    def commit(self, invoiced_ids: List[str], skipped_ids: List[str]):
+        """Avanza las marcas: lo facturado se recuerda y lo demás se reintenta
+
+        Una fila fallida se reintenta en las siguientes ejecuciones hasta
+        'max_retries' veces; las que no alcanzó el presupuesto de tiempo vuelven
+        sin contar como intento.
+        """
+        done, skipped = set(invoiced_ids), set(skipped_ids)
+        for source, (offset, line_number, inode, header) in self._reached.items():
+            mark = self.marks[source]
+            mark.offset, mark.line, mark.inode, mark.header = offset, line_number, inode, header
+            mark.retry = []
+
+        for (source, invoice_id), (line_number, text, attempts) in self._origin.items():
+            mark = self.marks[source]
+            if invoice_id in done:
+                mark.invoiced.append(invoice_id)
+            elif invoice_id in skipped:
+                mark.retry.append((line_number, text, attempts))
+            elif attempts + 1 < self.max_retries:
+                mark.retry.append((line_number, text, attempts + 1))
+            else:
+                log_message("ERROR", f"Factura {invoice_id} descartada tras {self.max_retries} intentos")
+
+        # Las facturadas solo evitan repetir un lote reescrito: basta con las últimas
+        for mark in self.marks.values():
+            if self.invoiced_keep and len(mark.invoiced) > self.invoiced_keep:
+                del mark.invoiced[:-self.invoiced_keep]
+
+        # Los lotes eliminados por la retención ya no necesitan marca
+        self.marks = {source: mark for source, mark in self.marks.items() if os.path.exists(source)}
+        self.save()
+        self._reached, self._origin = {}, {}
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    ingestor = PurchaseIngestor()
+
+    if '--reiniciar' in args:
+        source = os.path.abspath(args[args.index('--reiniciar') + 1])
+        ingestor.marks.pop(source, None)
+        ingestor.save()
+        print(f"Marca reiniciada: {source}")
+        return
+
+    for source, mark in ingestor.marks.items():
+        print(f"{os.path.basename(source)}: línea {mark.line}, byte {mark.offset}, "
+              f"{len(mark.invoiced)} facturadas, {len(mark.retry)} por reintentar")
+
+
+if __name__ == "__main__":
+    main()
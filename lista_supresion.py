@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lista de Supresión por Rebote Permanente
+Los destinatarios que el servidor rechaza de forma permanente (550, 551, 553)
+se guardan en una base SQLite con su código, motivo y vencimiento. Antes de
+enviar, enviador.py consulta cada dirección y las suprimidas se registran con
+estado 'suprimido' en lugar de intentarse en cada ejecución
+
+Delante de la base hay un filtro de Bloom en memoria (guardado en
+datos/supresion.bloom): casi todas las direcciones no están suprimidas y el
+filtro lo responde en O(1) sin tocar la base; solo un posible positivo se
+confirma con la consulta exacta, que también descarta las entradas vencidas.
+El filtro se completa con las filas nuevas de la base al abrirlo y se
+reconstruye al purgar los vencidos
+
+Uso: python3 lista_supresion.py [--estado] [--purgar] [--agregar CORREO] [--quitar CORREO]
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from config_paths import SUPPRESSION_CONFIG, get_path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suprimidos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL UNIQUE,
+    codigo INTEGER,
+    motivo TEXT,
+    creado REAL NOT NULL,
+    vence REAL
+);
+"""
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray con doble hash de blake2b"""
+
+    HEADER = struct.Struct('<QQq')  # bits, hashes, última fila de la base incluida
+
+    def __init__(self, bits: int, hashes: int, watermark: int = 0, data: Optional[bytearray] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.watermark = watermark
+        self.data = data if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, entries: int, false_positive_rate: float) -> 'BloomFilter':
+        """Tamaño óptimo para 'entries' elementos con la tasa de falsos positivos indicada"""
+        entries = max(1, entries)
+        bits = max(64, int(-entries * math.log(false_positive_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / entries * math.log(2)))
+        return cls(bits, hashes)
+
+    def _positions(self, key: str) -> Iterator[int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.bits, self.hashes, self.watermark))
+            f.write(self.data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['BloomFilter']:
+        try:
+            with open(path, 'rb') as f:
+                bits, hashes, watermark = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                data = bytearray(f.read())
+        except (OSError, struct.error):
+            return None
+        if len(data) != (bits + 7) // 8:
+            return None
+        return cls(bits, hashes, watermark, data)
+
+
+class SuppressionList:
+    """Direcciones con rebote permanente: filtro de Bloom y base exacta"""
+
+    def __init__(self, db_file: Optional[str] = None, bloom_file: Optional[str] = None,
+                 config: Dict = SUPPRESSION_CONFIG):
+        self.db_file = str(db_file or get_path('suppression_db'))
+        self.bloom_file = str(bloom_file or get_path('suppression_bloom'))
+        self.expire_seconds = float(config.get('expire_days', 0)) * 86400
+        self.codes = set(config.get('codes', []))
+        self.capacity = int(config.get('expected_entries', 1000000))
+        self.false_positive_rate = float(config.get('false_positive_rate', 0.001))
+        self._lock = threading.Lock()
+        self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+
+        db = self._connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+        self.bloom = self._load_bloom()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Una conexión por operación: los hilos de entrega no comparten conexiones"""
+        return sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def _empty_bloom(self, count: int) -> BloomFilter:
+        """Filtro para 'expected_entries', duplicando la capacidad mientras no alcance"""
+        capacity = self.capacity
+        while capacity < count:
+            capacity *= 2
+        return BloomFilter.for_capacity(capacity, self.false_positive_rate)
+
+    def _load_bloom(self) -> BloomFilter:
+        """Filtro guardado más las filas agregadas desde entonces (por este u otro proceso)"""
+        bloom = BloomFilter.load(self.bloom_file)
+        db = self._connect()
+        try:
+            count = db.execute("SELECT COUNT(*) FROM suprimidos").fetchone()[0]
+            # Un filtro sobrepasado o de otra configuración pierde precisión: se reconstruye
+            empty = self._empty_bloom(count)
+            if bloom is None or (bloom.bits, bloom.hashes) != (empty.bits, empty.hashes):
+                bloom = empty
+            rows = db.execute("SELECT id, email FROM suprimidos WHERE id > ? ORDER BY id", (bloom.watermark,))
+            for row_id, email in rows:
+                bloom.add(email)
+                bloom.watermark = row_id
+                self._dirty = True
+        finally:
+            db.close()
+        return bloom
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return email.strip().lower()
+
+    def is_permanent(self, smtp_code: Optional[int]) -> bool:
+        """Indica si un código de rechazo de destinatario suprime la dirección"""
+        return smtp_code in self.codes
+
+    def contains(self, email: str) -> bool:
+        """Indica si la dirección está suprimida y vigente"""
+        key = self._key(email)
+        if key not in self.bloom:
+            return False
+        db = self._connect()
+        try:
+            row = db.execute("SELECT vence FROM suprimidos WHERE email = ?", (key,)).fetchone()
+        finally:
+            db.close()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def add(self, email: str, smtp_code: Optional[int] = None, reason: str = ''):
+        """Suprime una dirección (o renueva su vencimiento)"""
+        key = self._key(email)
+        now = time.time()
+        expires = now + self.expire_seconds if self.expire_seconds else None
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO suprimidos (email, codigo, motivo, creado, vence) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(email) DO UPDATE SET codigo = excluded.codigo, motivo = excluded.motivo, "
+                "creado = excluded.creado, vence = excluded.vence",
+                (key, smtp_code, reason, now, expires)
+            )
+        with self._lock:
+            self.bloom.add(key)
+            self._dirty = True
+
+    def remove(self, email: str) -> bool:
+        """Quita una dirección de la lista (el filtro queda con un falso positivo hasta purgar)"""
+        with self._transaction() as db:
+            return db.execute("DELETE FROM suprimidos WHERE email = ?", (self._key(email),)).rowcount > 0
+
+    def purge(self) -> int:
+        """Elimina las entradas vencidas y reconstruye el filtro sin ellas"""
+        with self._transaction() as db:
+            removed = db.execute("DELETE FROM suprimidos WHERE vence IS NOT NULL AND vence <= ?",
+                                 (time.time(),)).rowcount
+            count = db.execute("SELECT COUNT(*) FROM suprimidos").fetchone()[0]
+            bloom = self._empty_bloom(count)
+            for row_id, email in db.execute("SELECT id, email FROM suprimidos ORDER BY id"):
+                bloom.add(email)
+                bloom.watermark = row_id
+        with self._lock:
+            self.bloom = bloom
+            self._dirty = True
+        self.save()
+        return removed
+
+    def save(self):
+        """Guarda el filtro si cambió"""
+        with self._lock:
+            if self._dirty:
+                self.bloom.save(self.bloom_file)
+                self._dirty = False
+
+    def stats(self) -> Dict[str, int]:
+        db = self._connect()
+        try:
+            total, active = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(vence IS NULL OR vence > ?), 0) FROM suprimidos", (time.time(),)
+            ).fetchone()
+        finally:
+            db.close()
+        return {'total': total, 'vigentes': active, 'vencidas': total - active,
+                'filtro_kb': len(self.bloom.data) // 1024}
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    suppression = SuppressionList()
+    if '--agregar' in args:
+        email = args[args.index('--agregar') + 1]
+        suppression.add(email, reason='Agregado manualmente')
+        print(f"Suprimido: {email}")
+    if '--quitar' in args:
+        email = args[args.index('--quitar') + 1]
+        print(f"{'Quitado' if suppression.remove(email) else 'No estaba suprimido'}: {email}")
+    if '--purgar' in args:
+        print(f"Entradas vencidas eliminadas: {suppression.purge()}")
+    suppression.save()
+    if '--estado' in args or not args:
+        for key, value in suppression.stats().items():
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
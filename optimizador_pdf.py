@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optimizador de PDFs
+Reduce el tamaño de las facturas antes de adjuntarlas: Ghostscript vuelve a
+subconjuntar las fuentes y las guarda en formato compacto, qpdf agrupa los
+objetos en flujos comprimidos y pypdf (si no hay qpdf) elimina objetos
+duplicados y comprime los contenidos. Solo se conserva el resultado si es
+más pequeño que el original
+
+Uso: python3 optimizador_pdf.py [--pendientes] [archivo.pdf ...]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from config_paths import BASE_DIR, PDF_OPTIMIZE_CONFIG, get_path
+
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pypdf es opcional
+    PdfWriter = None
+
+
+@dataclass
+class OptimizationStats:
+    """Tamaño total de los PDFs antes y después de optimizar"""
+    files: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+    @property
+    def saved_percent(self) -> float:
+        if self.bytes_before == 0:
+            return 0.0
+        return (1 - self.bytes_after / self.bytes_before) * 100
+
+    def summary(self) -> str:
+        """Línea para el log diario (ReportGenerator la lee con este formato)"""
+        return (f"Optimización de PDFs: {self.files} archivos, "
+                f"{self.bytes_before} bytes -> {self.bytes_after} bytes (-{self.saved_percent:.1f}%)")
+
+
+class PdfOptimizer:
+    """Aplica en orden las herramientas de optimización disponibles"""
+
+    def __init__(self, tools: Optional[List[str]] = None, config=PDF_OPTIMIZE_CONFIG):
+        self.config = config
+        tools = config['tools'] if tools is None else tools
+        self.stages: List[Tuple[str, Callable[[str, str], None]]] = []
+
+        if 'ghostscript' in tools and shutil.which('gs'):
+            self.stages.append(('ghostscript', self._ghostscript))
+        if 'qpdf' in tools and shutil.which('qpdf'):
+            self.stages.append(('qpdf', self._qpdf))
+        elif 'pypdf' in tools and PdfWriter is not None:
+            # pypdf no escribe flujos de objetos: solo se usa cuando falta qpdf
+            self.stages.append(('pypdf', self._pypdf))
+
+    @property
+    def available(self) -> bool:
+        return bool(self.stages)
+
+    @staticmethod
+    def _ghostscript(source: str, target: str):
+        """Reescribe el PDF con fuentes subconjuntadas y comprimidas (CFF)"""
+        subprocess.run(
+            ['gs', '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER', '-sDEVICE=pdfwrite',
+             '-dCompatibilityLevel=1.5', '-dSubsetFonts=true', '-dCompressFonts=true',
+             '-dEmbedAllFonts=true', '-dDetectDuplicateImages=true', '-dAutoRotatePages=/None',
+             f'-sOutputFile={target}', source],
+            check=True, capture_output=True
+        )
+
+    @staticmethod
+    def _qpdf(source: str, target: str):
+        """Flujos de objetos y recompresión de todos los flujos"""
+        subprocess.run(
+            ['qpdf', '--object-streams=generate', '--compress-streams=y', '--recompress-flate',
+             '--compression-level=9', source, target],
+            check=True, capture_output=True
+        )
+
+    @staticmethod
+    def _pypdf(source: str, target: str):
+        """Elimina objetos repetidos o huérfanos y comprime los contenidos"""
+        writer = PdfWriter(clone_from=source)
+        for page in writer.pages:
+            page.compress_content_streams(level=9)
+        writer.compress_identical_objects()
+        with open(target, 'wb') as out:
+            writer.write(out)
+
+    def optimize(self, pdf_path: str) -> Tuple[int, int]:
+        """Optimiza un PDF en su lugar; devuelve (bytes antes, bytes después)"""
+        before = os.path.getsize(pdf_path)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(pdf_path))) as tmp_dir:
+            current = pdf_path
+            for position, (_, stage) in enumerate(self.stages):
+                target = os.path.join(tmp_dir, f"etapa_{position}.pdf")
+                try:
+                    stage(current, target)
+                except Exception:
+                    # Una herramienta que falla no invalida la factura: se sigue con la anterior
+                    continue
+                current = target
+
+            after = os.path.getsize(current)
+            if current == pdf_path or after >= before:
+                return before, before
+            os.replace(current, pdf_path)
+            return before, after
+
+    def optimize_many(self, pdf_paths: Iterable[str]) -> OptimizationStats:
+        """Optimiza varios PDFs en paralelo y acumula los tamaños"""
+        stats = OptimizationStats()
+        lock = threading.Lock()
+
+        def work(path: str):
+            before, after = self.optimize(path)
+            with lock:
+                stats.files += 1
+                stats.bytes_before += before
+                stats.bytes_after += after
+
+        workers = max(1, int(self.config.get('workers', 1)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(work, (p for p in pdf_paths if os.path.exists(p))))
+        return stats
+
+
+def pending_pdfs() -> List[str]:
+    """PDFs listados en el archivo de pendientes de envío"""
+    pending_file = get_path('pending')
+    if not pending_file.exists():
+        return []
+    paths = []
+    with open(pending_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            pdf_path = line.split(',', 1)[0].strip()
+            if pdf_path:
+                paths.append(pdf_path if os.path.isabs(pdf_path) else str(BASE_DIR / pdf_path))
+    return paths
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    if not args or args[0] in ('-h', '--help'):
+        print(__doc__)
+        sys.exit(0)
+
+    paths = [arg for arg in args if arg != '--pendientes']
+    if '--pendientes' in args:
+        paths.extend(pending_pdfs())
+
+    optimizer = PdfOptimizer()
+    if not optimizer.available:
+        print("Optimización de PDFs omitida: no hay gs, qpdf ni pypdf disponibles")
+        return
+
+    print(optimizer.optimize_many(paths).summary())
+
+
+if __name__ == "__main__":
+    main()
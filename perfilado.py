@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perfilado por Etapas
+Envuelve cada etapa de un script (lectura, compilación, envío, reporte...) en
+cProfile y/o tracemalloc y deja los resultados en logs/perfiles/:
+
+  <script>_<AAAAmmdd_HHMMSS>_<etapa>.prof          perfil de CPU (pstats / snakeviz)
+  <script>_<AAAAmmdd_HHMMSS>_<etapa>_memoria.txt   las N líneas que más memoria
+                                                    asignaron durante la etapa y el pico
+
+Se activa con --perfilar cpu,memoria (o solo uno de los dos) en enviador.py,
+generador_facturas.py y generador_compras.py, o con la variable de entorno
+PERFILAR. Desactivado, cada etapa es un contextlib.nullcontext y no cuesta nada
+
+cProfile mide el hilo que ejecuta la etapa: en las etapas con hilos de trabajo
+el tiempo de esos hilos aparece como espera. tracemalloc cuenta las
+asignaciones de todos los hilos
+
+Uso: python3 perfilado.py archivo.prof [N]   (muestra las N funciones más costosas)
+"""
+
+import contextlib
+import cProfile
+import datetime
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Callable, ContextManager, List, Optional, Set, Tuple
+
+from config_paths import PROFILE_CONFIG, get_path
+from retencion import ArtifactManifest
+
+ENV_VARIABLE = 'PERFILAR'
+MODES = ('cpu', 'memoria')
+
+
+class StageProfiler:
+    """Perfiles de CPU y memoria por etapa de un script"""
+
+    def __init__(self, script: str, modes: Set[str], log: Callable[[str], None] = print,
+                 output_dir: Optional[str] = None, config=PROFILE_CONFIG):
+        self.script = script
+        self.modes = modes
+        self.log = log
+        self.output_dir = output_dir or str(get_path('profiles'))
+        self.top_n = int(config.get('top_n', 25))
+        self.frames = int(config.get('traceback_frames', 1))
+        self.prefix = f"{script}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    @staticmethod
+    def parse_arg(argv: List[str]) -> Tuple[Set[str], List[str]]:
+        """Modos de --perfilar MODOS (o de PERFILAR) y los argumentos restantes"""
+        rest = list(argv)
+        value = os.environ.get(ENV_VARIABLE, '')
+        if '--perfilar' in rest:
+            position = rest.index('--perfilar')
+            value = rest[position + 1]
+            del rest[position:position + 2]
+        modes = {mode.strip() for mode in value.split(',') if mode.strip()}
+        unknown = modes - set(MODES)
+        if unknown:
+            raise ValueError(f"Modos de perfilado desconocidos: {', '.join(sorted(unknown))} (use cpu, memoria)")
+        return modes, rest
+
+    @classmethod
+    def from_argv(cls, script: str, argv: List[str],
+                  log: Callable[[str], None] = print) -> Tuple['StageProfiler', List[str]]:
+        """Perfilador según la línea de comandos y el entorno; quita --perfilar de argv"""
+        modes, rest = cls.parse_arg(argv)
+        return cls(script, modes, log), rest
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.modes)
+
+    def stage(self, name: str) -> ContextManager:
+        """Contexto que perfila una etapa; sin modos activos no hace nada"""
+        if not self.modes:
+            return contextlib.nullcontext()
+        return self._profile(name)
+
+    @contextlib.contextmanager
+    def _profile(self, name: str):
+        profiler = cProfile.Profile() if 'cpu' in self.modes else None
+        started_tracing = False
+        before = None
+        if 'memoria' in self.modes:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                started_tracing = True
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            # La instantánea final va antes de escribir nada, para no medir el propio volcado
+            if before is not None:
+                after = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            base = os.path.join(self.output_dir, f"{self.prefix}_{name}")
+            outputs = []
+            if profiler is not None:
+                profiler.dump_stats(base + '.prof')
+                outputs.append(base + '.prof')
+            if before is not None:
+                self._write_memory(base + '_memoria.txt', name, before, after, peak, elapsed)
+                outputs.append(base + '_memoria.txt')
+
+            # Los perfiles vencen con la retención de logs
+            ArtifactManifest().register_many((path, 'log', None) for path in outputs)
+            self.log(f"Perfil de la etapa {name} ({elapsed:.2f} s): {base}.*")
+
+    def _write_memory(self, path: str, name: str, before: tracemalloc.Snapshot,
+                      after: tracemalloc.Snapshot, peak: int, elapsed: float):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Etapa: {self.script}/{name}\n")
+            f.write(f"Duración: {elapsed:.2f} s\n")
+            f.write(f"Pico de memoria rastreada: {peak / 1024:,.0f} KB\n")
+            f.write(f"Crecimiento neto: {sum(stat.size_diff for stat in diff) / 1024:,.0f} KB\n\n")
+            f.write(f"Top {self.top_n} líneas por memoria asignada durante la etapa:\n")
+            for stat in diff[:self.top_n]:
+                f.write(f"{stat}\n")
+
+
+def main():
+    """Función principal"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else PROFILE_CONFIG.get('top_n', 25)
+    pstats.Stats(sys.argv[1]).sort_stats('cumulative').print_stats(limit)
+
+
+if __name__ == "__main__":
+    main()
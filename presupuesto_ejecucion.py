@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Presupuesto de Tiempo de Ejecución
+Límite de tiempo para las etapas Python del proceso automático. Con el ritmo
+observado (unidades terminadas por segundo) se proyecta cuánto tomaría la
+siguiente unidad de trabajo; si no alcanza a terminar antes del límite menos
+un margen, la etapa deja de tomar trabajo nuevo y el resto queda para la
+próxima ejecución
+
+El límite se toma, en orden, de --presupuesto SEGUNDOS, de la variable de
+entorno PRESUPUESTO_SEGUNDOS (la define cron_job.sh) o de RUN_BUDGET_CONFIG
+"""
+
+import datetime
+import os
+import threading
+import time
+from typing import List, Optional
+
+from config_paths import RUN_BUDGET_CONFIG
+
+
+ENV_VARIABLE = 'PRESUPUESTO_SEGUNDOS'
+
+
+class RunBudget:
+    """Límite de tiempo de una etapa con proyección según el ritmo observado"""
+
+    def __init__(self, seconds: Optional[float], margin: float = 0.0):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.margin = margin
+        self.started = time.monotonic()
+        self.deadline = self.started + self.seconds if self.seconds else None
+        self.completed = 0
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_stage(cls, stage: str, seconds: Optional[float] = None, config=RUN_BUDGET_CONFIG) -> 'RunBudget':
+        """Presupuesto de 'generador' o 'enviador' (argumento > entorno > configuración)"""
+        if seconds is None and os.environ.get(ENV_VARIABLE):
+            seconds = float(os.environ[ENV_VARIABLE])
+        if seconds is None:
+            seconds = config.get(f'{stage}_seconds')
+        return cls(seconds, float(config.get('margin_seconds', 0)))
+
+    @staticmethod
+    def parse_arg(argv: List[str]) -> Optional[float]:
+        """Valor de --presupuesto SEGUNDOS en la línea de comandos, si está"""
+        if '--presupuesto' not in argv:
+            return None
+        position = argv.index('--presupuesto')
+        return float(argv[position + 1])
+
+    @property
+    def limited(self) -> bool:
+        return self.deadline is not None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def record(self, units: int = 1):
+        """Registra unidades terminadas (facturas generadas o enviadas)"""
+        with self._lock:
+            self.completed += units
+
+    def projected_seconds(self, units: int) -> float:
+        """Segundos que tomarían 'units' unidades más al ritmo observado"""
+        with self._lock:
+            completed = self.completed
+        if completed == 0:
+            return 0.0
+        return self.elapsed() / completed * units
+
+    def allows(self, units: int = 1) -> bool:
+        """Indica si 'units' unidades más alcanzan a terminar antes del límite
+
+        Una vez agotado, el presupuesto sigue agotado aunque el ritmo mejore.
+        """
+        if self.deadline is None:
+            return True
+        if self.exhausted:
+            return False
+        if self.remaining() - self.margin < self.projected_seconds(units):
+            with self._lock:
+                self.exhausted = True
+            return False
+        return True
+
+    def summary(self, left: int) -> str:
+        """Resumen para el log cuando quedó trabajo sin hacer"""
+        elapsed = self.elapsed()
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        finish = datetime.datetime.now() + datetime.timedelta(seconds=self.projected_seconds(left))
+        return (f"Límite de {self.seconds:.0f} s alcanzado: {left} pendientes para la próxima ejecución "
+                f"({self.completed} en {elapsed:.0f} s, {rate:.2f}/s; "
+                f"se habrían terminado cerca de las {finish.strftime('%H:%M:%S')})")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registro Estructurado en Segundo Plano
+Modo de logging en el que los hilos de envío solo encolan los registros: un
+hilo aparte les da formato y los escribe como líneas JSON (y en texto en la
+terminal). Los mensajes por fila se pueden muestrear por categoría; las
+advertencias y errores se registran siempre
+
+Lo usa enviador.py cuando LOGGING_CONFIG['enviador_mode'] es 'cola'; el archivo
+JSON se rota como los demás logs (rotacion_logs.py)
+"""
+
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+from typing import Dict, List
+
+from rotacion_logs import SegmentedFileHandler
+
+# Atributos estándar de LogRecord: lo demás llegó por 'extra' y va al JSON
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class CategorySampler(logging.Filter):
+    """Deja pasar una fracción fija de los registros de cada categoría
+
+    La categoría llega en extra={'categoria': ...}. Con fracción 0.1 se
+    registra uno de cada diez (el primero, el undécimo...), de forma
+    determinista. Los registros sin categoría o de nivel WARNING o superior
+    pasan siempre.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._credit: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, 'categoria', None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(category, 1.0)
+        if rate >= 1.0:
+            return True
+        with self._lock:
+            # Acumulador: cada registro suma 'rate' y se emite al completar una unidad
+            credit = self._credit.get(category, 1.0) + rate
+            emit = credit >= 1.0
+            self._credit[category] = credit - 1.0 if emit else credit
+        return emit
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Un objeto JSON compacto por línea con los campos de 'extra'"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro sin darle formato: el mensaje se arma en el hilo del listener
+
+    Los argumentos de los mensajes del enviador son cadenas y números, que no
+    cambian después de encolarse.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_queue_logging(json_file: str, rates: Dict[str, float], level: int = logging.INFO,
+                        text_format: str = '%(asctime)s [%(levelname)s] %(message)s') -> logging.handlers.QueueListener:
+    """Reemplaza los handlers del logger raíz por una cola atendida en segundo plano
+
+    Devuelve el listener; al detenerlo se escriben los registros pendientes.
+    """
+    records: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+
+    json_handler = SegmentedFileHandler(json_file)
+    json_handler.setFormatter(JsonLineFormatter())
+    terminal = logging.StreamHandler()
+    terminal.setFormatter(logging.Formatter(text_format))
+    handlers: List[logging.Handler] = [json_handler, terminal]
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(CategorySampler(rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener.start()
+    return listener
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gestor de Retención de Artefactos
+Elimina (y opcionalmente archiva) PDFs, logs y temporales vencidos usando un
+manifiesto de creación en lugar de recorrer los directorios con find
+
+Uso: python3 retencion.py [--inicializar] [--archivar] [--simular]
+"""
+
+import csv
+import fcntl
+import os
+import sys
+import tarfile
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config_paths import BASE_DIR, CLEANUP_CONFIG, RETENTION_CATEGORIES, get_path
+
+
+# Patrones usados solo por --inicializar para sembrar el manifiesto una vez
+BOOTSTRAP_PATTERNS = [
+    ('pdf', '*/*/*/factura_*.pdf', 'pdf'),
+    ('pdf', '*/*/*.pack', 'pdf'),
+    ('pdf', '*/*/*.idx', 'pdf'),
+    ('pdf', 'factura_*.pdf', 'pdf'),
+    ('pdf', 'factura_*.out', 'temp'),
+    ('logs', 'factura_*.log', 'log'),
+    ('reports', '*.txt', 'report'),
+    ('backup', '*.tar.gz', 'backup'),
+]
+
+
+@dataclass
+class ManifestEntry:
+    """Artefacto registrado en el manifiesto"""
+    path: str
+    category: str
+    created: float
+
+
+class ArtifactManifest:
+    """Manifiesto CSV (ruta, categoría, epoch de creación) de artefactos generados
+
+    Las altas son anexos de una línea, de modo que los scripts bash pueden
+    registrar archivos con un simple echo >> sin pasar por Python.
+    """
+
+    def __init__(self, manifest_file: Optional[str] = None):
+        self.manifest_file = Path(manifest_file or get_path('artifact_manifest'))
+        self.lock_file = self.manifest_file.with_name(self.manifest_file.name + '.lock')
+
+    def _lock(self):
+        """Bloqueo exclusivo entre procesos Python que reescriben el manifiesto"""
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.lock_file, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    @staticmethod
+    def relative_path(path: str) -> str:
+        """Ruta relativa al proyecto cuando es posible"""
+        try:
+            return str(Path(path).absolute().relative_to(BASE_DIR))
+        except ValueError:
+            return str(path)
+
+    def register(self, path: str, category: str, created: Optional[float] = None):
+        """Registra un artefacto recién creado"""
+        self.register_many([(path, category, created)])
+
+    def register_many(self, entries: Iterable[Tuple[str, str, Optional[float]]]):
+        """Registra varios artefactos con una sola escritura"""
+        now = time.time()
+        lines = [
+            [self.relative_path(path), category, f"{created if created is not None else now:.0f}"]
+            for path, category, created in entries
+        ]
+        if not lines:
+            return
+
+        handle = self._lock()
+        try:
+            with open(self.manifest_file, 'a', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(lines)
+        finally:
+            handle.close()
+
+    def read(self) -> Tuple[List[ManifestEntry], int]:
+        """Lee todas las entradas y devuelve también el tamaño leído en bytes"""
+        entries = []
+        if not self.manifest_file.exists():
+            return entries, 0
+
+        with open(self.manifest_file, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+
+        for row in csv.reader(content.splitlines()):
+            if len(row) < 3:
+                continue
+            try:
+                entries.append(ManifestEntry(row[0], row[1], float(row[2])))
+            except ValueError:
+                continue
+        return entries, len(content.encode('utf-8'))
+
+    def rewrite(self, entries: List[ManifestEntry], read_size: int):
+        """Reescribe el manifiesto conservando las líneas anexadas durante el barrido"""
+        handle = self._lock()
+        try:
+            tail = b''
+            if self.manifest_file.exists():
+                with open(self.manifest_file, 'rb') as f:
+                    f.seek(read_size)
+                    tail = f.read()
+
+            tmp_file = self.manifest_file.with_name(self.manifest_file.name + '.tmp')
+            with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(
+                    [e.path, e.category, f"{e.created:.0f}"] for e in entries
+                )
+            with open(tmp_file, 'ab') as f:
+                f.write(tail)
+            os.replace(tmp_file, self.manifest_file)
+        finally:
+            handle.close()
+
+
+class RetentionManager:
+    """Aplica CLEANUP_CONFIG sobre los artefactos del manifiesto"""
+
+    def __init__(self, manifest: Optional[ArtifactManifest] = None, config: Dict = CLEANUP_CONFIG):
+        self.manifest = manifest or ArtifactManifest()
+        self.config = config
+
+    def retention_days(self, category: str) -> Optional[int]:
+        """Días de retención de una categoría (None si no se gestiona)"""
+        key = RETENTION_CATEGORIES.get(category)
+        if key is None:
+            return None
+        return self.config.get(key)
+
+    def _is_expired(self, entry: ManifestEntry, now: float) -> bool:
+        days = self.retention_days(entry.category)
+        if days is None:
+            return False
+        return now - entry.created > days * 86400
+
+    @staticmethod
+    def _absolute(path: str) -> Path:
+        candidate = Path(path)
+        return candidate if candidate.is_absolute() else BASE_DIR / candidate
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        """Borra un archivo; si ya no existe también cuenta como eliminado"""
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def _archive(self, expired: List[ManifestEntry]) -> List[str]:
+        """Empaqueta los archivos vencidos en backup/, uno por categoría"""
+        archives = []
+        backup_dir = get_path('backup')
+        backup_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        by_category: Dict[str, List[ManifestEntry]] = {}
+        for entry in expired:
+            by_category.setdefault(entry.category, []).append(entry)
+
+        for category, entries in by_category.items():
+            if category == 'backup':
+                continue
+            archive_file = backup_dir / f"retencion_{category}_{stamp}.tar.gz"
+            with tarfile.open(archive_file, 'w:gz') as tar:
+                for entry in entries:
+                    path = self._absolute(entry.path)
+                    if path.exists():
+                        tar.add(path, arcname=entry.path)
+            archives.append(str(archive_file))
+
+        if archives:
+            self.manifest.register_many((archive, 'backup', None) for archive in archives)
+        return archives
+
+    def sweep(self, archive: Optional[bool] = None, dry_run: bool = False,
+              now: Optional[float] = None) -> Dict[str, int]:
+        """Elimina por lotes los artefactos vencidos y compacta el manifiesto"""
+        now = now or time.time()
+        archive = self.config.get('archive_expired', False) if archive is None else archive
+        batch_size = max(1, int(self.config.get('batch_size', 500)))
+        workers = max(1, int(self.config.get('workers', 1)))
+
+        entries, read_size = self.manifest.read()
+        expired = [e for e in entries if self._is_expired(e, now)]
+
+        stats = {'registrados': len(entries), 'vencidos': len(expired), 'eliminados': 0,
+                 'errores': 0, 'archivos_backup': 0}
+        if dry_run or not expired:
+            return stats
+
+        if archive:
+            stats['archivos_backup'] = len(self._archive(expired))
+
+        kept_failures: List[ManifestEntry] = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(expired), batch_size):
+                batch = expired[start:start + batch_size]
+                results = executor.map(self._remove, (self._absolute(e.path) for e in batch))
+                for entry, removed in zip(batch, results):
+                    if removed:
+                        stats['eliminados'] += 1
+                    else:
+                        stats['errores'] += 1
+                        kept_failures.append(entry)
+
+        expired_ids = {id(e) for e in expired}
+        remaining = [e for e in entries if id(e) not in expired_ids] + kept_failures
+        self.manifest.rewrite(remaining, read_size)
+
+        return stats
+
+    def bootstrap(self) -> int:
+        """Siembra el manifiesto con los artefactos ya existentes (una sola vez)"""
+        known = {entry.path for entry in self.manifest.read()[0]}
+        found = []
+        for dir_key, pattern, category in BOOTSTRAP_PATTERNS:
+            directory = get_path(dir_key)
+            if not directory.exists():
+                continue
+            for path in directory.glob(pattern):
+                relative = ArtifactManifest.relative_path(str(path))
+                if relative not in known:
+                    found.append((relative, category, path.stat().st_mtime))
+
+        self.manifest.register_many(found)
+        return len(found)
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    manager = RetentionManager()
+
+    if '--inicializar' in args:
+        added = manager.bootstrap()
+        print(f"Manifiesto inicializado: {added} artefactos registrados")
+
+    stats = manager.sweep(archive=True if '--archivar' in args else None,
+                          dry_run='--simular' in args)
+
+    print("=== RETENCIÓN DE ARTEFACTOS ===")
+    print(f"Registrados: {stats['registrados']}")
+    print(f"Vencidos: {stats['vencidos']}")
+    print(f"Eliminados: {stats['eliminados']}")
+    if stats['archivos_backup']:
+        print(f"Archivos de respaldo: {stats['archivos_backup']}")
+    if stats['errores']:
+        print(f"Errores: {stats['errores']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
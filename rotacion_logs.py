@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rotación de Logs por Día y Tamaño
+log_diario.log, envios/enviador.log (y .jsonl) y cron_execution.log se cierran
+en un segmento comprimido cuando cambia el día de su primera línea o superan
+'max_bytes'. Los segmentos quedan en logs/segmentos/ y un índice CSV
+(log, segmento, primer día, último día, líneas, bytes) permite abrir solo los
+segmentos de las fechas que se consultan:
+
+  logs/segmentos/log_diario_2024-05-02_000.log.gz
+  logs/segmentos/indice.csv
+
+La rotación copia y trunca el archivo vivo: todos los escritores (tee -a, >>,
+open('a') y logging) escriben con O_APPEND y siguen haciéndolo sin reabrirlo.
+Lo anexado durante la compresión entra al segmento, pero los escritores no
+toman el bloqueo: lo que se escriba entre la última lectura y el truncado se
+pierde. Es la ventana de copytruncate en logrotate: dos llamadas al sistema,
+más larga si el proceso que rota pierde la CPU justo entre ellas
+Los segmentos vencen con la retención de logs (retencion.py)
+
+Compresión gzip, o zstd si está instalado el módulo zstandard
+
+Uso: python3 rotacion_logs.py [--forzar]
+     python3 rotacion_logs.py --leer daily_log|enviador_log|enviador_json_log|cron_log [--desde AAAA-MM-DD] [--hasta AAAA-MM-DD]
+"""
+
+import csv
+import datetime
+import fcntl
+import gzip
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from config_paths import BASE_DIR, LOG_ROTATION_CONFIG, get_path
+from retencion import ArtifactManifest
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional; sin él se usa gzip
+    zstandard = None
+
+# Fecha al inicio de las líneas de todos los logs rotados ("2024-05-02 01:00:00 [...]"
+# o, en las líneas JSON de registro_estructurado.py, '{"ts":"2024-05-02T01:00:00.000",...')
+LINE_DATE = re.compile(rb'^(?:\{"ts":")?(\d{4}-\d{2}-\d{2})[ T]')
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+INDEX_FIELDS = ['log', 'segmento', 'desde', 'hasta', 'lineas', 'bytes']
+
+
+def _open_compressed(path: str, mode: str, level: int = 6):
+    """Abre un segmento según su extensión"""
+    if path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError(f"Se requiere el módulo zstandard para leer {path}")
+        if 'w' in mode:
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=level))
+        return zstandard.open(path, mode)
+    if 'w' in mode:
+        return gzip.open(path, mode, compresslevel=level)
+    return gzip.open(path, mode)
+
+
+@dataclass
+class Segment:
+    """Segmento cerrado de un log"""
+    log: str
+    path: str
+    first_day: str
+    last_day: str
+    lines: int
+    size: int
+
+
+class SegmentIndex:
+    """Índice CSV de los segmentos de todos los logs rotados"""
+
+    def __init__(self, index_file: Optional[str] = None):
+        self.index_file = Path(index_file or get_path('log_segment_index'))
+        self.lock_file = self.index_file.with_name(self.index_file.name + '.lock')
+
+    def lock(self):
+        """Bloqueo exclusivo entre procesos que rotan"""
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.lock_file, 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def segments(self, log: str) -> List[Segment]:
+        """Segmentos de un log que aún existen, en orden de creación"""
+        if not self.index_file.exists():
+            return []
+        with open(self.index_file, 'r', encoding='utf-8', newline='') as f:
+            rows = [row for row in csv.DictReader(f) if row['log'] == log]
+        return [
+            Segment(row['log'], str(self.index_file.parent / row['segmento']), row['desde'], row['hasta'],
+                    int(row['lineas']), int(row['bytes']))
+            for row in rows if (self.index_file.parent / row['segmento']).exists()
+        ]
+
+    def add(self, segment: Segment):
+        """Anexa un segmento (llamar con el bloqueo tomado)"""
+        new_file = not self.index_file.exists()
+        with open(self.index_file, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(INDEX_FIELDS)
+            writer.writerow([segment.log, os.path.basename(segment.path), segment.first_day,
+                             segment.last_day, segment.lines, segment.size])
+
+
+class SegmentedLog:
+    """Un log vivo y sus segmentos comprimidos"""
+
+    def __init__(self, path: str, config: Dict = LOG_ROTATION_CONFIG, index: Optional[SegmentIndex] = None):
+        self.path = Path(path)
+        # enviador.log y enviador.jsonl comparten stem: el índice los distingue por nombre
+        self.name = self.path.stem if self.path.suffix == '.log' else f"{self.path.stem}_{self.path.suffix.lstrip('.')}"
+        self.max_bytes = int(config.get('max_bytes', 0))
+        self.level = int(config.get('level', 6))
+        compression = config.get('compression', 'gzip')
+        if compression == 'zstd' and zstandard is None:
+            compression = 'gzip'
+        self.extension = EXTENSIONS[compression]
+        self.index = index or SegmentIndex()
+
+    def _first_day(self) -> Optional[str]:
+        """Día de la primera línea fechada del archivo vivo"""
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    match = LINE_DATE.match(line)
+                    if match:
+                        return match.group(1).decode()
+        except FileNotFoundError:
+            pass
+        return None
+
+    def needs_rotation(self, today: Optional[str] = None) -> bool:
+        """El archivo vivo empezó otro día o superó max_bytes"""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        first_day = self._first_day()
+        return first_day is not None and first_day < (today or datetime.date.today().isoformat())
+
+    def rotate(self, force: bool = False) -> Optional[Segment]:
+        """Cierra el contenido actual en un segmento si corresponde (o siempre con 'force')"""
+        handle = self.index.lock()
+        try:
+            # Se comprueba de nuevo con el bloqueo: otro proceso pudo rotarlo recién
+            if not self.needs_rotation() and not (force and self.path.exists() and self.path.stat().st_size):
+                return None
+            segment = self._write_segment()
+        finally:
+            handle.close()
+        ArtifactManifest().register(segment.path, 'log')
+        return segment
+
+    def _write_segment(self) -> Segment:
+        today = datetime.date.today().isoformat()
+        first_day = self._first_day() or today
+        segment_dir = self.index.index_file.parent
+        existing = {os.path.basename(s.path) for s in self.index.segments(self.name)}
+        number = 0
+        while True:
+            name = f"{self.name}_{first_day}_{number:03d}{self.path.suffix}{self.extension}"
+            if name not in existing and not (segment_dir / name).exists():
+                break
+            number += 1
+        segment_path = str(segment_dir / name)
+
+        with open(self.path, 'r+b') as live:
+            last_day = first_day
+            lines = 0
+            size = 0
+            with _open_compressed(segment_path, 'wb', self.level) as out:
+                # Lo anexado mientras se comprime también entra al segmento: se
+                # lee hasta el final y se trunca en cuanto una lectura vuelve vacía
+                partial = b''
+                while True:
+                    chunk = live.read(1 << 20)
+                    if not chunk:
+                        live.truncate(0)
+                        break
+                    size += len(chunk)
+                    out.write(chunk)
+                    *complete, partial = (partial + chunk).split(b'\n')
+                    lines += len(complete)
+                    for line in complete:
+                        match = LINE_DATE.match(line)
+                        if match:
+                            last_day = max(last_day, match.group(1).decode())
+                if partial:
+                    lines += 1
+                    match = LINE_DATE.match(partial)
+                    if match:
+                        last_day = max(last_day, match.group(1).decode())
+
+        segment = Segment(self.name, segment_path, first_day, last_day, lines, size)
+        self.index.add(segment)
+        return segment
+
+    def lines(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[str]:
+        """Líneas de los días [since, until] (AAAA-MM-DD) abriendo solo los segmentos necesarios
+
+        Las líneas sin fecha (continuaciones, salida de comandos) toman la de
+        la línea fechada anterior.
+        """
+        sources = [
+            (_open_compressed, segment.path, segment.first_day) for segment in self.index.segments(self.name)
+            if (since is None or segment.last_day >= since) and (until is None or segment.first_day <= until)
+        ]
+        if self.path.exists():
+            sources.append((open, str(self.path), self._first_day() or ''))
+
+        for opener, source, day in sources:
+            with opener(source, 'rb') as f:
+                for line in f:
+                    match = LINE_DATE.match(line)
+                    if match:
+                        day = match.group(1).decode()
+                    if (since is not None and day and day < since) or (until is not None and day > until):
+                        continue
+                    yield line.decode('utf-8', errors='replace')
+
+
+class SegmentedFileHandler(logging.FileHandler):
+    """FileHandler que rota su archivo cuando cambia el día o supera max_bytes
+
+    Para procesos de larga duración (enviador.py --demonio); el archivo se
+    copia y trunca, así que el stream abierto sigue siendo válido.
+    """
+
+    def __init__(self, filename: str, config: Dict = LOG_ROTATION_CONFIG):
+        super().__init__(filename, encoding='utf-8')
+        self.segmented = SegmentedLog(filename, config)
+        self._day = datetime.date.today().isoformat()
+
+    def emit(self, record: logging.LogRecord):
+        day = datetime.date.fromtimestamp(record.created).isoformat()
+        over_size = (self.segmented.max_bytes and self.stream is not None
+                     and self.stream.tell() >= self.segmented.max_bytes)
+        if day != self._day or over_size:
+            self._day = day
+            try:
+                if self.stream is not None:
+                    self.stream.flush()
+                self.segmented.rotate()
+            except Exception:
+                self.handleError(record)
+        super().emit(record)
+
+
+def configured_logs(config: Dict = LOG_ROTATION_CONFIG) -> Dict[str, SegmentedLog]:
+    """Logs rotados según LOG_ROTATION_CONFIG['logs'] (claves de FILES)"""
+    return {key: SegmentedLog(str(get_path(key)), config) for key in config.get('logs', [])}
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    logs = configured_logs()
+
+    if '--leer' in args:
+        key = args[args.index('--leer') + 1]
+        if key not in logs:
+            print(f"Error: log desconocido: {key} (use {', '.join(logs)})")
+            sys.exit(1)
+        since = args[args.index('--desde') + 1] if '--desde' in args else None
+        until = args[args.index('--hasta') + 1] if '--hasta' in args else None
+        for line in logs[key].lines(since, until):
+            sys.stdout.write(line)
+        return
+
+    force = '--forzar' in args
+    for key, log in logs.items():
+        segment = log.rotate(force)
+        if segment is not None:
+            print(f"{key}: {segment.lines} líneas ({segment.first_day} a {segment.last_day}) -> "
+                  f"{os.path.relpath(segment.path, BASE_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
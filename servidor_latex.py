@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor de Compilación LaTeX
+Mantiene procesos pdflatex "calientes" (formato, paquetes y fuentes ya cargados)
+que leen trabajos por stdin. Cada trabajo es el cuerpo de una factura; al cerrar
+el proceso su PDF se separa en los factura_<id>.pdf individuales
+
+Lo usa generador_facturas.py --servidor
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config_paths import LATEX_SERVER_CONFIG, get_path
+from generador_facturas import PAGE_MARKER, InvoiceRecord, InvoiceTemplate, PdfSplitter
+from presupuesto_ejecucion import RunBudget
+from retencion import ArtifactManifest
+
+
+DONE_MARKER = 'FACTURA-LISTO'
+END_COMMAND = 'FIN'
+
+# Bucle TeX: lee un id por stdin, inserta su cuerpo en una página nueva y avisa al terminar
+DRIVER_LOOP = r"""
+\makeatletter
+\def\factura@fin{%(end)s}
+\def\factura@siguiente{%%
+  \begingroup\endlinechar=-1 \global\read-1 to \factura@job\endgroup
+  \ifx\factura@job\factura@fin
+    \let\factura@next\relax
+  \else
+    \clearpage\setcounter{page}{1}%%
+    \typeout{%(page)s:\factura@job:\the\numexpr\value{abspage}+1\relax}%%
+    \input{%(jobs)s/\factura@job.tex}%%
+    \clearpage
+    \typeout{%(done)s:\factura@job}%%
+    \let\factura@next\factura@siguiente
+  \fi
+  \factura@next}
+\makeatother
+\csname factura@siguiente\endcsname
+\end{document}
+"""
+
+
+@dataclass
+class CompileResult:
+    """Resultado de compilar una factura en el servidor"""
+    invoice_id: str
+    success: bool
+    pdf_path: Optional[str] = None
+    errors: List[str] = field(default_factory=list)
+
+
+class TexWorker:
+    """Proceso pdflatex con el preámbulo precargado que atiende trabajos desde stdin"""
+
+    def __init__(self, server: 'LatexCompileServer', name: str):
+        self.server = server
+        self.name = name
+        self.log_file = str(server.log_dir / f"servidor_latex_{name}.log")
+        self.jobs: Dict[str, str] = {}          # id -> PDF destino, en orden de envío
+        self.discarded: List[str] = []
+        self._lines: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._process: Optional[subprocess.Popen] = None
+
+    def start(self):
+        """Arranca pdflatex; la carga del preámbulo ocurre mientras no hay trabajos"""
+        env = dict(os.environ, max_print_line='10000')
+        self._process = subprocess.Popen(
+            ['pdflatex', '-interaction=scrollmode', f'-jobname={self.name}',
+             f'-output-directory={self.server.out_dir}', str(self.server.driver_file)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding='utf-8', errors='replace', env=env
+        )
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        """Copia la salida del proceso al log y a la cola de líneas"""
+        with open(self.log_file, 'w', encoding='utf-8') as log:
+            for line in self._process.stdout:
+                log.write(line)
+                self._lines.put(line.rstrip('\n'))
+        self._lines.put(None)
+
+    def run_job(self, record: InvoiceRecord, target: str) -> Tuple[str, List[str]]:
+        """Envía una factura y espera su aviso de fin
+
+        Devuelve ('ok' | 'error' | 'timeout' | 'muerto', líneas con "!").
+        """
+        job_file = self.server.jobs_dir / f"{record.invoice_id}.tex"
+        job_file.write_text(self.server.template.render_page(record), encoding='utf-8')
+        self.jobs[record.invoice_id] = target
+
+        try:
+            self._process.stdin.write(record.invoice_id + "\n")
+            self._process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            return 'muerto', []
+
+        done = f"{DONE_MARKER}:{record.invoice_id}"
+        deadline = time.monotonic() + self.server.job_timeout
+        errors: List[str] = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 'timeout', errors
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                return 'timeout', errors
+            if line is None:
+                return 'muerto', errors
+            if '!' in line:
+                errors.append(line)
+            if line.strip() == done:
+                job_file.unlink()
+                return ('error' if errors else 'ok'), errors
+
+    def discard(self, invoice_id: str):
+        """Excluye un trabajo fallido del PDF final del proceso"""
+        self.discarded.append(invoice_id)
+
+    def kill(self) -> List[str]:
+        """Termina el proceso y devuelve los trabajos que quedaron sin PDF"""
+        if self._process and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        return [i for i in self.jobs if i not in self.discarded]
+
+    def finish(self) -> Dict[str, CompileResult]:
+        """Cierra el documento, espera a pdflatex y separa el PDF por factura"""
+        results: Dict[str, CompileResult] = {}
+        try:
+            self._process.stdin.write(END_COMMAND + "\n")
+            self._process.stdin.close()
+            self._process.wait(timeout=self.server.job_timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        except (BrokenPipeError, OSError):
+            pass
+
+        while self._lines.get() is not None:
+            pass
+
+        pending = [i for i in self.jobs if i not in self.discarded]
+        pdf_file = str(self.server.out_dir / f"{self.name}.pdf")
+        if pending and os.path.exists(pdf_file):
+            try:
+                splitter = self.server.splitter
+                ranges = splitter.page_ranges(self.log_file, list(self.jobs), splitter.page_count(pdf_file))
+                ranges = {i: r for i, r in ranges.items() if i in pending}
+                splitter.split(pdf_file, ranges, {i: self.jobs[i] for i in ranges})
+                for invoice_id in ranges:
+                    results[invoice_id] = CompileResult(invoice_id, True, self.jobs[invoice_id])
+            except (OSError, subprocess.CalledProcessError, ValueError) as e:
+                for invoice_id in pending:
+                    results[invoice_id] = CompileResult(invoice_id, False, errors=[f"Error separando PDF: {e}"])
+
+        for invoice_id in pending:
+            results.setdefault(invoice_id, CompileResult(
+                invoice_id, False, errors=["pdflatex terminó sin generar el PDF"]))
+
+        for leftover in Path(self.server.out_dir).glob(f"{self.name}.*"):
+            leftover.unlink()
+        return results
+
+
+class LatexCompileServer:
+    """Reparte facturas entre procesos pdflatex calientes y los recicla cada N trabajos"""
+
+    def __init__(self, template: InvoiceTemplate, work_dir: Optional[str] = None,
+                 config: Dict = LATEX_SERVER_CONFIG):
+        self.template = template
+        self.workers = max(1, int(config.get('workers', 1)))
+        self.recycle_after = max(1, int(config.get('recycle_after', 50)))
+        self.job_timeout = float(config.get('job_timeout', 60))
+
+        base = Path(work_dir) if work_dir else get_path('temp') / 'latex'
+        self.jobs_dir = (base / 'servidor_trabajos').absolute()
+        self.out_dir = (base / 'servidor_salida').absolute()
+        self.log_dir = get_path('logs')
+        self.driver_file = base.absolute() / 'servidor_driver.tex'
+        self.splitter = PdfSplitter()
+        self.manifest = ArtifactManifest()
+
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._records: Dict[str, InvoiceRecord] = {}
+        self._attempts: Dict[str, int] = {}
+
+    def _write_driver(self):
+        """Documento base: preámbulo común y bucle de lectura de trabajos"""
+        for directory in (self.jobs_dir, self.out_dir, self.log_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        loop = DRIVER_LOOP % {'end': END_COMMAND, 'page': PAGE_MARKER, 'done': DONE_MARKER,
+                              'jobs': self.jobs_dir.as_posix()}
+        self.driver_file.write_text(self.template.batch_preamble() + loop, encoding='utf-8')
+
+    def _new_worker(self, slot: int) -> TexWorker:
+        with self._lock:
+            self._generation += 1
+            name = f"trabajador_{slot}_{self._generation}"
+        worker = TexWorker(self, name)
+        worker.start()
+        return worker
+
+    def _serve(self, slot: int, jobs: 'queue.Queue', results: Dict[str, CompileResult], budget: RunBudget):
+        """Bucle de un hilo: alimenta a su proceso y lo recicla cuando corresponde"""
+        worker: Optional[TexWorker] = None
+        completed = 0
+
+        def close_worker():
+            nonlocal worker, completed
+            if worker is not None:
+                results.update(worker.finish())
+                self.manifest.register(worker.log_file, 'log')
+            worker, completed = None, 0
+
+        while budget.allows():
+            try:
+                record, target = jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            if worker is None:
+                worker = self._new_worker(slot)
+
+            status, errors = worker.run_job(record, target)
+            budget.record()
+
+            if status == 'ok':
+                completed += 1
+                if completed >= self.recycle_after:
+                    close_worker()
+            elif status == 'error':
+                # Un error puede dejar a TeX en un estado inconsistente: se recicla el proceso
+                worker.discard(record.invoice_id)
+                results[record.invoice_id] = CompileResult(record.invoice_id, False, errors=errors[:5])
+                close_worker()
+            else:
+                message = "Tiempo de compilación agotado" if status == 'timeout' else "pdflatex terminó inesperadamente"
+                results[record.invoice_id] = CompileResult(record.invoice_id, False, errors=errors[:5] + [message])
+                worker.discard(record.invoice_id)
+                # Los trabajos ya compilados en este proceso se pierden con él: se reintentan una vez
+                for lost_id in worker.kill():
+                    with self._lock:
+                        retry = self._attempts.get(lost_id, 0) == 0
+                        self._attempts[lost_id] = 1
+                    if retry:
+                        jobs.put((self._records[lost_id], worker.jobs[lost_id]))
+                    else:
+                        results[lost_id] = CompileResult(lost_id, False, errors=[message])
+                self.manifest.register(worker.log_file, 'log')
+                worker, completed = None, 0
+
+        close_worker()
+
+    def compile_many(self, records: List[InvoiceRecord], output_dir: str,
+                     budget: Optional[RunBudget] = None) -> Dict[str, CompileResult]:
+        """Compila las facturas y devuelve el resultado por id
+
+        Las que no se alcanzan a tomar dentro del presupuesto quedan sin resultado.
+        """
+        budget = budget or RunBudget(None)
+        self._write_driver()
+        self._records = {record.invoice_id: record for record in records}
+        self._attempts = {}
+
+        jobs: 'queue.Queue' = queue.Queue()
+        for record in records:
+            jobs.put((record, os.path.join(output_dir, f"factura_{record.invoice_id}.pdf")))
+
+        results: Dict[str, CompileResult] = {}
+        threads = [
+            threading.Thread(target=self._serve, args=(slot, jobs, results, budget))
+            for slot in range(min(self.workers, len(records)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
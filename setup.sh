@@ -144,7 +144,7 @@ install_python() {
 install_python_modules() {
     show_progress 4 8 "Instalando módulos Python"
     
-    modules=("faker")
+    modules=("faker" "pypdf")  # pypdf: separar páginas en el modo por lotes
     
     for module in "${modules[@]}"; do
         if python3 -c "import $module" 2>/dev/null; then
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gestión de Usuarios Temporales y Regulares (Linux)
+Versión Python de usuarios_completo.ps1 para equipos Linux. Lee
+datos/empleados.csv y las cuentas existentes (etc/passwd y etc/shadow) una sola
+vez, calcula la diferencia y la aplica en lote:
+
+  - cuentas nuevas: una sola ejecución de newusers
+  - cuentas del sistema bloqueadas que vuelven al CSV: una ejecución de chpasswd
+  - temporales vencidas (inicio + temp_users_days) o fuera del CSV: se
+    bloquean con una ejecución de chpasswd -e
+  - departamentos administrativos: una ejecución de gpasswd -M
+
+Las cuentas del sistema se reconocen por el campo GECOS ("Empleado temporal -
+Departamento" o "Empleado regular - Departamento"); las demás no se tocan.
+Con --archivos los mismos lotes se aplican editando passwd/shadow/group bajo
+--raiz, lo que permite probar con una raíz de prueba sin privilegios
+
+Uso: python3 usuarios_temporales.py [--csv archivo] [--raiz DIR] [--archivos] [--simular]
+"""
+
+import csv
+import datetime
+import fcntl
+import os
+import re
+import secrets
+import string
+import subprocess
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from config_paths import CLEANUP_CONFIG, USER_PROVISION_CONFIG, get_path
+from generador_facturas import log_message
+from retencion import ArtifactManifest
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import crypt
+except ImportError:  # crypt ya no existe desde Python 3.13; solo lo usa el modo --archivos
+    crypt = None
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+REGULAR_CONTRACTS = {'permanente', 'indefinido', 'fijo'}
+GECOS_MARKER = 'Empleado '
+
+
+@dataclass
+class Employee:
+    """Empleado del CSV con su cuenta deseada"""
+    username: str
+    full_name: str
+    email: str
+    department: str
+    user_type: str                      # 'temporal' o 'regular'
+    start: Optional[datetime.date]
+    is_admin: bool
+    password: str = ''
+
+    @property
+    def gecos(self) -> str:
+        """Nombre y descripción (sin ':' ni ',' que separan campos)"""
+        clean = lambda value: re.sub(r'[:,\n]', ' ', value).strip()
+        return f"{clean(self.full_name)},,,,{GECOS_MARKER}{self.user_type} - {clean(self.department)}"
+
+
+@dataclass
+class Account:
+    """Cuenta existente según passwd y shadow"""
+    name: str
+    uid: int
+    gecos: str
+    password_hash: str = ''
+
+    @property
+    def managed_type(self) -> Optional[str]:
+        """'temporal' o 'regular' si la creó este sistema"""
+        description = self.gecos.split(',')[-1]
+        if not description.startswith(GECOS_MARKER):
+            return None
+        return description[len(GECOS_MARKER):].split(' ', 1)[0]
+
+    @property
+    def locked(self) -> bool:
+        return self.password_hash.startswith(('!', '*'))
+
+
+@dataclass
+class ProvisionPlan:
+    """Diferencia entre el CSV y las cuentas existentes"""
+    create: List[Employee] = field(default_factory=list)
+    reactivate: List[Employee] = field(default_factory=list)
+    expire: List[Account] = field(default_factory=list)
+    admins: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    invalid: int = 0
+    conflicts: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        return (f"{len(self.create)} nuevas, {len(self.reactivate)} reactivadas, {len(self.expire)} vencidas, "
+                f"{self.unchanged} sin cambios, {self.invalid} inválidas, {len(self.conflicts)} en conflicto")
+
+
+def username_for(email: str, max_length: int) -> str:
+    """Nombre de usuario desde el correo, como usuarios_completo.ps1 (en minúsculas para Linux)"""
+    username = re.sub(r'[^a-z0-9]', '', email.split('@')[0].lower())[:max_length]
+    if username and not username[0].isalpha():
+        username = ('u' + username)[:max_length]
+    return username
+
+
+def new_password(length: int) -> str:
+    """Contraseña con al menos una minúscula, mayúscula, número y símbolo"""
+    pools = [string.ascii_lowercase, string.ascii_uppercase, string.digits, '!@#$%^&*']
+    chars = [secrets.choice(pool) for pool in pools]
+    chars += [secrets.choice(''.join(pools)) for _ in range(length - len(chars))]
+    secrets.SystemRandom().shuffle(chars)
+    return ''.join(chars)
+
+
+class UserProvisioner:
+    """Calcula y aplica en lote la diferencia entre empleados.csv y las cuentas del equipo"""
+
+    def __init__(self, root: Optional[str] = None, use_files: Optional[bool] = None,
+                 config: Dict = USER_PROVISION_CONFIG):
+        self.root = Path(root or config.get('root', '/'))
+        self.use_files = config.get('backend') == 'archivos' if use_files is None else use_files
+        self.config = config
+        self.temp_days = int(CLEANUP_CONFIG.get('temp_users_days', 30))
+
+    def _etc(self, name: str) -> Path:
+        return self.root / 'etc' / name
+
+    # --- Lectura ---------------------------------------------------------
+
+    def read_employees(self, csv_file: str) -> Tuple[List[Employee], int]:
+        """Empleados válidos del CSV (sin usuarios repetidos) y cantidad de filas inválidas"""
+        employees: Dict[str, Employee] = {}
+        invalid = 0
+        admin_departments = set(self.config.get('admin_departments', []))
+        max_length = int(self.config.get('username_max_length', 20))
+
+        with open(csv_file, 'r', encoding='utf-8-sig', newline='') as f:
+            for line_num, row in enumerate(csv.DictReader(f), 2):
+                full_name = (row.get('nombre_completo') or '').strip()
+                email = (row.get('correo') or '').strip()
+                if not full_name or not email or not EMAIL_PATTERN.match(email):
+                    log_message("ERROR", f"Empleado inválido en línea {line_num}: {full_name or '?'} <{email}>")
+                    invalid += 1
+                    continue
+                username = username_for(email, max_length)
+                if not username or username in employees:
+                    log_message("ERROR", f"Usuario repetido o vacío en línea {line_num}: {email}")
+                    invalid += 1
+                    continue
+
+                user_type = (row.get('tipo_usuario') or '').strip().lower()
+                if not user_type:
+                    user_type = 'regular' if (row.get('tipo_contrato') or '').strip().lower() in REGULAR_CONTRACTS else 'temporal'
+                try:
+                    start = datetime.date.fromisoformat((row.get('fecha_inicio') or '').strip())
+                except ValueError:
+                    start = None
+                department = (row.get('departamento') or '').strip()
+                employees[username] = Employee(username, full_name, email, department, user_type, start,
+                                               department in admin_departments)
+        return list(employees.values()), invalid
+
+    def read_accounts(self) -> Dict[str, Account]:
+        """Cuentas de passwd con su hash de shadow, en una pasada por archivo"""
+        accounts: Dict[str, Account] = {}
+        with open(self._etc('passwd'), 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split(':')
+                if len(parts) >= 7:
+                    accounts[parts[0]] = Account(parts[0], int(parts[2]) if parts[2].isdigit() else -1, parts[4])
+        shadow = self._etc('shadow')
+        if shadow.exists():
+            with open(shadow, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split(':')
+                    if len(parts) >= 2 and parts[0] in accounts:
+                        accounts[parts[0]].password_hash = parts[1]
+        return accounts
+
+    def group_members(self, group: str) -> Optional[List[str]]:
+        """Miembros de un grupo o None si no existe"""
+        with open(self._etc('group'), 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split(':')
+                if len(parts) >= 4 and parts[0] == group:
+                    return [member for member in parts[3].split(',') if member]
+        return None
+
+    # --- Diferencia ------------------------------------------------------
+
+    def expired(self, employee: Employee, today: datetime.date) -> bool:
+        return (employee.user_type == 'temporal' and employee.start is not None
+                and employee.start + datetime.timedelta(days=self.temp_days) < today)
+
+    def plan(self, employees: List[Employee], accounts: Dict[str, Account],
+             today: Optional[datetime.date] = None) -> ProvisionPlan:
+        """Diferencia en una pasada: qué crear, reactivar y bloquear"""
+        today = today or datetime.date.today()
+        plan = ProvisionPlan()
+        wanted: Set[str] = set()
+        password_length = int(self.config.get('password_length', 12))
+
+        for employee in employees:
+            if self.expired(employee, today):
+                continue
+            account = accounts.get(employee.username)
+            if account is not None and account.managed_type is None:
+                plan.conflicts.append(employee.username)
+                continue
+            wanted.add(employee.username)
+            if employee.is_admin:
+                plan.admins.append(employee.username)
+            if account is None:
+                employee.password = new_password(password_length)
+                plan.create.append(employee)
+            elif account.locked:
+                employee.password = new_password(password_length)
+                plan.reactivate.append(employee)
+            else:
+                plan.unchanged += 1
+
+        plan.expire = [
+            account for account in accounts.values()
+            if account.managed_type == 'temporal' and not account.locked and account.name not in wanted
+        ]
+        return plan
+
+    # --- Aplicación ------------------------------------------------------
+
+    def _newusers_lines(self, employees: List[Employee]) -> List[str]:
+        group, shell = self.config.get('group', 'empleados'), self.config.get('shell', '/bin/bash')
+        home = self.config.get('home', '/home').rstrip('/')
+        return [f"{e.username}:{e.password}::{group}:{e.gecos}:{home}/{e.username}:{shell}" for e in employees]
+
+    def _run(self, command: List[str], lines: List[str]):
+        if str(self.root) != '/':
+            command = [command[0], '--root', str(self.root)] + command[1:]
+        subprocess.run(command, input=''.join(line + '\n' for line in lines), text=True,
+                       check=True, capture_output=True)
+
+    def apply(self, plan: ProvisionPlan):
+        """Aplica el plan con un lote por herramienta"""
+        admin_group = self.config.get('admin_group', '')
+        members = self.group_members(admin_group) if admin_group and plan.admins else None
+        if admin_group and plan.admins and members is None:
+            log_message("WARNING", f"Grupo administrativo {admin_group} no existe; no se agregan miembros")
+
+        if self.use_files:
+            AccountFiles(self.root, self.config).apply(plan, admin_group if members is not None else '')
+            return
+
+        if plan.create:
+            self._run(['newusers'], self._newusers_lines(plan.create))
+        if plan.reactivate:
+            self._run(['chpasswd'], [f"{e.username}:{e.password}" for e in plan.reactivate])
+        if plan.expire:
+            self._run(['chpasswd', '-e'], [f"{a.name}:!" for a in plan.expire])
+        if members is not None:
+            missing = [name for name in plan.admins if name not in members]
+            if missing:
+                self._run(['gpasswd', '-M', ','.join(members + missing), admin_group], [])
+
+    def write_report(self, plan: ProvisionPlan) -> str:
+        """Reporte con las contraseñas nuevas, legible solo por el dueño"""
+        reports_dir = get_path('reports')
+        reports_dir.mkdir(parents=True, exist_ok=True)
+        report_file = reports_dir / f"reporte_usuarios_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        fd = os.open(report_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['nombre_completo', 'usuario', 'correo', 'departamento', 'tipo_usuario',
+                             'contrasena', 'es_admin', 'estado'])
+            for state, employees in (('Creado', plan.create), ('Reactivado', plan.reactivate)):
+                for e in employees:
+                    writer.writerow([e.full_name, e.username, e.email, e.department, e.user_type,
+                                     e.password, e.is_admin, state])
+            for account in plan.expire:
+                writer.writerow([account.gecos.split(',')[0], account.name, '', '', 'temporal', '', '', 'Bloqueado'])
+        ArtifactManifest().register(str(report_file), 'report')
+        return str(report_file)
+
+
+def hash_password(password: str) -> str:
+    return crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512))
+
+
+class AccountFiles:
+    """Aplica los lotes editando passwd, shadow y group bajo una raíz
+
+    Equivale a newusers/chpasswd/gpasswd para raíces de prueba o equipos sin
+    shadow-utils: cada archivo se reescribe una sola vez, de forma atómica y
+    con el bloqueo etc/.pwd.lock que usan esas herramientas.
+    """
+
+    def __init__(self, root: Path, config: Dict = USER_PROVISION_CONFIG):
+        self.root = root
+        self.config = config
+        self.uid_min = int(config.get('uid_min', 1000))
+
+    def _read(self, name: str) -> List[List[str]]:
+        path = self.root / 'etc' / name
+        if not path.exists():
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n').split(':') for line in f if line.strip()]
+
+    def _write(self, name: str, rows: List[List[str]], mode: int):
+        path = self.root / 'etc' / name
+        tmp_path = path.with_name(name + '+')
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(':'.join(row) + '\n' for row in rows)
+        os.replace(tmp_path, path)
+
+    def _next_id(self, rows: List[List[str]], column: int) -> int:
+        used = [int(row[column]) for row in rows if len(row) > column and row[column].isdigit()]
+        return max([self.uid_min - 1] + [value for value in used if value < 60000]) + 1
+
+    def _hash_many(self, passwords: List[str]) -> List[str]:
+        """Hashes SHA-512 de crypt; con muchos se reparten entre procesos (unos 3 ms cada uno)"""
+        if crypt is None:
+            raise RuntimeError("El modo --archivos requiere el módulo crypt")
+        workers = int(self.config.get('hash_workers', 0)) or os.cpu_count() or 1
+        if workers == 1 or len(passwords) < 200:
+            return [hash_password(password) for password in passwords]
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(hash_password, passwords, chunksize=64))
+
+    def apply(self, plan: ProvisionPlan, admin_group: str = ''):
+        lock = open(self.root / 'etc' / '.pwd.lock', 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            passwd, shadow, groups = self._read('passwd'), self._read('shadow'), self._read('group')
+            today = str((datetime.date.today() - datetime.date(1970, 1, 1)).days)
+
+            group_name = self.config.get('group', 'empleados')
+            group = next((row for row in groups if row[0] == group_name), None)
+            if group is None and plan.create:
+                group = [group_name, 'x', str(self._next_id(groups, 2)), '']
+                groups.append(group)
+
+            hashes = self._hash_many([e.password for e in plan.create + plan.reactivate])
+            home, shell = self.config.get('home', '/home').rstrip('/'), self.config.get('shell', '/bin/bash')
+            uid = self._next_id(passwd, 2)
+            for employee, password_hash in zip(plan.create, hashes):
+                passwd.append([employee.username, 'x', str(uid), group[2], employee.gecos,
+                               f"{home}/{employee.username}", shell])
+                shadow.append([employee.username, password_hash, today, '0', '99999', '7', '', '', ''])
+                (self.root / home.lstrip('/') / employee.username).mkdir(mode=0o700, parents=True, exist_ok=True)
+                uid += 1
+
+            new_hashes = {e.username: h for e, h in zip(plan.reactivate, hashes[len(plan.create):])}
+            new_hashes.update({account.name: '!' for account in plan.expire})
+            for row in shadow:
+                if row[0] in new_hashes:
+                    row[1], row[2] = new_hashes[row[0]], today
+
+            if admin_group:
+                for row in groups:
+                    if row[0] == admin_group:
+                        members = [member for member in row[3].split(',') if member]
+                        row[3] = ','.join(members + [name for name in plan.admins if name not in members])
+
+            self._write('passwd', passwd, 0o644)
+            self._write('shadow', shadow, 0o640)
+            self._write('group', groups, 0o644)
+        finally:
+            lock.close()
+
+
+def main():
+    """Función principal"""
+    args = sys.argv[1:]
+    csv_file = args[args.index('--csv') + 1] if '--csv' in args else str(get_path('data') / 'empleados.csv')
+    root = args[args.index('--raiz') + 1] if '--raiz' in args else None
+    provisioner = UserProvisioner(root, True if '--archivos' in args else None)
+
+    log_message("INFO", "=== INICIO DE GESTIÓN DE USUARIOS ===")
+    if not os.path.exists(csv_file):
+        log_message("ERROR", f"Archivo CSV no encontrado: {csv_file}")
+        sys.exit(1)
+    if not provisioner.use_files and os.geteuid() != 0:
+        log_message("ERROR", "Este script requiere privilegios de administrador (o use --archivos con --raiz)")
+        sys.exit(1)
+    if provisioner.use_files and crypt is None and '--simular' not in args:
+        # Sin hashes las cuentas quedarían bloqueadas y el reporte daría contraseñas que no sirven
+        log_message("ERROR", "El modo --archivos requiere el módulo crypt (no disponible desde Python 3.13)")
+        sys.exit(1)
+
+    employees, invalid = provisioner.read_employees(csv_file)
+    plan = provisioner.plan(employees, provisioner.read_accounts())
+    plan.invalid = invalid
+    for username in plan.conflicts:
+        log_message("WARNING", f"La cuenta {username} ya existe y no es de este sistema; no se modifica")
+    log_message("INFO", f"Empleados en CSV: {len(employees)}; cambios: {plan.summary()}")
+
+    if '--simular' in args:
+        log_message("INFO", "Modo simulación: no se realizan cambios")
+    else:
+        try:
+            provisioner.apply(plan)
+        except subprocess.CalledProcessError as e:
+            log_message("ERROR", f"Error en {e.cmd[0]}: {(e.stderr or '').strip()}")
+            sys.exit(1)
+        if plan.create or plan.reactivate or plan.expire:
+            log_message("INFO", f"Reporte generado: {provisioner.write_report(plan)}")
+
+    log_message("INFO", "=== FIN DE GESTIÓN DE USUARIOS ===")
+    sys.exit(0 if invalid == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()